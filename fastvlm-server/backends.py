@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Бэкенды инференса: загрузка модели и Runner для движка батчинга (см. model_runner.Runner)
+- fastvlm - FastVLM (llava) из ../ml-fastvlm, чекпоинт Config.MODEL_PATH
+- stub - детерминированная заглушка без весов с настраиваемыми задержками (stub_backend.py)
+"""
+
+import os
+import sys
+import logging
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('fastvlm', 'stub')
+
+
+def load_backend(name=None):
+    """Загружает бэкенд по имени (по умолчанию Config.BACKEND) и возвращает Runner"""
+    name = name or Config.BACKEND
+    if name == 'fastvlm':
+        return load_fastvlm()
+    if name == 'stub':
+        return load_stub()
+    raise ValueError(f"Неизвестный бэкенд: {name} (доступны: {', '.join(BACKENDS)})")
+
+
+def load_fastvlm():
+    """FastVLM через llava: токенизатор, модель, препроцессор изображений"""
+    if not os.path.exists(Config.MODEL_PATH):
+        raise FileNotFoundError(f"Модель не найдена: {Config.MODEL_PATH}")
+
+    sys.path.append('../ml-fastvlm')
+    from llava.utils import disable_torch_init
+    from llava.model.builder import load_pretrained_model
+    from llava.mm_utils import get_model_name_from_path
+    from model_runner import FastVLMRunner
+
+    disable_torch_init()
+    model_name = get_model_name_from_path(Config.MODEL_PATH)
+    # safetensors читаются через mmap (страницы весов подгружаются по мере копирования на устройство),
+    # .bin - целиком через pickle; builder уже передает low_cpu_mem_usage=True
+    kwargs = {}
+    if any(name.endswith('.safetensors') for name in os.listdir(Config.MODEL_PATH)):
+        kwargs['use_safetensors'] = True
+    else:
+        logger.warning(
+            f"В {Config.MODEL_PATH} нет *.safetensors: веса читаются целиком, "
+            f"загрузка медленнее (сконвертируйте чекпоинт в safetensors)"
+        )
+    tokenizer, model, image_processor, context_len = load_pretrained_model(
+        Config.MODEL_PATH, None, model_name,
+        device=Config.DEVICE,
+        torch_dtype=Config.TORCH_DTYPE,
+        **kwargs
+    )
+    logger.info(f"FastVLM модель загружена: {model_name} на {Config.DEVICE}")
+    return FastVLMRunner(
+        model, tokenizer, image_processor, image_position=Config.IMAGE_POSITION,
+        name=os.path.basename(Config.MODEL_PATH), context_len=context_len
+    )
+
+
+def load_stub():
+    from stub_backend import StubRunner
+
+    logger.info(
+        f"Бэкенд-заглушка: шаг {Config.STUB_TOKEN_LATENCY_MS}ms, prefill {Config.STUB_PREFILL_LATENCY_MS}ms, "
+        f"энкодер {Config.STUB_ENCODE_LATENCY_MS}ms"
+    )
+    return StubRunner(
+        token_latency_ms=Config.STUB_TOKEN_LATENCY_MS,
+        prefill_latency_ms=Config.STUB_PREFILL_LATENCY_MS,
+        encode_latency_ms=Config.STUB_ENCODE_LATENCY_MS,
+        image_position=Config.IMAGE_POSITION
+    )
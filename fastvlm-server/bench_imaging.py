@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк загрузки изображений: старый путь /analyze против imaging.load_image
+Старый путь: полное декодирование + перекодирование во временный JPEG + convert('RGB').
+Новый: draft/reduce до масштаба входа модели, EXIF-поворот, одна конвертация в RGB.
+В обоих случаях в конце resize до входа модели, как в process_images.
+
+    python bench_imaging.py                  # синтетические фото 12 Мп
+    python bench_imaging.py photos/ -n 20    # свои фото из каталога
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+from PIL import Image, ImageOps
+
+from imaging import load_image
+
+PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def legacy_load(data, target_size):
+    image = Image.open(io.BytesIO(data))
+    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+        image.save(temp_file, 'JPEG')
+        temp_path = temp_file.name
+    os.unlink(temp_path)
+    return image.convert('RGB')
+
+
+def fast_load(data, target_size):
+    return load_image(data, target_size=target_size, max_size=2048)
+
+
+def to_model_input(image, target_size):
+    """Грубая замена process_images: квадрат target_size x target_size"""
+    return image.resize((target_size, target_size), Image.Resampling.BICUBIC)
+
+
+def synthetic_photos(count):
+    """Фото 4032x3024 с шумом (плохо сжимается, как настоящие) и EXIF-поворотом"""
+    photos = []
+    for i in range(count):
+        noise = Image.effect_noise((4032, 3024), 40 + i).convert('RGB')
+        gradient = Image.linear_gradient('L').resize((4032, 3024)).convert('RGB')
+        image = Image.blend(noise, gradient, 0.5)
+        exif = image.getexif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=90, exif=exif)
+        photos.append((f"synthetic-{i}.jpg", buffer.getvalue()))
+    return photos
+
+
+def directory_photos(path):
+    photos = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(PHOTO_EXTENSIONS):
+            with open(os.path.join(path, name), 'rb') as f:
+                photos.append((name, f.read()))
+    return photos
+
+
+def measure(load, photos, target_size, repeats):
+    timings = []
+    for _ in range(repeats):
+        for _, data in photos:
+            start = time.perf_counter()
+            to_model_input(load(data, target_size), target_size)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк декодирования изображений')
+    parser.add_argument('photos', nargs='?', help='Каталог с фото (по умолчанию - синтетические 12 Мп)')
+    parser.add_argument('-n', '--repeats', type=int, default=5, help='Повторов на каждое фото')
+    parser.add_argument('--target-size', type=int, default=1024, help='Сторона входа модели')
+    args = parser.parse_args()
+
+    photos = directory_photos(args.photos) if args.photos else synthetic_photos(3)
+    if not photos:
+        print(f"В {args.photos} нет фото ({', '.join(PHOTO_EXTENSIONS)})")
+        sys.exit(1)
+
+    total_mb = sum(len(data) for _, data in photos) / (1024 ** 2)
+    print(f"Фото: {len(photos)} ({total_mb:.1f} МБ), повторов: {args.repeats}, вход модели: {args.target_size}")
+    for name, data in photos[:5]:
+        with Image.open(io.BytesIO(data)) as image:
+            original = ImageOps.exif_transpose(image).size
+        print(f"  {name}: {original[0]}x{original[1]} -> {fast_load(data, args.target_size).size}")
+
+    results = {}
+    for label, load in (('старый путь', legacy_load), ('load_image', fast_load)):
+        load(photos[0][1], args.target_size)
+        timings = measure(load, photos, args.target_size, args.repeats)
+        results[label] = statistics.median(timings)
+        p90 = sorted(timings)[min(len(timings) - 1, int(len(timings) * 0.9))]
+        print(f"{label:>12}: медиана {results[label]:.1f} мс, p90 {p90:.1f} мс на изображение")
+
+    print(f"Ускорение: x{results['старый путь'] / results['load_image']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк /analyze/multi против N отдельных /analyze к одному изображению
+Для каждого изображения сравнивает три способа получить ответы на одни и те же промпты:
+N запросов /analyze по очереди, N одновременных запросов /analyze и один /analyze/multi.
+Кроме времени, по /stats считает работу движка: prefill-токены и закодированные изображения.
+
+    python bench_multi.py                        # синтетические фото, промпты по умолчанию
+    python bench_multi.py --images ./photos -n 5
+
+Чтобы сравнение было честным, длина ответов должна совпадать: запустите сервер
+с MAX_NEW_TOKENS, равным MULTI_MAX_NEW_TOKENS. Кэш результатов обходится (cache_bypass),
+каждое изображение используется одним способом, чтобы не попасть в кэш признаков.
+"""
+
+import sys
+import time
+import base64
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_imaging import directory_photos, synthetic_photos
+
+PROMPTS = {
+    'type': 'What clothing items are in the image? List their types briefly.',
+    'color': 'What are the main colors of the clothing items? Answer briefly.',
+    'material': 'What materials are the clothing items made of? Answer briefly.',
+    'style': 'What is the style of the outfit (casual, business, evening, sporty, etc.)? Answer briefly.'
+}
+MODES = ('sequential', 'concurrent', 'multi')
+COUNTERS = ('prefill_tokens', 'images_encoded', 'image_prefixes_shared', 'tokens_generated')
+
+
+def analyze(session, url, image_base64, prompt):
+    response = session.post(f"{url}/analyze", json={
+        'image_base64': image_base64, 'prompt': prompt, 'deterministic': True, 'cache_bypass': True
+    })
+    response.raise_for_status()
+
+
+def run_mode(mode, url, image_data):
+    """Ответы на все PROMPTS для одного изображения выбранным способом, время в мс"""
+    image_base64 = base64.b64encode(image_data).decode('ascii')
+    session = requests.Session()
+    start = time.perf_counter()
+    if mode == 'sequential':
+        for prompt in PROMPTS.values():
+            analyze(session, url, image_base64, prompt)
+    elif mode == 'concurrent':
+        with ThreadPoolExecutor(max_workers=len(PROMPTS)) as pool:
+            # Отдельная сессия на поток: requests.Session не потокобезопасна
+            futures = [pool.submit(analyze, requests.Session(), url, image_base64, prompt) for prompt in PROMPTS.values()]
+            for future in futures:
+                future.result()
+    else:
+        response = session.post(f"{url}/analyze/multi", json={
+            'image_base64': image_base64, 'prompts': PROMPTS, 'deterministic': True, 'cache_bypass': True
+        })
+        response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+def engine_counters(url):
+    stats = requests.get(f"{url}/stats", timeout=5).json()
+    return {name: stats.get(name, 0) for name in COUNTERS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк /analyze/multi против отдельных /analyze')
+    parser.add_argument('--url', default='http://127.0.0.1:3001', help='Адрес сервера')
+    parser.add_argument('--images', help='Каталог с фото (по умолчанию - синтетические фото 12 Мп)')
+    parser.add_argument('-n', '--repeats', type=int, default=3, help='Изображений на каждый способ')
+    args = parser.parse_args()
+
+    needed = args.repeats * len(MODES) + 1
+    photos = directory_photos(args.images) if args.images else synthetic_photos(needed)
+    if len(photos) < needed:
+        print(f"Нужно минимум {needed} изображений, найдено {len(photos)}")
+        sys.exit(1)
+
+    try:
+        # Прогрев на отдельном изображении: соединения, аллокатор, первые вызовы модели
+        run_mode('multi', args.url, photos[0][1])
+    except requests.RequestException as e:
+        print(f"Сервер недоступен: {e}")
+        sys.exit(1)
+
+    print(f"{len(PROMPTS)} промпта на изображение, {args.repeats} изображений на способ")
+    photos = photos[1:]
+    for index, mode in enumerate(MODES):
+        batch = photos[index * args.repeats:(index + 1) * args.repeats]
+        before = engine_counters(args.url)
+        timings = [run_mode(mode, args.url, image_data) for _, image_data in batch]
+        after = engine_counters(args.url)
+        per_image = {name: (after[name] - before[name]) / len(batch) for name in COUNTERS}
+        print(
+            f"{mode:>10}: медиана {statistics.median(timings):.0f} мс на изображение, "
+            f"prefill {per_image['prefill_tokens']:.0f} токенов, "
+            f"кодирований {per_image['images_encoded']:.1f}, "
+            f"общих префиксов {per_image['image_prefixes_shared']:.1f}, "
+            f"сгенерировано {per_image['tokens_generated']:.0f} токенов"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк TTFT: кэш префиксов промпта и положение изображения (IMAGE_POSITION)
+Движок батчинга и CausalLMRunner - те же, что у сервера; языковая модель - Qwen2
+размеров LLM FastVLM-0.5B со случайными весами (время prefill зависит от размеров,
+а не от значений весов). Энкодер изображений не входит в замер: признаки изображения
+готовы заранее, поэтому разница TTFT - это только prefill языковой модели.
+
+    python bench_prefix.py                     # промпт из prompt.md, 5 замеров на вариант
+    python bench_prefix.py --runs 10 --dtype bfloat16
+
+Длина промпта в токенах - оценка (слово или знак препинания ~ один токен BPE Qwen2):
+настоящего токенизатора без весов модели нет; точное число можно передать --prompt-tokens.
+"""
+
+import os
+import re
+import argparse
+import statistics
+
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from cache import PrefixCache
+from engine import BatchingEngine, GenerationRequest
+from model_runner import CausalLMRunner
+
+# Размеры LLM FastVLM-0.5B (Qwen2-0.5B)
+QWEN2_05B = dict(
+    vocab_size=151936, hidden_size=896, intermediate_size=4864, num_hidden_layers=24,
+    num_attention_heads=14, num_key_value_heads=2, max_position_embeddings=4096
+)
+# Шаблон qwen_2 до сообщения пользователя и после него, токенов
+SYSTEM_TOKENS = 14
+FOOTER_TOKENS = 5
+# Признаков изображения на выходе FastViTHD (1024x1024)
+IMAGE_TOKENS = 256
+POSITIONS = ('before', 'after')
+
+
+class FeatureRunner(CausalLMRunner):
+    """CausalLMRunner с готовыми признаками изображения вместо энкодера"""
+
+    def __init__(self, model, image_tokens):
+        super().__init__(model, None)
+        self.features = torch.randn(image_tokens, model.config.hidden_size, dtype=model.dtype) * 0.02
+
+    def encode_images(self, image_tensors):
+        return [self.features for _ in image_tensors]
+
+
+def estimate_prompt_tokens():
+    """Оценка длины промпта из prompt.md (основной блок ```), как его берет server.load_prompt"""
+    with open(os.path.join(os.path.dirname(__file__), 'prompt.md'), 'r', encoding='utf-8') as f:
+        content = f.read()
+    match = re.search(r'```\s*(.*?)\s*```', content, re.DOTALL)
+    prompt = match.group(1).strip() if match else content.strip()
+    return len(re.findall(r'\w+|[^\w\s]', prompt)) + prompt.count('\n')
+
+
+def build_prompt(position, prompt_tokens, vocab_size):
+    """Токены промпта как у FastVLMRunner.tokenize_prompt: шаблон, изображение и текст"""
+    generator = torch.Generator().manual_seed(0)
+    system = torch.randint(1, vocab_size, (SYSTEM_TOKENS,), generator=generator).tolist()
+    text = torch.randint(1, vocab_size, (prompt_tokens,), generator=generator).tolist()
+    footer = torch.randint(1, vocab_size, (FOOTER_TOKENS,), generator=generator).tolist()
+    newline = [198]
+    image = [CausalLMRunner.image_token_index]
+    body = image + newline + text if position == 'before' else text + newline + image
+    return system + body + footer
+
+
+def measure(runner, input_ids, prefix_cache, runs):
+    """TTFT (мс) последовательных запросов и prefill-токенов на запрос; первый запрос - прогрев"""
+    engine = BatchingEngine(runner, max_batch_size=1, max_wait_ms=0, max_queue_size=0, prefix_cache=prefix_cache)
+    engine.start()
+    if prefix_cache is not None:
+        engine.register_prefix(input_ids[:input_ids.index(runner.image_token_index)]).result()
+    ttfts = []
+    image = torch.zeros(3, 4, 4)
+    for run in range(runs + 1):
+        before = engine.stats['prefill_tokens']
+        gen_request = engine.submit(GenerationRequest(input_ids, image, max_new_tokens=1, do_sample=False))
+        gen_request.result(timeout=600)
+        if run:
+            ttfts.append(gen_request.ttft_ms())
+        prefill_tokens = engine.stats['prefill_tokens'] - before
+    engine.stop()
+    return ttfts, prefill_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TTFT с кэшем префиксов и без, IMAGE_POSITION before/after')
+    parser.add_argument('--runs', type=int, default=5, help='Замеров на вариант')
+    parser.add_argument('--prompt-tokens', type=int, help='Длина промпта в токенах (по умолчанию - оценка prompt.md)')
+    parser.add_argument('--dtype', default='float32', choices=('float32', 'bfloat16', 'float16'))
+    parser.add_argument('--threads', type=int, help='Потоков torch')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    prompt_tokens = args.prompt_tokens or estimate_prompt_tokens()
+    torch.manual_seed(0)
+    model = Qwen2ForCausalLM(Qwen2Config(**QWEN2_05B)).to(getattr(torch, args.dtype)).eval()
+    runner = FeatureRunner(model, IMAGE_TOKENS)
+
+    print(f"Qwen2 {QWEN2_05B['num_hidden_layers']} слоев, hidden {QWEN2_05B['hidden_size']}, {args.dtype}, "
+          f"{torch.get_num_threads()} потоков; промпт ~{prompt_tokens} токенов, изображение {IMAGE_TOKENS}")
+    print(f"{'IMAGE_POSITION':<16}{'кэш префиксов':<16}{'prefill токенов':>16}{'TTFT p50, мс':>14}{'min':>8}{'max':>8}")
+    with torch.inference_mode():
+        for position in POSITIONS:
+            input_ids = build_prompt(position, prompt_tokens, QWEN2_05B['vocab_size'])
+            for enabled in (False, True):
+                ttfts, prefill_tokens = measure(runner, input_ids, PrefixCache(8) if enabled else None, args.runs)
+                print(f"{position:<16}{'on' if enabled else 'off':<16}{prefill_tokens:>16}"
+                      f"{statistics.median(ttfts):>14.0f}{min(ttfts):>8.0f}{max(ttfts):>8.0f}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк форматов загрузки изображения в запущенный сервер
+json (image_base64), multipart/form-data и сырые байты image/*: задержка от отправки
+до ответа и пиковый RSS процесса сервера во время серии запросов.
+
+    python bench_upload.py                           # синтетическое фото 12 Мп, /analyze
+    python bench_upload.py --image photo.jpg -n 20
+    python bench_upload.py --endpoint encode         # только прием и декодирование изображения
+
+RSS после серии не возвращается к исходному (аллокатор держит память), поэтому для
+чистого сравнения пиков запускайте каждый формат на свежем сервере: --formats raw
+"""
+
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+import statistics
+from urllib.parse import quote
+
+import psutil
+import requests
+
+from bench_imaging import synthetic_photos
+
+FORMATS = ('json', 'multipart', 'raw')
+PROMPT = 'Опиши одежду на фото'
+
+
+def build_request(fmt, image_data):
+    """Аргументы requests.post для формата; base64 и JSON считаются частью стоимости запроса"""
+    if fmt == 'json':
+        body = json.dumps({
+            'image_base64': base64.b64encode(image_data).decode('ascii'),
+            'prompt': PROMPT,
+            'cache_bypass': True
+        })
+        return {'data': body, 'headers': {'Content-Type': 'application/json'}}
+    if fmt == 'multipart':
+        return {
+            'files': {'image': ('photo.jpg', image_data, 'image/jpeg')},
+            'data': {'prompt': PROMPT, 'cache_bypass': 'true'}
+        }
+    return {
+        'data': image_data,
+        'headers': {'Content-Type': 'image/jpeg', 'X-Prompt': quote(PROMPT), 'X-Cache-Bypass': 'true'}
+    }
+
+
+class RssSampler(threading.Thread):
+    """Опрашивает RSS процесса сервера, пока идет серия запросов"""
+
+    def __init__(self, pid, interval=0.01):
+        super().__init__(daemon=True)
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.baseline = self.process.memory_info().rss
+        self.peak = self.baseline
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_format(url, fmt, image_data, repeats, pid):
+    session = requests.Session()
+    # Прогрев: соединение, кэш признаков (для /encode) и аллокатор
+    session.post(url, **build_request(fmt, image_data)).raise_for_status()
+
+    sampler = RssSampler(pid) if pid else None
+    if sampler:
+        sampler.start()
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = session.post(url, **build_request(fmt, image_data))
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+
+    result = {
+        'format': fmt,
+        'median_ms': round(statistics.median(timings), 1),
+        'p90_ms': round(sorted(timings)[min(len(timings) - 1, int(len(timings) * 0.9))], 1)
+    }
+    if sampler:
+        sampler.stop()
+        result['peak_rss_mb'] = round(sampler.peak / (1024 ** 2), 1)
+        result['rss_growth_mb'] = round((sampler.peak - sampler.baseline) / (1024 ** 2), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк форматов загрузки изображения')
+    parser.add_argument('--url', default='http://127.0.0.1:3001', help='Адрес сервера')
+    parser.add_argument('--endpoint', choices=('analyze', 'encode'), default='analyze')
+    parser.add_argument('--image', help='Файл изображения (по умолчанию - синтетическое фото 12 Мп)')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='Форматы через запятую')
+    parser.add_argument('-n', '--repeats', type=int, default=10, help='Запросов на формат')
+    parser.add_argument('--pid', type=int, help='PID сервера для замера RSS (по умолчанию из /stats)')
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            image_data = f.read()
+    else:
+        image_data = synthetic_photos(1)[0][1]
+
+    pid = args.pid
+    if pid is None:
+        try:
+            pid = requests.get(f"{args.url}/stats", timeout=5).json().get('worker_pid')
+        except requests.RequestException as e:
+            print(f"Сервер недоступен: {e}")
+            sys.exit(1)
+    if pid and not psutil.pid_exists(pid):
+        print(f"Процесс {pid} не найден (сервер на другой машине?), RSS не замеряется")
+        pid = None
+
+    url = f"{args.url}/{args.endpoint}"
+    print(f"Изображение: {len(image_data) / 1024:.0f} КБ, {url}, {args.repeats} запросов на формат")
+    for fmt in args.formats.split(','):
+        result = run_format(url, fmt.strip(), image_data, args.repeats, pid)
+        rss = f", пик RSS {result['peak_rss_mb']} МБ (+{result['rss_growth_mb']})" if 'peak_rss_mb' in result else ''
+        print(f"{result['format']:>10}: медиана {result['median_ms']} мс, p90 {result['p90_ms']} мс{rss}")
+
+
+if __name__ == '__main__':
+    main()
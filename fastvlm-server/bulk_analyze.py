@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Пакетный анализ каталога изображений (бэкфилл каталога) с результатами в JSONL
+
+    python bulk_analyze.py ./photos -o results.jsonl                    # модель в этом процессе
+    python bulk_analyze.py manifest.jsonl -o results.jsonl --server http://127.0.0.1:3001
+
+Вход - каталог с изображениями (рекурсивно) или JSONL-манифест, строка которого
+{"path": "a.jpg", "id": "sku-1", "prompt": "..."} (id и prompt необязательны, путь -
+относительно манифеста). Каждый результат сразу дописывается в выходной файл, он же
+служит чекпоинтом: при повторном запуске уже обработанные id пропускаются, поэтому
+после падения или Ctrl+C достаточно запустить ту же команду.
+
+Изображения читаются и декодируются пулом потоков с опережением (--prefetch), генерация
+идет батчами: в процессе - через движок непрерывного батчинга, с сервером - через /analyze/batch.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import collections
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import Config
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+
+# Как часто печатать прогресс и сбрасывать выходной файл на диск, секунды
+PROGRESS_INTERVAL = 5.0
+
+# Батч по умолчанию: офлайн-прогону важна пропускная способность, а не задержка (BATCH_SIZE сервера - 1)
+DEFAULT_BATCH_SIZE = 8
+
+
+def scan_directory(path):
+    """Изображения каталога (рекурсивно) в стабильном порядке; id - путь относительно каталога"""
+    items = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                full_path = os.path.join(root, name)
+                relative = os.path.relpath(full_path, path).replace(os.sep, '/')
+                items.append({'id': relative, 'path': full_path})
+    return items
+
+
+def read_manifest(path):
+    """Строки JSONL-манифеста; пути считаются относительно каталога манифеста"""
+    base = os.path.dirname(os.path.abspath(path))
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: некорректный JSON: {e}")
+            if 'path' not in entry:
+                raise ValueError(f"{path}:{number}: нет поля path")
+            items.append({
+                'id': str(entry.get('id', entry['path'])),
+                'path': os.path.join(base, entry['path']),
+                'prompt': entry.get('prompt')
+            })
+    return items
+
+
+def load_done(output_path, retry_errors=False):
+    """id, уже записанные в выходной файл; оборванная при падении последняя строка игнорируется"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('success') or not retry_errors:
+                done.add(record.get('id'))
+    return done
+
+
+def terminate_last_line(path):
+    """После падения файл мог оборваться посреди строки: дописывает перевод строки"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def prefetch(pool, fn, items, depth):
+    """pool.submit(fn, item) с опережением не больше depth, выдает (item, future) по порядку"""
+    pending = collections.deque()
+    for item in items:
+        pending.append((item, pool.submit(fn, item)))
+        if len(pending) >= depth:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def read_file(item):
+    with open(item['path'], 'rb') as f:
+        return f.read()
+
+
+def error_record(item, error):
+    return {'id': item['id'], 'path': item['path'], 'success': False, 'error': str(error)}
+
+
+class LocalBackend:
+    """Модель в этом процессе: те же загрузка, кэши и движок батчинга, что у server.py"""
+
+    def __init__(self, batch_size, prefetch_depth, workers, deterministic):
+        import server
+
+        self.server = server
+        self.deterministic = deterministic
+        # Очередь движка ограничена QUEUE_MAX_SIZE: держим в ней не больше двух батчей
+        self.window = max(1, min(batch_size * 2, Config.QUEUE_MAX_SIZE or batch_size * 2))
+        self.prefetch_depth = prefetch_depth
+        self.workers = workers
+
+        server.load_prompt()
+        server.init_result_cache()
+        if not server.load_model():
+            raise RuntimeError('Не удалось загрузить модель')
+        # Движок батчит по --batch-size, а не по BATCH_SIZE сервера
+        Config.BATCH_SIZE = batch_size
+        server.start_engine()
+
+    def _prepare(self, item):
+        """В пуле предвыборки: чтение файла, декодирование, препроцессинг и токенизация"""
+        data = {'deterministic': self.deterministic}
+        if item.get('prompt'):
+            data['prompt'] = item['prompt']
+        # Бэкфилл - фоновая работа, как элементы /analyze/batch
+        job = self.server.AnalysisJob(data, read_file(item), priority='background')
+        job.decode()
+        cached = job.cached_result()
+        if cached is None:
+            job.prepare()
+        return job, cached
+
+    def run(self, items):
+        """Выдает записи результатов по мере завершения"""
+        inflight = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bulk-decode') as pool:
+            for item, future in prefetch(pool, self._prepare, items, self.prefetch_depth):
+                try:
+                    job, cached = future.result()
+                    if cached is not None:
+                        yield self._record(item, job, cached['analysis'], cached=True)
+                        continue
+                    gen_request = job.submit()
+                except Exception as e:
+                    yield error_record(item, e)
+                    continue
+
+                inflight[gen_request.future] = (item, job, gen_request)
+                while len(inflight) >= self.window:
+                    yield from self._collect(inflight)
+
+            while inflight:
+                yield from self._collect(inflight)
+
+    def _collect(self, inflight):
+        done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+        for future in done:
+            item, job, gen_request = inflight.pop(future)
+            try:
+                analysis = job.finish(future.result(), gen_request.finish_reason)
+            except Exception as e:
+                yield error_record(item, e)
+                continue
+            yield self._record(item, job, analysis, finish_reason=gen_request.finish_reason)
+
+    def _record(self, item, job, analysis, cached=False, finish_reason=None):
+        return {
+            'id': item['id'], 'path': item['path'], 'success': True, 'analysis': analysis,
+            'image_hash': job.image_key, 'cached': cached, 'finish_reason': finish_reason
+        }
+
+    def close(self):
+        self.server.shutdown()
+
+
+class RemoteBackend:
+    """Запущенный сервер: чанки по batch_size изображений в /analyze/batch (multipart)
+
+    Чанк не больше BATCH_MAX_IMAGES; если у сервера предел меньше (400 с max_images),
+    чанк делится и дальше отправляются чанки по его пределу.
+    """
+
+    def __init__(self, url, batch_size, prefetch_depth, workers, deterministic, concurrency, retries):
+        import requests
+
+        self.requests = requests
+        self.url = url.rstrip('/')
+        self.chunk_size = max(1, min(batch_size, Config.BATCH_MAX_IMAGES))
+        self.prefetch_depth = prefetch_depth
+        self.workers = workers
+        self.deterministic = deterministic
+        self.concurrency = concurrency
+        self.retries = retries
+        self._local = threading.local()
+
+        health = requests.get(f"{self.url}/health", timeout=10)
+        health.raise_for_status()
+
+    def run(self, items):
+        inflight = set()
+        chunk = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bulk-read') as readers, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='bulk-post') as posters:
+            for item, future in prefetch(readers, read_file, items, self.prefetch_depth):
+                try:
+                    chunk.append((item, future.result()))
+                except Exception as e:
+                    yield error_record(item, e)
+                    continue
+                if len(chunk) >= self.chunk_size:
+                    inflight.add(posters.submit(self._post_chunk, chunk))
+                    chunk = []
+                while len(inflight) >= self.concurrency:
+                    yield from self._collect(inflight)
+
+            if chunk:
+                inflight.add(posters.submit(self._post_chunk, chunk))
+            while inflight:
+                yield from self._collect(inflight)
+
+    def _collect(self, inflight):
+        done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+        for future in done:
+            inflight.discard(future)
+            yield from future.result()
+
+    def _session(self):
+        # requests.Session не потокобезопасна: своя сессия (и keep-alive соединение) на поток
+        if not hasattr(self._local, 'session'):
+            self._local.session = self.requests.Session()
+        return self._local.session
+
+    def _post_chunk(self, chunk):
+        """Отправляет чанк; элементы с 503 (очередь сервера заполнена) повторяются после Retry-After"""
+        records = []
+        attempt = 0
+        while chunk:
+            try:
+                response = self._session().post(
+                    f"{self.url}/analyze/batch",
+                    files=[('image', (os.path.basename(item['path']), data)) for item, data in chunk],
+                    data=self._form(chunk),
+                    timeout=600
+                )
+            except self.requests.RequestException as e:
+                return records + [error_record(item, e) for item, _ in chunk]
+
+            body = response.json() if response.headers.get('Content-Type', '').startswith('application/json') else {}
+            if response.status_code == 503 and attempt < self.retries:
+                attempt += 1
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+                continue
+            max_images = body.get('max_images')
+            if response.status_code == 400 and max_images and len(chunk) > max_images:
+                self.chunk_size = max_images
+                for start in range(0, len(chunk), max_images):
+                    records += self._post_chunk(chunk[start:start + max_images])
+                return records
+            if response.status_code != 200:
+                error = body.get('error') or f"HTTP {response.status_code}"
+                return records + [error_record(item, error) for item, _ in chunk]
+
+            retry = []
+            for (item, data), result in zip(chunk, body['results']):
+                if not result['success'] and result.get('status') == 503 and attempt < self.retries:
+                    retry.append((item, data))
+                    continue
+                records.append(self._record(item, result))
+
+            if retry:
+                attempt += 1
+                time.sleep(max(result.get('retry_after', 1) for result in body['results'] if not result['success']))
+            chunk = retry
+        return records
+
+    def _form(self, chunk):
+        """Поля формы: один prompt на все изображения или по одному на каждое"""
+        form = {'deterministic': 'true' if self.deterministic else 'false'}
+        prompts = [item.get('prompt') for item, _ in chunk]
+        if any(prompts):
+            # Пустой промпт в списке означает промпт сервера по умолчанию
+            form['prompt'] = [prompt or '' for prompt in prompts] if len(chunk) > 1 else prompts[0]
+        return form
+
+    def _record(self, item, result):
+        if not result['success']:
+            return error_record(item, result.get('error'))
+        return {
+            'id': item['id'], 'path': item['path'], 'success': True, 'analysis': result['analysis'],
+            'image_hash': result.get('image_hash'), 'cached': result.get('cached', False),
+            'finish_reason': result.get('finish_reason')
+        }
+
+    def close(self):
+        pass
+
+
+class Progress:
+    """Обработано / всего, изображений в секунду и оценка оставшегося времени"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    def update(self, record):
+        self.done += 1
+        if not record['success']:
+            self.failed += 1
+
+    def due(self):
+        return time.monotonic() - self.last_report >= PROGRESS_INTERVAL
+
+    def report(self):
+        self.last_report = time.monotonic()
+        elapsed = self.last_report - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else None
+        eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+        print(
+            f"{self.done}/{self.total} ({self.failed} с ошибкой), {rate:.2f} изобр/с, осталось {eta_text}",
+            file=sys.stderr, flush=True
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пакетный анализ изображений в JSONL с возобновлением')
+    parser.add_argument('source', help='Каталог с изображениями или JSONL-манифест')
+    parser.add_argument('-o', '--output', required=True, help='Выходной JSONL (он же чекпоинт)')
+    parser.add_argument('--server', help='Адрес запущенного сервера; без него модель грузится в этом процессе')
+    parser.add_argument('--prompt', help='Промпт для изображений без своего (по умолчанию - из prompt.md)')
+    parser.add_argument('--deterministic', action='store_true', help='Greedy-декодирование')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Изображений в батче (в процессе - размер батча движка, с сервером - до BATCH_MAX_IMAGES)')
+    parser.add_argument('--prefetch', type=int, default=32, help='Сколько изображений читать и декодировать заранее')
+    parser.add_argument('--workers', type=int, default=Config.DECODE_WORKERS, help='Потоков чтения/декодирования')
+    parser.add_argument('--concurrency', type=int, default=2, help='Одновременных батчей к серверу (--server)')
+    parser.add_argument('--retries', type=int, default=5, help='Повторов при 503 от сервера (--server)')
+    parser.add_argument('--retry-errors', action='store_true', help='Повторить записи, завершившиеся ошибкой')
+    parser.add_argument('--limit', type=int, help='Обработать не больше N изображений')
+    args = parser.parse_args()
+
+    items = scan_directory(args.source) if os.path.isdir(args.source) else read_manifest(args.source)
+    if args.prompt:
+        for item in items:
+            item['prompt'] = item.get('prompt') or args.prompt
+
+    done = load_done(args.output, args.retry_errors)
+    todo = [item for item in items if item['id'] not in done]
+    skipped = len(items) - len(todo)
+    if args.limit is not None:
+        todo = todo[:args.limit]
+    print(f"Изображений: {len(items)}, уже обработано: {skipped}, в работе: {len(todo)}", file=sys.stderr)
+    if not todo:
+        return
+
+    if args.server:
+        backend = RemoteBackend(args.server, args.batch_size, args.prefetch, args.workers,
+                                args.deterministic, args.concurrency, args.retries)
+    else:
+        backend = LocalBackend(args.batch_size, args.prefetch, args.workers, args.deterministic)
+
+    progress = Progress(len(todo))
+    terminate_last_line(args.output)
+    with open(args.output, 'a', encoding='utf-8') as output:
+        try:
+            for record in backend.run(todo):
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                output.flush()
+                progress.update(record)
+                if progress.due():
+                    os.fsync(output.fileno())
+                    progress.report()
+        except KeyboardInterrupt:
+            print("Прервано, для продолжения запустите ту же команду", file=sys.stderr)
+        finally:
+            output.flush()
+            os.fsync(output.fileno())
+            backend.close()
+
+    progress.report()
+
+
+if __name__ == '__main__':
+    main()
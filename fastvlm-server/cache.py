@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Кэши FastVLM сервера
+LRUCache - потокобезопасный LRU с бюджетом по байтам и TTL
+FeatureCache - признаки изображений после энкодера, вытеснение по объему тензоров
+PrefixCache - KV-состояния общих префиксов промпта
+ResultCache - кэш результатов /analyze: память + опциональный диск с бюджетом и очисткой
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def image_hash(image):
+    """SHA-256 от декодированных пикселей изображения (не от байтов файла)"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    """Стабильный ключ из произвольных JSON-сериализуемых частей"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """LRU-кэш с ограничением суммарного размера значений в байтах и временем жизни записей"""
+
+    def __init__(self, max_bytes, ttl=0, sizeof=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: len(value))
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, created = entry
+            if self.ttl and time.time() - created > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, created=None):
+        """created - время создания записи (для TTL), если она старше момента вставки"""
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, created or time.time())
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+class FeatureCache(LRUCache):
+    """Кэш проекций изображений (выход vision tower + проектор) по хэшу изображения"""
+
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes, sizeof=_tensor_size)
+
+
+class PrefixCache:
+    """KV-состояния общих префиксов промпта (шаблон диалога + статичный промпт) по их токенам"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, prefix_ids, state):
+        key = tuple(prefix_ids)
+        with self._lock:
+            self._entries[key] = state
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def match(self, input_ids):
+        """Самый длинный сохраненный префикс input_ids: (длина, состояние) или (0, None)
+
+        Префикс всегда короче input_ids - хотя бы один токен должен пройти prefill.
+        """
+        best = None
+        with self._lock:
+            for key in self._entries:
+                if len(key) < len(input_ids) and (best is None or len(key) > len(best)):
+                    if tuple(input_ids[:len(key)]) == key:
+                        best = key
+            if best is None:
+                self.misses += 1
+                return 0, None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            return len(best), self._entries[best]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'prefix_lengths': [len(key) for key in self._entries],
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class ResultCache:
+    """Кэш результатов анализа: LRU в памяти и (если задан каталог) файлы на диске
+
+    Диск ограничен disk_max_bytes (0 - без предела): при превышении и не реже раза
+    в DISK_SWEEP_INTERVAL секунд фоновая очистка удаляет истекшие по TTL записи,
+    затем самые старые по mtime, пока не останется DISK_SWEEP_TARGET бюджета.
+    Каталог очищается и при запуске.
+    """
+
+    DISK_SWEEP_INTERVAL = 3600
+    # Запас после вытеснения, чтобы очистка не запускалась на каждой записи
+    DISK_SWEEP_TARGET = 0.9
+    # Недописанный .tmp старше этого - остаток упавшего процесса
+    STALE_TEMP_SECONDS = 3600
+
+    def __init__(self, max_bytes, ttl=0, cache_dir=None, disk_max_bytes=0):
+        self.ttl = ttl
+        self.cache_dir = cache_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self.memory = LRUCache(max_bytes, ttl=ttl, sizeof=_json_size)
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.bypassed = 0
+        self.disk_bytes = 0
+        self.disk_entries = 0
+        self.disk_evictions = 0
+        self.disk_expired = 0
+        self._last_sweep = 0.0
+        self._sweeping = False
+        self._lock = threading.Lock()
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.sweep_disk()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.cache_dir:
+            record = self._read_disk(key)
+            if record is not None:
+                value = record['value']
+                # Время создания записи сохраняется: TTL не продлевается переносом в память
+                self.memory.put(key, value, created=record['created'])
+                with self._lock:
+                    self.disk_hits += 1
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if not self.cache_dir:
+            return
+        size = self._write_disk(key, value)
+        if size is None:
+            return
+        with self._lock:
+            # Перезапись ключа считается дважды - точный размер посчитает очистка
+            self.disk_bytes += size
+            self.disk_entries += 1
+            over_budget = bool(self.disk_max_bytes) and self.disk_bytes > self.disk_max_bytes
+            due = time.time() - self._last_sweep > self.DISK_SWEEP_INTERVAL
+            sweep = (over_budget or due) and not self._sweeping
+            if sweep:
+                self._sweeping = True
+        if sweep:
+            threading.Thread(target=self.sweep_disk, name='result-cache-sweep', daemon=True).start()
+
+    def sweep_disk(self):
+        """Удаляет истекшие записи и недописанные файлы, затем самые старые сверх бюджета"""
+        now = time.time()
+        entries = []
+        expired = evicted = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.name.endswith('.tmp'):
+                        if now - stat.st_mtime > self.STALE_TEMP_SECONDS:
+                            _unlink(entry.path)
+                        continue
+                    if not entry.name.endswith('.json'):
+                        continue
+                    # mtime файла - момент записи, как created внутри записи
+                    if self.ttl and now - stat.st_mtime > self.ttl:
+                        expired += _unlink(entry.path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            logger.warning(f"Не удалось очистить кэш на диске {self.cache_dir}: {e}")
+            with self._lock:
+                self._last_sweep = now
+                self._sweeping = False
+            return
+
+        total = sum(size for _, size, _ in entries)
+        if self.disk_max_bytes and total > self.disk_max_bytes:
+            entries.sort()
+            target = self.disk_max_bytes * self.DISK_SWEEP_TARGET
+            kept = len(entries)
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                if _unlink(path):
+                    evicted += 1
+                total -= size
+                kept -= 1
+            entries = entries[len(entries) - kept:]
+
+        with self._lock:
+            self.disk_bytes = total
+            self.disk_entries = len(entries)
+            self.disk_expired += expired
+            self.disk_evictions += evicted
+            self._last_sweep = now
+            self._sweeping = False
+        if expired or evicted:
+            logger.info(f"Очистка кэша на диске: истекло {expired}, вытеснено {evicted}, осталось {total} байт")
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'bypassed': self.bypassed,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'memory': self.memory.stats(),
+            'disk_dir': self.cache_dir,
+            'disk': {
+                'entries': self.disk_entries,
+                'bytes': self.disk_bytes,
+                'max_bytes': self.disk_max_bytes,
+                'evictions': self.disk_evictions,
+                'expired': self.disk_expired
+            } if self.cache_dir else None,
+            'ttl': self.ttl
+        }
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Поврежденная запись кэша {path}: {e}")
+            return None
+
+        created = record.get('created', 0)
+        if self.ttl and time.time() - created > self.ttl:
+            _unlink(path)
+            return None
+        return {'value': record.get('value'), 'created': created}
+
+    def _write_disk(self, key, value):
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created': time.time(), 'value': value}, f, ensure_ascii=False)
+                size = f.tell()
+            os.replace(temp_path, path)
+            return size
+        except Exception as e:
+            logger.warning(f"Не удалось записать кэш на диск {path}: {e}")
+            _unlink(temp_path)
+            return None
+
+
+def _unlink(path):
+    """Удаляет файл, если он еще есть (его мог удалить другой процесс); True - удален"""
+    try:
+        os.unlink(path)
+        return True
+    except OSError:
+        return False
+
+
+def _tensor_size(tensor):
+    return tensor.element_size() * tensor.nelement()
+
+
+def _json_size(value):
+    return len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Проверка движка батчинга на CPU с крошечной случайной моделью вместо FastVLM
+Сравнивает greedy-генерацию через BatchingEngine (батч + подключение на лету)
+с последовательной генерацией по одному запросу
+"""
+
+import sys
+import time
+import random
+
+import torch
+from transformers import Qwen2Config, Qwen2ForCausalLM
+
+from cache import FeatureCache, PrefixCache
+from engine import BatchingEngine, GenerationRequest
+from model_runner import CausalLMRunner
+
+VOCAB_SIZE = 256
+HIDDEN_SIZE = 64
+IMAGE_PATCHES = 8
+
+
+class TinyRunner(CausalLMRunner):
+    """Стенд-ин для FastVLMRunner: маленькая Qwen2 и линейный "энкодер" изображений"""
+
+    def __init__(self, model):
+        super().__init__(model, None)
+        self.projector = torch.nn.Linear(3, HIDDEN_SIZE)
+
+    def encode_images(self, image_tensors):
+        images = torch.stack(image_tensors)
+        patches = images.flatten(2).transpose(1, 2)[:, :IMAGE_PATCHES]
+        return list(self.projector(patches).to(self.dtype))
+
+
+def build_requests(count, seed):
+    """Случайные промпты; часть запросов ссылается на одни и те же изображения и общие префиксы"""
+    rng = random.Random(seed)
+    images = {
+        f"image-{i}": torch.rand(3, 4, 4, generator=torch.Generator().manual_seed(i))
+        for i in range(4)
+    }
+    prefixes = [[rng.randrange(1, VOCAB_SIZE) for _ in range(length)] for length in (6, 15)]
+    requests = []
+    for _ in range(count):
+        length = rng.randint(3, 24)
+        input_ids = [rng.randrange(1, VOCAB_SIZE) for _ in range(length)]
+        image_key = None
+        if rng.random() < 0.7:
+            input_ids.insert(rng.randint(0, length), CausalLMRunner.image_token_index)
+            image_key = rng.choice(list(images))
+        if rng.random() < 0.6:
+            input_ids = rng.choice(prefixes) + input_ids
+        requests.append((input_ids, image_key, rng.randint(1, 40)))
+    return requests, images, prefixes
+
+
+def build_fanout_requests(prompts, seed):
+    """Несколько промптов к каждому изображению с общим началом, как у /analyze/multi"""
+    rng = random.Random(seed)
+    images = {
+        f"image-{i}": torch.rand(3, 4, 4, generator=torch.Generator().manual_seed(100 + i))
+        for i in range(2)
+    }
+    system = [rng.randrange(1, VOCAB_SIZE) for _ in range(10)]
+    requests = []
+    for image_key in images:
+        for _ in range(prompts):
+            question = [rng.randrange(1, VOCAB_SIZE) for _ in range(rng.randint(2, 12))]
+            requests.append((system + [CausalLMRunner.image_token_index] + question, image_key, rng.randint(1, 30)))
+    return requests, images, [system]
+
+
+def run_engine(runner, specs, batch_size, stagger, feature_cache=None, prefix_cache=None):
+    requests, images, prefixes = specs
+    engine = BatchingEngine(
+        runner, max_batch_size=batch_size, max_wait_ms=5, max_queue_size=0,
+        feature_cache=feature_cache, prefix_cache=prefix_cache
+    )
+    if prefix_cache is not None:
+        for prefix_ids in prefixes:
+            engine.register_prefix(prefix_ids)
+    engine.start()
+    submitted = []
+    for input_ids, image_key, max_new_tokens in requests:
+        image_tensor = images[image_key] if image_key else None
+        gen_request = GenerationRequest(
+            input_ids, image_tensor, max_new_tokens=max_new_tokens, do_sample=False,
+            image_key=image_key if feature_cache is not None else None
+        )
+        submitted.append(engine.submit(gen_request))
+        if stagger:
+            time.sleep(0.003)
+    outputs = [r.result(timeout=60) for r in submitted]
+    engine.stop()
+    return outputs, engine.stats
+
+
+def main():
+    torch.manual_seed(0)
+    config = Qwen2Config(
+        vocab_size=VOCAB_SIZE, hidden_size=HIDDEN_SIZE, intermediate_size=128,
+        num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=2,
+        max_position_embeddings=256, eos_token_id=0
+    )
+    model = Qwen2ForCausalLM(config).eval()
+    runner = TinyRunner(model)
+    specs = build_requests(16, seed=1)
+
+    expected, _ = run_engine(runner, specs, batch_size=1, stagger=False)
+    checks = [
+        ('батчинг', {}),
+        ('батчинг + кэш признаков', {'feature_cache': FeatureCache(1 << 20)}),
+        ('батчинг + кэш префиксов', {'prefix_cache': PrefixCache(4)})
+    ]
+
+    fanout = build_fanout_requests(4, seed=2)
+    fanout_expected, _ = run_engine(runner, fanout, batch_size=1, stagger=False)
+    # Промпты к одному изображению приходят вместе и делят prefill изображения
+    checks.append(('общий префикс изображения', {
+        'feature_cache': FeatureCache(1 << 20), 'specs': fanout, 'expected': fanout_expected, 'stagger': False
+    }))
+    checks.append(('общий префикс изображения + кэш префиксов', {
+        'feature_cache': FeatureCache(1 << 20), 'prefix_cache': PrefixCache(4),
+        'specs': fanout, 'expected': fanout_expected, 'stagger': False
+    }))
+
+    failed = False
+    for name, options in checks:
+        cases = options.pop('specs', specs)
+        reference = options.pop('expected', expected)
+        stagger = options.pop('stagger', True)
+        actual, stats = run_engine(runner, cases, batch_size=4, stagger=stagger, **options)
+        mismatches = [i for i, (a, b) in enumerate(zip(reference, actual)) if a != b]
+        print(f"Статистика движка ({name}): {stats}")
+        if mismatches:
+            print(f"❌ {name}: расхождение с последовательной генерацией в запросах {mismatches}")
+            failed = True
+        else:
+            print(f"✅ {name}: совпадает с последовательной генерацией ({len(cases[0])} запросов)")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
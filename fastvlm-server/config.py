@@ -1,7 +1,20 @@
 import os
-import torch
 
-class Config:
+class _LazyConfig(type):
+    """Значения, которым нужен torch, вычисляются при первом обращении (см. Config._LAZY)
+
+    Поэтому import config остается легким: без импорта torch и опроса CUDA.
+    """
+
+    def __getattr__(cls, name):
+        resolver = cls._LAZY.get(name)
+        if resolver is None:
+            raise AttributeError(f"type object 'Config' has no attribute '{name}'")
+        value = getattr(cls, resolver)()
+        setattr(cls, name, value)
+        return value
+
+class Config(metaclass=_LazyConfig):
     """Конфигурация FastVLM сервера"""
 
     # === Пути ===
@@ -13,32 +26,145 @@ class Config:
     # === Настройки сервера ===
     HOST = os.getenv('FASTVLM_HOST', '127.0.0.1')
     PORT = int(os.getenv('FASTVLM_PORT', '3001'))
+    # TCP можно отключить, если клиенты ходят только через Unix-сокет
+    TCP_ENABLED = os.getenv('FASTVLM_TCP', 'true').lower() == 'true'
+    # Unix domain socket рядом с TCP (пусто - не используется)
+    UNIX_SOCKET = os.getenv('FASTVLM_SOCKET', '')
+    UNIX_SOCKET_MODE = int(os.getenv('FASTVLM_SOCKET_MODE', '660'), 8)
+    # Сколько держать простаивающее keep-alive соединение (секунды)
+    KEEP_ALIVE_TIMEOUT = float(os.getenv('KEEP_ALIVE_TIMEOUT', '30'))
 
     # === Настройки модели ===
-    # Используем GPU если доступен
-    if torch.cuda.is_available():
-        DEVICE = 'cuda'
-        print(f"GPU доступен: {torch.cuda.get_device_name(0)}")
-    else:
-        print("GPU не найден, используем CPU")
-        DEVICE = 'cpu'
+    # Бэкенд инференса: fastvlm (чекпоинт MODEL_PATH) или stub (заглушка без весов для нагрузочных тестов)
+    BACKEND = os.getenv('FASTVLM_BACKEND', 'fastvlm')
+    # Задержки заглушки: шаг декодирования (на весь батч), вызов prefill, кодирование изображения
+    STUB_TOKEN_LATENCY_MS = float(os.getenv('STUB_TOKEN_LATENCY_MS', '20'))
+    STUB_PREFILL_LATENCY_MS = float(os.getenv('STUB_PREFILL_LATENCY_MS', '50'))
+    STUB_ENCODE_LATENCY_MS = float(os.getenv('STUB_ENCODE_LATENCY_MS', '30'))
+
+    # Устройство: auto - GPU, если доступен, иначе CPU; cuda, mps или cpu - явно.
+    # DEVICE и TORCH_DTYPE вычисляются при первом обращении (импорт torch и опрос CUDA)
+    DEVICE_SETTING = os.getenv('FASTVLM_DEVICE', 'auto')
+    _LAZY = {'DEVICE': '_detect_device', 'TORCH_DTYPE': '_torch_dtype'}
 
-    TORCH_DTYPE = torch.float16
+    # === Прогрев модели перед готовностью ===
+    # Синтетические изображения ШxВ через запятую (пусто - без прогрева); по умолчанию - размеры фото Telegram
+    WARMUP_IMAGE_SIZES = os.getenv('WARMUP_IMAGE_SIZES', '1280x960,960x1280')
+    WARMUP_MAX_NEW_TOKENS = int(os.getenv('WARMUP_MAX_NEW_TOKENS', '16'))
 
     # === Настройки генерации ===
     MAX_NEW_TOKENS = int(os.getenv('MAX_NEW_TOKENS', '256'))
     TEMPERATURE = float(os.getenv('TEMPERATURE', '0.2'))
     DO_SAMPLE = os.getenv('DO_SAMPLE', 'true').lower() == 'true'
+    # Детерминированный режим (greedy) по умолчанию для всех запросов
+    DETERMINISTIC = os.getenv('DETERMINISTIC', 'false').lower() == 'true'
+
+    # === Ранняя остановка генерации ===
+    # Сколько непустых строк оставляет постобработка анализа
+    ANALYSIS_MAX_LINES = int(os.getenv('ANALYSIS_MAX_LINES', '10'))
+    # Остановка после ANALYSIS_MAX_LINES строк (0 - выключено)
+    STOP_LINE_BUDGET = int(os.getenv('STOP_LINE_BUDGET', str(ANALYSIS_MAX_LINES)))
+    STOP_ON_REPETITION = os.getenv('STOP_ON_REPETITION', 'true').lower() == 'true'
+    REPETITION_MAX_PERIOD = int(os.getenv('REPETITION_MAX_PERIOD', '32'))
+    REPETITION_MIN_REPEATS = int(os.getenv('REPETITION_MIN_REPEATS', '4'))
+    # Лимит времени на запрос в секундах (0 - без лимита, по умолчанию; включается явно)
+    GENERATION_DEADLINE_SECONDS = float(os.getenv('GENERATION_DEADLINE_SECONDS', '0'))
 
     # === Настройки производительности ===
     MAX_IMAGE_SIZE = int(os.getenv('MAX_IMAGE_SIZE', '2048'))
+    # Предел размера загружаемого изображения в байтах (multipart, image/*, base64 после декодирования)
+    MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', '20971520'))  # 20MB
+    # Последовательностей в батче генерации: по умолчанию 1, как раньше; батчинг включается явно
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', '1'))
+    # Сколько ждать остальные запросы батча после прихода первого (мс)
+    BATCH_WAIT_MS = int(os.getenv('BATCH_WAIT_MS', '20'))
+    # /analyze/batch: максимум изображений в одном запросе и предел всего тела запроса в байтах
+    BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', '16'))
+    BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', '67108864'))  # 64MB
+    # /analyze/multi: максимум промптов к одному изображению и лимит токенов на каждый ответ
+    MULTI_MAX_PROMPTS = int(os.getenv('MULTI_MAX_PROMPTS', '8'))
+    MULTI_MAX_NEW_TOKENS = int(os.getenv('MULTI_MAX_NEW_TOKENS', '64'))
+    # Максимум запросов в очереди движка; при переполнении сервер отвечает 503 с Retry-After
+    QUEUE_MAX_SIZE = int(os.getenv('QUEUE_MAX_SIZE', '16'))
+    # Справедливая очередь: веса классов приоритета и пределы на пользователя (X-User-ID, 0 - без предела)
+    INTERACTIVE_WEIGHT = float(os.getenv('INTERACTIVE_WEIGHT', '4'))
+    BACKGROUND_WEIGHT = float(os.getenv('BACKGROUND_WEIGHT', '1'))
+    USER_MAX_QUEUED = int(os.getenv('USER_MAX_QUEUED', '8'))
+    USER_MAX_ACTIVE = int(os.getenv('USER_MAX_ACTIVE', '2'))
+    # Пулы этапов конвейера: декодирование base64/JPEG и препроцессинг в тензоры
+    DECODE_WORKERS = int(os.getenv('DECODE_WORKERS', '2'))
+    PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', '2'))
+    # Потоки для прочей блокирующей работы вне event loop (кэш на диске, перезагрузка промпта)
+    CPU_WORKERS = int(os.getenv('CPU_WORKERS', '2'))
+    # Период фонового снятия CPU/памяти для /load, /gpu и /metrics (секунды)
+    RESOURCE_SAMPLE_SECONDS = float(os.getenv('RESOURCE_SAMPLE_SECONDS', '5'))
+
+    # === Prefork-режим (только CPU) ===
+    # Число процессов-воркеров с общей копией весов (1 - один процесс без fork)
+    WORKERS = int(os.getenv('WORKERS', '1'))
+    # Потоки intra-op torch на воркер (0 - поровну ядер на каждый воркер)
+    WORKER_THREADS = int(os.getenv('WORKER_THREADS', '0'))
+    # Привязывать воркеры к своим ядрам (только Linux)
+    WORKER_CPU_AFFINITY = os.getenv('WORKER_CPU_AFFINITY', 'false').lower() == 'true'
+
+    # === Потоковая выдача (SSE) ===
+    # Интервал keep-alive комментариев, пока запрос ждет в очереди (секунды)
+    SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', '5'))
+
+    # === Кэш результатов ===
+    RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+    RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', '67108864'))  # 64MB
+    RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '86400'))  # секунды, 0 - без ограничения
+    RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', '')  # пусто - только память
+    # Бюджет каталога RESULT_CACHE_DIR: сверх него удаляются самые старые записи (0 - без предела)
+    RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv('RESULT_CACHE_DISK_MAX_BYTES', '1073741824'))  # 1GB
+
+    # === Кэш признаков изображений (выход энкодера) ===
+    FEATURE_CACHE_ENABLED = os.getenv('FEATURE_CACHE_ENABLED', 'true').lower() == 'true'
+    FEATURE_CACHE_MAX_BYTES = int(os.getenv('FEATURE_CACHE_MAX_BYTES', '268435456'))  # 256MB
+
+    # === Кэш KV общих префиксов промпта ===
+    PREFIX_CACHE_ENABLED = os.getenv('PREFIX_CACHE_ENABLED', 'true').lower() == 'true'
+    PREFIX_CACHE_SIZE = int(os.getenv('PREFIX_CACHE_SIZE', '8'))
+    # Положение изображения в промпте: before (как при обучении; из кэша префиксов берется
+    # только системная часть шаблона) или after (после инструкций, тогда весь статичный
+    # промпт переиспользуется из кэша префиксов и TTFT примерно вдвое меньше - bench_prefix.py)
+    IMAGE_POSITION = os.getenv('IMAGE_POSITION', 'before')
 
     # === Настройки логирования ===
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', '10485760'))  # 10MB
     LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
 
+    @classmethod
+    def _detect_device(cls):
+        if cls.DEVICE_SETTING != 'auto':
+            return cls.DEVICE_SETTING
+
+        import torch
+        if torch.cuda.is_available():
+            print(f"GPU доступен: {torch.cuda.get_device_name(0)}")
+            return 'cuda'
+        print("GPU не найден, используем CPU")
+        return 'cpu'
+
+    @classmethod
+    def _torch_dtype(cls):
+        import torch
+        return torch.float16
+
+    @classmethod
+    def warmup_sizes(cls):
+        """Размеры изображений прогрева [(ширина, высота), ...] из WARMUP_IMAGE_SIZES"""
+        sizes = []
+        for item in cls.WARMUP_IMAGE_SIZES.split(','):
+            item = item.strip().lower()
+            if not item:
+                continue
+            width, _, height = item.partition('x')
+            sizes.append((int(width), int(height)))
+        return sizes
+
     @classmethod
     def load_env(cls):
         """Загрузка переменных окружения из .env файла"""
@@ -58,13 +184,32 @@ class Config:
     @classmethod
     def validate_config(cls):
         """Валидация конфигурации"""
-        if not os.path.exists(cls.MODEL_PATH):
+        if cls.BACKEND not in ('fastvlm', 'stub'):
+            raise ValueError(f"Некорректный FASTVLM_BACKEND: {cls.BACKEND}")
+
+        if cls.DEVICE_SETTING not in ('auto', 'cuda', 'mps', 'cpu'):
+            raise ValueError(f"Некорректный FASTVLM_DEVICE: {cls.DEVICE_SETTING}")
+
+        try:
+            cls.warmup_sizes()
+        except ValueError:
+            raise ValueError(f"Некорректный WARMUP_IMAGE_SIZES: {cls.WARMUP_IMAGE_SIZES} (ожидается 1280x960,960x1280)")
+
+        if cls.BACKEND == 'fastvlm' and not os.path.exists(cls.MODEL_PATH):
             raise FileNotFoundError(f"Модель не найдена: {cls.MODEL_PATH}")
 
         if cls.PORT < 1024 or cls.PORT > 65535:
             raise ValueError(f"Некорректный порт: {cls.PORT}")
 
+        if not cls.TCP_ENABLED and not cls.UNIX_SOCKET:
+            raise ValueError("FASTVLM_TCP=false требует FASTVLM_SOCKET")
+
         print(f"✅ Конфигурация загружена:")
         print(f"   Порт: {cls.PORT}")
+        if cls.UNIX_SOCKET:
+            print(f"   Unix-сокет: {cls.UNIX_SOCKET}")
         print(f"   Устройство: {cls.DEVICE}")
-        print(f"   Модель: {os.path.basename(cls.MODEL_PATH)}")
+        if cls.BACKEND == 'stub':
+            print(f"   Модель: заглушка (stub), шаг {cls.STUB_TOKEN_LATENCY_MS}ms")
+        else:
+            print(f"   Модель: {os.path.basename(cls.MODEL_PATH)}")
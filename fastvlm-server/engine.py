@@ -0,0 +1,709 @@
+#!/usr/bin/env python3
+"""
+Движок непрерывного батчинга (continuous batching) для FastVLM
+Собирает входящие запросы, кодирует изображения и делает prefill батчем,
+затем шагает декодирование по одному токену для всего батча.
+Завершенные последовательности выходят из батча, новые подключаются на лету.
+"""
+
+import math
+import queue
+import statistics
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+from config import Config
+from metrics import BATCH_BUCKETS, TOKEN_BUCKETS, Histogram
+from scheduler import FairQueue, UserLimitReached
+from streaming import IncrementalDetokenizer
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRequest:
+    """Запрос на генерацию: токены промпта, изображение и параметры генерации
+
+    Изображение задается либо готовыми признаками (image_features), либо тензором
+    после препроцессинга (image_tensor) - тогда его закодирует движок.
+    image_key - хэш изображения для кэша признаков, encode_only - только энкодер, без генерации.
+    stopping - критерии ранней остановки (см. stopping.py).
+    deadline - момент time.monotonic(), после которого ответ клиенту уже не нужен:
+    запрос убирается из очереди или отменяется на следующем токене (DeadlineExceededError).
+    user и priority - поток в справедливой очереди, group - общий ключ запросов,
+    которые для предела пользователя считаются одним (см. scheduler.py).
+    """
+
+    def __init__(self, input_ids, image_tensor=None, max_new_tokens=None,
+                 do_sample=None, temperature=None, on_token=None,
+                 image_key=None, image_features=None, encode_only=False, stopping=None, deadline=None,
+                 user=None, priority='interactive', group=None):
+        self.input_ids = input_ids
+        self.image_tensor = image_tensor
+        self.image_key = image_key
+        self.image_features = image_features
+        self.encode_only = encode_only
+        self.max_new_tokens = max_new_tokens if max_new_tokens is not None else Config.MAX_NEW_TOKENS
+        self.do_sample = do_sample if do_sample is not None else Config.DO_SAMPLE
+        self.temperature = temperature if temperature is not None else Config.TEMPERATURE
+        self.on_token = on_token
+        self.stopping = stopping or []
+        self.deadline = deadline
+        self.user = user
+        self.priority = priority
+        self.group = group
+        self.detokenizer = None
+
+        self.output_ids = []
+        self.finish_reason = None
+        self.future = Future()
+        self.cancelled = False
+
+        # Позиция в очереди при постановке и оценка ожидания до prefill, секунды
+        self.queue_position = None
+        self.estimated_wait = None
+        self.scheduled = False
+
+        self.prefix_tokens = 0
+        # Время энкодера и prefill батча, в котором запрос начал генерацию, мс
+        self.encode_ms = None
+        self.prefill_ms = None
+        self.created_at = time.monotonic()
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+
+    def check_stopping(self):
+        """Проверяет критерии остановки после нового токена, возвращает имя сработавшего или None"""
+        if self.detokenizer is not None:
+            self.detokenizer.push(self.output_ids[-1])
+        for criterion in self.stopping:
+            if criterion(self):
+                return criterion.name
+        return None
+
+    def cancel(self):
+        """Помечает запрос отмененным, движок уберет его на следующем шаге"""
+        self.cancelled = True
+
+    def expired(self, now=None):
+        """Дедлайн клиента прошел"""
+        return self.deadline is not None and (now or time.monotonic()) >= self.deadline
+
+    def result(self, timeout=None):
+        """Ждет завершения генерации и возвращает список сгенерированных токенов"""
+        return self.future.result(timeout=timeout)
+
+    def ttft_ms(self):
+        """Время до первого токена с момента постановки в очередь, мс"""
+        if self.first_token_at is None:
+            return None
+        return round((self.first_token_at - self.created_at) * 1000, 1)
+
+    def timings(self):
+        """Сводка по времени: ожидание в очереди, энкодер, prefill, TTFT, генерация и ее скорость"""
+        end = self.finished_at or time.monotonic()
+        decode_time = end - self.first_token_at if self.first_token_at else 0
+        tokens = len(self.output_ids)
+        return {
+            'queue_ms': round((self.started_at - self.created_at) * 1000, 1) if self.started_at else None,
+            'encode_ms': round(self.encode_ms, 1) if self.encode_ms is not None else None,
+            'prefill_ms': round(self.prefill_ms, 1) if self.prefill_ms is not None else None,
+            'ttft_ms': self.ttft_ms(),
+            'generate_ms': round(decode_time * 1000, 1),
+            'total_ms': round((end - self.created_at) * 1000, 1),
+            'tokens': tokens,
+            'tokens_per_sec': round((tokens - 1) / decode_time, 2) if tokens > 1 and decode_time > 0 else None
+        }
+
+
+class QueueFullError(Exception):
+    """Очередь движка заполнена; retry_after - оценка времени до освобождения места, секунды
+
+    reason - машиночитаемая причина отказа для клиента (поле reason ответа 503/429).
+    """
+
+    reason = 'queue_full'
+
+    def __init__(self, retry_after):
+        super().__init__('Generation queue is full')
+        self.retry_after = retry_after
+
+
+class UserQueueFullError(QueueFullError):
+    """У пользователя уже USER_MAX_QUEUED запросов в очереди"""
+
+    reason = 'user_queue_full'
+
+    def __init__(self, user, retry_after):
+        super().__init__(retry_after)
+        self.args = ('Too many queued requests for this user',)
+        self.user = user
+
+
+class WaitLimitError(QueueFullError):
+    """Оценка ожидания в очереди больше, чем клиент готов ждать (max_wait_ms)"""
+
+    reason = 'wait_limit'
+
+    def __init__(self, estimated_wait, retry_after):
+        super().__init__(retry_after)
+        self.args = ('Estimated queue wait exceeds max_wait_ms',)
+        self.estimated_wait = estimated_wait
+
+
+class WarmingUpError(QueueFullError):
+    """Прогрев модели еще идет, а клиент просил быстрый отказ (max_wait_ms)"""
+
+    reason = 'warming_up'
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.args = ('Model is warming up',)
+
+
+class DeadlineExceededError(Exception):
+    """Дедлайн клиента прошел до завершения генерации; stage - где запрос был снят"""
+
+    def __init__(self, stage):
+        super().__init__(f'Deadline exceeded ({stage})')
+        self.stage = stage
+
+
+class BatchingEngine:
+    """Планировщик генерации: один поток владеет моделью и ведет общий батч"""
+
+    # Вес нового замера в скользящем среднем времени обслуживания запроса
+    SERVICE_TIME_ALPHA = 0.2
+    # Сколько последних запросов учитывает медиана задержки для /ready
+    LATENCY_WINDOW = 100
+
+    def __init__(self, runner, max_batch_size=None, max_wait_ms=None, feature_cache=None, prefix_cache=None,
+                 max_queue_size=None):
+        self.runner = runner
+        self.feature_cache = feature_cache
+        self.prefix_cache = prefix_cache
+        self.max_batch_size = max(1, max_batch_size or Config.BATCH_SIZE)
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else Config.BATCH_WAIT_MS) / 1000.0
+        # 0 - очередь без ограничения
+        self.max_queue_size = max(0, max_queue_size if max_queue_size is not None else Config.QUEUE_MAX_SIZE)
+
+        # Справедливая очередь по пользователям и классам приоритета вместо FIFO
+        self._queue = FairQueue(
+            maxsize=self.max_queue_size,
+            weights={'interactive': Config.INTERACTIVE_WEIGHT, 'background': Config.BACKGROUND_WEIGHT},
+            max_user_queued=Config.USER_MAX_QUEUED,
+            max_user_active=Config.USER_MAX_ACTIVE
+        )
+        self._jobs = queue.Queue()
+        self._active = []
+        self._batch = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.stats = {
+            'requests_total': 0,
+            'requests_completed': 0,
+            'requests_failed': 0,
+            'requests_cancelled': 0,
+            'requests_rejected': 0,
+            # Сняты из очереди до prefill (отмена или дедлайн) и сняты по дедлайну клиента
+            'requests_dropped': 0,
+            'requests_expired': 0,
+            'prefill_batches': 0,
+            'decode_steps': 0,
+            'tokens_generated': 0,
+            'images_encoded': 0,
+            'feature_cache_hits': 0,
+            'prefix_tokens_reused': 0,
+            'image_prefixes_shared': 0,
+            'prefill_tokens': 0,
+            'ttft_ms_total': 0.0,
+            'max_batch_seen': 0,
+            'finish_reasons': {}
+        }
+        # Счетчики запросов меняет не только поток движка: submit (из потоков сервера) считает
+        # отказы и снимает из очереди отмененные запросы - такие обновления идут под блокировкой
+        self._stats_lock = threading.Lock()
+        # Скользящее среднее времени от начала prefill до завершения запроса, секунды
+        self.avg_service_time = None
+        # Медиана полного времени (очередь + генерация) последних запросов, секунды;
+        # пересчитывается потоком движка при завершении запроса, /ready только читает
+        self._recent_latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self.latency_p50 = None
+        # Первая генерация завершена: ядра ускорителя скомпилированы, аллокатор прогрет
+        self.warmed_up = False
+
+        # Распределения для /metrics: обновляются потоком движка
+        self.histograms = {
+            'queue_wait': Histogram('fastvlm_queue_wait_seconds', 'Ожидание запроса в очереди движка до prefill'),
+            'ttft': Histogram('fastvlm_ttft_seconds', 'Время от постановки в очередь до первого токена'),
+            'tokens': Histogram(
+                'fastvlm_generated_tokens', 'Сгенерировано токенов на завершенный запрос', buckets=TOKEN_BUCKETS
+            ),
+            'batch_size': Histogram(
+                'fastvlm_decode_batch_size', 'Последовательностей в батче на шаге декодирования', buckets=BATCH_BUCKETS
+            )
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='fastvlm-engine', daemon=True)
+        self._thread.start()
+        logger.info(f"Движок батчинга запущен: batch_size={self.max_batch_size}, wait={self.max_wait * 1000:.0f}ms")
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def submit(self, gen_request):
+        """Ставит запрос в очередь и сразу возвращает его, результат - через gen_request.result()
+
+        Если очередь заполнена, бросает QueueFullError с оценкой времени ожидания,
+        если заполнена доля пользователя - UserQueueFullError.
+        Перед отказом из очереди убираются отмененные и просроченные запросы.
+        """
+        try:
+            try:
+                position = self._queue.put_nowait(gen_request)
+            except queue.Full:
+                if not self._purge_queue():
+                    raise
+                position = self._queue.put_nowait(gen_request)
+        except UserLimitReached:
+            self._count('requests_rejected')
+            raise UserQueueFullError(gen_request.user, self.estimate_wait())
+        except queue.Full:
+            self._count('requests_rejected')
+            raise QueueFullError(self.estimate_wait())
+        self._count('requests_total')
+        gen_request.queue_position = position
+        gen_request.estimated_wait = self.estimate_start(position)
+        return gen_request
+
+    def is_full(self, user=None):
+        """Очередь (или доля пользователя user) заполнена - новый запрос будет отклонен"""
+        return self._queue.full(user)
+
+    def estimate_wait(self):
+        """Оценка в секундах, через сколько освободится место в очереди
+
+        Очередь и активный батч проходят волнами по max_batch_size запросов,
+        каждая волна занимает среднее время обслуживания запроса.
+        """
+        service_time = self.avg_service_time or 1.0
+        waves = math.ceil((self.queue_depth() + self.active_count()) / self.max_batch_size)
+        return max(1, math.ceil(waves * service_time))
+
+    def estimate_start(self, position):
+        """Оценка в секундах, через сколько начнется prefill запроса с позицией position в очереди
+
+        Запрос попадает в батч сразу, если перед ним меньше запросов, чем свободных мест;
+        иначе ждет освобождения мест волнами по max_batch_size.
+        """
+        ahead = position + self.active_count() - self.max_batch_size + 1
+        if ahead <= 0:
+            return 0.0
+        return math.ceil(ahead / self.max_batch_size) * (self.avg_service_time or 1.0)
+
+    def readiness(self):
+        """Готовность принимать запросы из уже посчитанных значений, без обращения к модели"""
+        depth = self.queue_depth()
+        return {
+            'warmed_up': self.warmed_up,
+            'queue_depth': depth,
+            'queue_max_size': self.max_queue_size,
+            'queue_full': bool(self.max_queue_size) and depth >= self.max_queue_size,
+            'in_flight': self.active_count(),
+            'p50_latency_ms': round(self.latency_p50 * 1000, 1) if self.latency_p50 is not None else None,
+            'estimated_wait_ms': round(self.estimate_start(depth) * 1000)
+        }
+
+    def reset_latency(self):
+        """Забывает медиану и среднее время обслуживания (после прогрева: холодные запросы не показательны)"""
+        def reset():
+            self._recent_latencies.clear()
+            self.latency_p50 = None
+            self.avg_service_time = None
+        return self.run_in_engine(reset)
+
+    def reset_prefix_stats(self):
+        """Обнуляет счетчики кэша префиксов (после прогрева: его prefill не должен попадать в статистику)"""
+        def reset():
+            self.stats['prefix_tokens_reused'] = 0
+            if self.prefix_cache is not None:
+                self.prefix_cache.reset_stats()
+        return self.run_in_engine(reset)
+
+    def scheduler_stats(self):
+        """Состояние справедливой очереди: очереди по приоритетам, пользователи, отложенные выдачи"""
+        return self._queue.stats()
+
+    def run_in_engine(self, fn):
+        """Выполняет fn в потоке движка (между шагами генерации), возвращает Future"""
+        future = Future()
+        self._jobs.put((fn, future))
+        return future
+
+    def register_prefix(self, prefix_ids):
+        """Считает KV префикса в потоке движка и сохраняет его в prefix_cache"""
+        def job():
+            self.prefix_cache.put(prefix_ids, self.runner.compute_prefix(prefix_ids))
+            return len(prefix_ids)
+        return self.run_in_engine(job)
+
+    def stats_snapshot(self):
+        """Копия счетчиков для чтения из других потоков"""
+        with self._stats_lock:
+            snapshot = dict(self.stats)
+            snapshot['finish_reasons'] = dict(self.stats['finish_reasons'])
+        return snapshot
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def active_count(self):
+        return len(self._active)
+
+    def _run(self):
+        with torch.inference_mode():
+            while not self._stop_event.is_set():
+                try:
+                    self._run_jobs()
+                    new_requests = self._collect()
+                    if new_requests:
+                        self._prefill(new_requests)
+                    if self._active:
+                        self._decode_step()
+                except Exception as e:
+                    logger.error(f"Ошибка в цикле генерации: {e}", exc_info=True)
+                    self._fail_active(e)
+
+        self._fail_active(RuntimeError('Engine stopped'))
+
+    def _run_jobs(self):
+        while True:
+            try:
+                fn, future = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                logger.error(f"Ошибка задачи в потоке движка: {e}", exc_info=True)
+                future.set_exception(e)
+
+    def _collect(self):
+        """Забирает новые запросы из очереди с учетом свободных мест в батче"""
+        self._purge_queue()
+        capacity = self.max_batch_size - len(self._active)
+        if capacity <= 0:
+            return []
+
+        collected = []
+        if not self._active:
+            # Батч пуст: ждем первый запрос, затем окно max_wait на набор батча
+            try:
+                collected.append(self._queue.get(timeout=0.1))
+            except queue.Empty:
+                return []
+            deadline = time.monotonic() + self.max_wait
+            while len(collected) < capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    collected.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        else:
+            # Батч уже идет: подхватываем ожидающих без задержки
+            while len(collected) < capacity:
+                try:
+                    collected.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+        return [r for r in collected if not self._drop_if_abandoned(r, queued=True)]
+
+    def _purge_queue(self):
+        """Убирает из очереди отмененные и просроченные запросы, возвращает их число
+
+        Место в очереди освобождается сразу, не дожидаясь, пока запрос дойдет до начала очереди.
+        """
+        now = time.monotonic()
+        dropped = self._queue.remove_if(lambda r: r.cancelled or r.expired(now))
+        for gen_request in dropped:
+            self._drop_if_abandoned(gen_request, queued=True)
+        return len(dropped)
+
+    def _prefill(self, new_requests):
+        """Энкодер изображений и prefill для новых запросов одним батчем"""
+        now = time.monotonic()
+        for gen_request in new_requests:
+            gen_request.started_at = now
+            self.histograms['queue_wait'].observe(now - gen_request.created_at)
+            if any(criterion.needs_text for criterion in gen_request.stopping):
+                gen_request.detokenizer = IncrementalDetokenizer(self.runner.decode_text)
+
+        try:
+            self._encode(new_requests)
+        except Exception as e:
+            logger.error(f"Ошибка энкодера изображений: {e}", exc_info=True)
+            for gen_request in new_requests:
+                self._finish(gen_request, 'error', error=e)
+            return
+
+        for gen_request in new_requests:
+            if gen_request.encode_only:
+                self._finish(gen_request, 'encoded')
+        new_requests = [r for r in new_requests if not r.encode_only]
+        if not new_requests:
+            return
+
+        prefill_start = time.monotonic()
+        try:
+            embeds, prefixes = [], []
+            shared = self._shared_image_prefixes(new_requests)
+            for gen_request in new_requests:
+                prefix_length, prefix = shared.get(id(gen_request)) or self._match_prefix(gen_request)
+                gen_request.prefix_tokens = prefix_length
+                embeds.append(self.runner.embed_inputs(gen_request.input_ids[prefix_length:], gen_request.image_features))
+                prefixes.append(prefix)
+                self.stats['prefix_tokens_reused'] += prefix_length
+                self.stats['prefill_tokens'] += embeds[-1].shape[0]
+            logits, batch = self.runner.prefill(embeds, prefixes)
+        except Exception as e:
+            logger.error(f"Ошибка prefill: {e}", exc_info=True)
+            for gen_request in new_requests:
+                self._finish(gen_request, 'error', error=e)
+            return
+
+        prefill_ms = (time.monotonic() - prefill_start) * 1000
+        for gen_request in new_requests:
+            gen_request.prefill_ms = prefill_ms
+        self.stats['prefill_batches'] += 1
+        keep = self._accept_tokens(new_requests, logits)
+        if not keep:
+            return
+
+        batch = batch.select(keep) if len(keep) < len(new_requests) else batch
+        survivors = [new_requests[i] for i in keep]
+        if self._batch is None:
+            self._batch = batch
+            self._active = survivors
+        else:
+            self._batch = self._batch.concat(batch)
+            self._active = self._active + survivors
+        self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(self._active))
+
+    def _match_prefix(self, gen_request):
+        """Длина и KV самого длинного префикса из кэша префиксов, (0, None) - нет совпадения"""
+        if self.prefix_cache is None:
+            return 0, None
+        return self.prefix_cache.match(gen_request.input_ids)
+
+    def _shared_image_prefixes(self, requests):
+        """KV общего начала промпта вместе с изображением для запросов к одному изображению
+
+        Несколько промптов к одному изображению (/analyze/multi) различаются только текстом
+        после изображения: начало промпта и признаки изображения проходят prefill один раз,
+        строки батча продолжают с копии этого KV. Возвращает {id(запроса): (длина, KVBatch)}.
+        """
+        groups = {}
+        for gen_request in requests:
+            input_ids = gen_request.input_ids
+            if gen_request.image_key is None or gen_request.image_features is None:
+                continue
+            if self.runner.image_token_index not in input_ids:
+                continue
+            end = input_ids.index(self.runner.image_token_index) + 1
+            if end < len(input_ids):
+                groups.setdefault((gen_request.image_key, tuple(input_ids[:end])), []).append(gen_request)
+
+        shared = {}
+        for (_, head), group in groups.items():
+            if len(group) < 2:
+                continue
+            # Кэш префиксов хранит только текст, поэтому совпадение не заходит за изображение
+            prefix_length, prefix = self._match_prefix(group[0])
+            embeds = self.runner.embed_inputs(list(head[prefix_length:]), group[0].image_features)
+            _, batch = self.runner.prefill([embeds], [prefix])
+            self.stats['prefill_tokens'] += embeds.shape[0]
+            self.stats['image_prefixes_shared'] += len(group) - 1
+            for gen_request in group:
+                shared[id(gen_request)] = (len(head), batch)
+        return shared
+
+    def _encode(self, requests):
+        """Признаки изображений: из кэша или через энкодер, одно изображение кодируется один раз"""
+        pending = {}
+        for gen_request in requests:
+            if gen_request.image_features is not None or gen_request.image_tensor is None:
+                continue
+            key = gen_request.image_key
+            if key is not None and self.feature_cache is not None:
+                cached = self.feature_cache.get(key)
+                if cached is not None:
+                    gen_request.image_features = cached
+                    self.stats['feature_cache_hits'] += 1
+                    continue
+            pending.setdefault(key if key is not None else id(gen_request), []).append(gen_request)
+
+        if not pending:
+            return
+
+        groups = list(pending.values())
+        start = time.monotonic()
+        encoded = self.runner.encode_images([group[0].image_tensor for group in groups])
+        encode_ms = (time.monotonic() - start) * 1000
+        self.stats['images_encoded'] += len(groups)
+        for group, features in zip(groups, encoded):
+            for gen_request in group:
+                gen_request.image_features = features
+                gen_request.encode_ms = encode_ms
+            key = group[0].image_key
+            if key is not None and self.feature_cache is not None:
+                self.feature_cache.put(key, features)
+
+    def _decode_step(self):
+        """Один токен для каждой активной последовательности"""
+        keep = [i for i, r in enumerate(self._active) if not self._drop_if_abandoned(r)]
+        if len(keep) < len(self._active):
+            self._shrink(keep)
+            if not self._active:
+                return
+
+        last_tokens = [r.output_ids[-1] for r in self._active]
+        logits = self.runner.decode(self._batch, last_tokens)
+        self.stats['decode_steps'] += 1
+        self.histograms['batch_size'].observe(len(self._active))
+
+        keep = self._accept_tokens(self._active, logits)
+        if len(keep) < len(self._active):
+            self._shrink(keep)
+
+    def _accept_tokens(self, requests, logits):
+        """Выбирает следующий токен для каждой строки, возвращает индексы незавершенных"""
+        tokens = sample_tokens(logits, requests)
+        now = time.monotonic()
+        keep = []
+        for i, (gen_request, token_id) in enumerate(zip(requests, tokens)):
+            if gen_request.first_token_at is None:
+                gen_request.first_token_at = now
+                self.stats['ttft_ms_total'] += gen_request.ttft_ms()
+                self.histograms['ttft'].observe(now - gen_request.created_at)
+
+            if token_id in self.runner.eos_token_ids:
+                self._finish(gen_request, 'eos')
+                continue
+
+            gen_request.output_ids.append(token_id)
+            self.stats['tokens_generated'] += 1
+            if gen_request.on_token is not None:
+                try:
+                    gen_request.on_token(token_id)
+                except Exception as e:
+                    logger.warning(f"Ошибка в on_token: {e}")
+
+            if len(gen_request.output_ids) >= gen_request.max_new_tokens:
+                self._finish(gen_request, 'length')
+                continue
+            reason = gen_request.check_stopping()
+            if reason is not None:
+                self._finish(gen_request, reason)
+                continue
+            keep.append(i)
+        return keep
+
+    def _shrink(self, keep):
+        if not keep:
+            self._active = []
+            self._batch = None
+            return
+        self._batch = self._batch.select(keep)
+        self._active = [self._active[i] for i in keep]
+
+    def _drop_if_abandoned(self, gen_request, queued=False):
+        """Снимает запрос, отмененный клиентом или с прошедшим дедлайном; место отдается следующим"""
+        if gen_request.cancelled:
+            self._count('requests_cancelled', 'requests_dropped' if queued else None)
+            self._finish(gen_request, 'cancelled')
+        elif gen_request.expired():
+            self._count('requests_expired', 'requests_dropped' if queued else None)
+            self._finish(gen_request, 'expired', error=DeadlineExceededError('queue' if queued else 'generation'))
+        else:
+            return False
+        return True
+
+    def _count(self, *names):
+        """Увеличивает счетчики stats на 1 под блокировкой (None пропускается)"""
+        with self._stats_lock:
+            for name in names:
+                if name is not None:
+                    self.stats[name] += 1
+
+    def _finish(self, gen_request, reason, error=None):
+        # Место пользователя среди активных освобождается для его следующих запросов
+        self._queue.release(gen_request)
+        gen_request.finish_reason = reason
+        gen_request.finished_at = time.monotonic()
+        if gen_request.future.done():
+            return
+        failed = error is not None and not isinstance(error, DeadlineExceededError)
+        completed = error is None and reason != 'cancelled'
+        with self._stats_lock:
+            reasons = self.stats['finish_reasons']
+            reasons[reason] = reasons.get(reason, 0) + 1
+            if failed:
+                self.stats['requests_failed'] += 1
+            if completed:
+                self.stats['requests_completed'] += 1
+        if error is not None:
+            gen_request.future.set_exception(error)
+        else:
+            if completed:
+                self._record_service_time(gen_request)
+                if not gen_request.encode_only:
+                    self.histograms['tokens'].observe(len(gen_request.output_ids))
+            gen_request.future.set_result(gen_request.output_ids)
+
+    def _record_service_time(self, gen_request):
+        if not gen_request.encode_only:
+            self.warmed_up = True
+            self._recent_latencies.append(gen_request.finished_at - gen_request.created_at)
+            self.latency_p50 = statistics.median(self._recent_latencies)
+        if gen_request.started_at is None:
+            return
+        elapsed = gen_request.finished_at - gen_request.started_at
+        if self.avg_service_time is None:
+            self.avg_service_time = elapsed
+        else:
+            self.avg_service_time += self.SERVICE_TIME_ALPHA * (elapsed - self.avg_service_time)
+
+    def _fail_active(self, error):
+        for gen_request in self._active:
+            self._finish(gen_request, 'error', error=error)
+        self._active = []
+        self._batch = None
+
+
+def sample_tokens(logits, requests):
+    """Greedy или сэмплирование с температурой - отдельно для каждой строки батча"""
+    greedy = logits.argmax(dim=-1)
+    temperatures = [r.temperature if r.do_sample and r.temperature > 0 else 0.0 for r in requests]
+    if not any(temperatures):
+        return greedy.tolist()
+
+    temps = torch.tensor(temperatures, dtype=logits.dtype, device=logits.device)
+    probs = torch.softmax(logits / temps.clamp(min=1e-5).unsqueeze(1), dim=-1)
+    sampled = torch.multinomial(probs, num_samples=1).squeeze(1)
+    return torch.where(temps > 0, sampled, greedy).tolist()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Загрузка изображений из памяти для FastVLM
+Фото с телефона (12 Мп) не декодируется в полном размере: JPEG сразу декодируется
+в уменьшенном масштабе (draft), остальные форматы уменьшаются целым множителем (reduce).
+Финальный resize до входа модели остается за препроцессором (process_images).
+"""
+
+import io
+
+from PIL import Image, ImageOps
+
+
+def load_image(data, target_size=None, max_size=None):
+    """Декодирует байты изображения в RGB с учетом EXIF-ориентации
+
+    target_size - сторона входа модели: длинная сторона результата не станет меньше нее.
+    max_size - предел длинной стороны результата (Config.MAX_IMAGE_SIZE).
+    """
+    image = Image.open(io.BytesIO(data))
+
+    if target_size:
+        requested = _reduced_size(image.size, target_size)
+        if requested != image.size:
+            # Для JPEG масштаб 1/2..1/8 выбирается на этапе декодирования DCT,
+            # для остальных форматов draft ничего не делает
+            image.draft('RGB', requested)
+
+    # Поворот по EXIF до любых размеров: длинная сторона от него не меняется
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    if target_size:
+        factor = max(image.size) // target_size
+        if factor >= 2:
+            image = image.reduce(factor)
+
+    if max_size and max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.Resampling.BICUBIC)
+
+    return image
+
+
+def _reduced_size(size, target_size):
+    """Наименьший размер с той же пропорцией, у которого длинная сторона >= target_size"""
+    width, height = size
+    longest = max(width, height)
+    if longest <= target_size:
+        return size
+    # Деление с округлением вверх в целых числах
+    return -(-width * target_size // longest), -(-height * target_size // longest)
+
+
+def synthetic_jpeg(width, height, quality=90):
+    """JPEG с шумом заданного размера для прогрева: декодер и препроцессор работают как на фото"""
+    size = (width, height)
+    image = Image.merge('RGB', [Image.effect_noise(size, 64) for _ in range(3)])
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
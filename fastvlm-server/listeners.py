@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Слушающие сокеты сервера: TCP и Unix domain socket
+Сокеты создаются заранее и передаются Hypercorn как fd:// - одинаково для одного
+процесса и для prefork-воркеров, которые наследуют их от мастера.
+"""
+
+import os
+import stat
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+BACKLOG = 2048
+
+
+def create_tcp_socket(host, port):
+    sock = socket.create_server((host, port), backlog=BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def create_unix_socket(path, mode=0o660):
+    """Unix-сокет по пути path; файл от упавшего процесса удаляется, живой - ошибка"""
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise OSError(f"{path} существует и не является сокетом")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+            logger.info(f"Удален старый сокет {path}")
+        else:
+            raise OSError(f"Сокет {path} уже занят другим процессом")
+        finally:
+            probe.close()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, mode)
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def create_listen_sockets(host, port, unix_path='', unix_mode=0o660, tcp=True):
+    """TCP (если tcp) и Unix-сокет (если задан unix_path)"""
+    sockets = []
+    if tcp:
+        sockets.append(create_tcp_socket(host, port))
+    if unix_path:
+        sockets.append(create_unix_socket(unix_path, unix_mode))
+    if not sockets:
+        raise ValueError('Нет ни TCP, ни Unix-сокета для приема запросов')
+    return sockets
+
+
+def remove_unix_socket(path):
+    if path:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def describe(sockets):
+    """Адреса сокетов для логов: 127.0.0.1:3001, unix:/run/fastvlm.sock"""
+    names = []
+    for sock in sockets:
+        if sock.family == socket.AF_UNIX:
+            names.append(f"unix:{sock.getsockname()}")
+        else:
+            host, port = sock.getsockname()[:2]
+            names.append(f"{host}:{port}")
+    return ', '.join(names)
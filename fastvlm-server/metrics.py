@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Метрики сервера в текстовом формате Prometheus (/metrics) и фоновый сэмплер ресурсов
+Счетчики и гистограммы обновляются по ходу работы (event loop и поток движка),
+значения вроде глубины очереди и попаданий в кэш читаются в момент запроса /metrics.
+CPU, память процесса и память ускорителя снимает фоновый поток, поэтому /load и /gpu
+отдают последний снимок сразу, без psutil.cpu_percent(interval=1) в обработчике.
+"""
+
+import os
+import time
+import bisect
+import logging
+import threading
+
+import psutil
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм по умолчанию: секунды от миллисекунд до минуты
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (1, 8, 16, 32, 64, 128, 256, 512, 1024)
+BATCH_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 32)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    """Метрика с набором меток; samples() - строки (суффикс имени, метки, значение)"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: ожидались метки {self.labels}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        return []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Монотонный счетчик: inc(amount, **метки)"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [('', dict(zip(self.labels, key)), value) for key, value in items]
+
+
+class Histogram(Metric):
+    """Гистограмма с накопительными корзинами (le), суммой и числом наблюдений"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        samples = []
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', {**labels, 'le': _format_value(float(bound))}, cumulative))
+            samples.append(('_sum', labels, round(total, 6)))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class Callback(Metric):
+    """Значение, читаемое при запросе /metrics: fn() -> число или {значение метки: число}
+
+    Для метрики с одной меткой fn возвращает словарь, без меток - число (None - пропустить).
+    kind - gauge или counter (для счетчиков, которые уже ведутся в другом месте).
+    """
+
+    def __init__(self, name, help_text, fn, kind='gauge', labels=()):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.warning(f"Метрика {self.name} не посчитана: {e}")
+            return []
+        if value is None:
+            return []
+        if not self.labels:
+            return [('', {}, value)]
+        return [('', {self.labels[0]: label}, item) for label, item in sorted(value.items()) if item is not None]
+
+
+class Registry:
+    """Набор метрик для /metrics в порядке регистрации"""
+
+    def __init__(self):
+        self._metrics = []
+        self._names = set()
+
+    def register(self, metric):
+        if metric.name in self._names:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics.append(metric)
+        self._names.add(metric.name)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        return self.register(Histogram(name, help_text, buckets, labels))
+
+    def callback(self, name, help_text, fn, kind='gauge', labels=()):
+        return self.register(Callback(name, help_text, fn, kind, labels))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class ResourceSampler:
+    """Фоновый поток: раз в interval секунд снимает CPU, память процесса/системы и память ускорителя
+
+    snapshot() отдает последний снимок без блокировок на измерение. CPU считается
+    между соседними снимками, поэтому в первом снимке его еще нет (None).
+    """
+
+    def __init__(self, interval=5.0, device='cpu'):
+        self.interval = max(0.1, interval)
+        self.device = device
+        self._process = psutil.Process(os.getpid())
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._accelerator = self._describe_accelerator()
+
+    def start(self):
+        # Первый вызов cpu_percent(None) только запоминает точку отсчета
+        psutil.cpu_percent(interval=None)
+        self._process.cpu_percent(interval=None)
+        self._sample(cpu=False)
+        self._thread = threading.Thread(target=self._run, name='fastvlm-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._snapshot) if self._snapshot is not None else None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                logger.warning(f"Ошибка снятия метрик ресурсов: {e}")
+
+    def _sample(self, cpu=True):
+        memory = psutil.virtual_memory()
+        snapshot = {
+            'sampled_at': time.time(),
+            'cpu_percent': psutil.cpu_percent(interval=None) if cpu else None,
+            'process_cpu_percent': self._process.cpu_percent(interval=None) if cpu else None,
+            'process_rss_bytes': self._process.memory_info().rss,
+            'memory_percent': memory.percent,
+            'memory_used_bytes': memory.used,
+            'memory_total_bytes': memory.total,
+            **self._accelerator,
+            **self._accelerator_memory()
+        }
+        with self._lock:
+            self._snapshot = snapshot
+
+    def _describe_accelerator(self):
+        """Постоянные сведения об ускорителе: снимаются один раз"""
+        if self.device == 'cuda' and torch.cuda.is_available():
+            return {
+                'accelerator': 'cuda',
+                'accelerator_name': torch.cuda.get_device_name(0),
+                'accelerator_memory_total_bytes': torch.cuda.get_device_properties(0).total_memory
+            }
+        if self.device == 'mps' and torch.backends.mps.is_available():
+            return {'accelerator': 'mps', 'accelerator_name': 'Apple MPS'}
+        return {'accelerator': None}
+
+    def _accelerator_memory(self):
+        if self._accelerator['accelerator'] == 'cuda':
+            return {
+                'accelerator_memory_allocated_bytes': torch.cuda.memory_allocated(0),
+                'accelerator_memory_reserved_bytes': torch.cuda.memory_reserved(0)
+            }
+        if self._accelerator['accelerator'] == 'mps':
+            return {
+                'accelerator_memory_allocated_bytes': torch.mps.current_allocated_memory(),
+                'accelerator_memory_reserved_bytes': torch.mps.driver_allocated_memory()
+            }
+        return {}
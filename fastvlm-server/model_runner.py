@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Обертка над языковой моделью для пошаговой генерации
+Используется движком батчинга (engine.py) вместо model.generate.
+Runner - интерфейс бэкенда инференса; загрузка конкретного бэкенда - в backends.py.
+"""
+
+import torch
+from transformers import DynamicCache
+
+
+class KVBatch:
+    """Состояние батча: KV-кэш, маска внимания и следующая позиция для каждой строки"""
+
+    def __init__(self, past, attention_mask, positions):
+        # past - кортеж (key, value) по слоям, тензоры формы [B, H, T, D]
+        self.past = past
+        self.attention_mask = attention_mask
+        self.positions = positions
+
+    @property
+    def size(self):
+        return self.attention_mask.shape[0]
+
+    @property
+    def length(self):
+        return self.attention_mask.shape[1]
+
+    def select(self, indices):
+        """Оставляет в батче только указанные строки"""
+        index = torch.tensor(indices, dtype=torch.long, device=self.attention_mask.device)
+        past = tuple(
+            (key.index_select(0, index), value.index_select(0, index))
+            for key, value in self.past
+        )
+        batch = KVBatch(past, self.attention_mask.index_select(0, index), self.positions.index_select(0, index))
+        batch._trim_left()
+        return batch
+
+    def concat(self, other):
+        """Объединяет два батча, выравнивая длины паддингом слева"""
+        length = max(self.length, other.length)
+        left, right = self._pad_left(length), other._pad_left(length)
+        past = tuple(
+            (torch.cat([lk, rk], dim=0), torch.cat([lv, rv], dim=0))
+            for (lk, lv), (rk, rv) in zip(left.past, right.past)
+        )
+        return KVBatch(
+            past,
+            torch.cat([left.attention_mask, right.attention_mask], dim=0),
+            torch.cat([left.positions, right.positions], dim=0)
+        )
+
+    def _pad_left(self, length):
+        pad = length - self.length
+        if pad <= 0:
+            return self
+        past = tuple(
+            (_pad_kv(key, pad), _pad_kv(value, pad))
+            for key, value in self.past
+        )
+        mask_pad = self.attention_mask.new_zeros((self.size, pad))
+        return KVBatch(past, torch.cat([mask_pad, self.attention_mask], dim=1), self.positions)
+
+    def _trim_left(self):
+        """Убирает столбцы паддинга слева, общие для всех строк батча"""
+        used = self.attention_mask.any(dim=0).nonzero()
+        if used.numel() == 0:
+            return
+        start = int(used[0])
+        if start == 0:
+            return
+        self.past = tuple((key[:, :, start:], value[:, :, start:]) for key, value in self.past)
+        self.attention_mask = self.attention_mask[:, start:]
+
+
+def _pad_kv(tensor, pad):
+    shape = list(tensor.shape)
+    shape[2] = pad
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=2)
+
+
+class Runner:
+    """Интерфейс бэкенда инференса, которым пользуются движок батчинга и сервер
+
+    - токены: tokenize_prompt, static_prefix, decode_text, eos_token_ids
+    - изображения: image_size, preprocess_image, encode_images
+    - модель: embed_text, embed_inputs, prefill, compute_prefix, decode (шаг для всего батча)
+
+    Состояние батча - KVBatch: prefill возвращает его, decode обновляет на месте.
+    """
+
+    # Значение-заглушка для позиции изображения в input_ids (как IMAGE_TOKEN_INDEX в llava)
+    image_token_index = -200
+    # Идентификатор модели для ключей кэша результатов и логов
+    name = 'unknown'
+    model_type = 'unknown'
+    context_len = None
+
+    def __init__(self, device, dtype):
+        self.device = device
+        self.dtype = dtype
+        self.eos_token_ids = set()
+
+    @property
+    def image_size(self):
+        """Сторона входа энкодера изображений; None - неизвестна (изображение декодируется целиком)"""
+        return None
+
+    def describe(self):
+        """Сведения о модели для /model"""
+        return {
+            'model_name': self.model_type,
+            'device': str(self.device),
+            'context_length': self.context_len,
+            'torch_dtype': str(self.dtype)
+        }
+
+    def tokenize_prompt(self, prompt):
+        """Токены промпта по шаблону диалога, изображение обозначается image_token_index"""
+        raise NotImplementedError
+
+    def static_prefix(self, prompt):
+        """Токены промпта до изображения - часть, одинаковая для всех запросов с этим промптом"""
+        input_ids = self.tokenize_prompt(prompt)
+        if self.image_token_index in input_ids:
+            return input_ids[:input_ids.index(self.image_token_index)]
+        return input_ids[:-1]
+
+    def decode_text(self, token_ids):
+        raise NotImplementedError
+
+    def preprocess_image(self, image):
+        """PIL-изображение -> тензор входа энкодера"""
+        raise NotImplementedError
+
+    def encode_images(self, image_tensors):
+        """Признаки для батча изображений, по тензору [N, D] на изображение"""
+        raise NotImplementedError
+
+    def embed_text(self, input_ids):
+        """Эмбеддинги для списка токенов, результат формы [L, D]"""
+        raise NotImplementedError
+
+    def embed_inputs(self, input_ids, image_features=None):
+        """Эмбеддинги промпта с подставленными признаками изображения вместо image_token_index"""
+        parts = []
+        chunk = []
+        for token_id in input_ids:
+            if token_id == self.image_token_index:
+                if chunk:
+                    parts.append(self.embed_text(chunk))
+                    chunk = []
+                if image_features is not None:
+                    parts.append(image_features.to(self.dtype))
+            else:
+                chunk.append(token_id)
+        if chunk:
+            parts.append(self.embed_text(chunk))
+        return torch.cat(parts, dim=0)
+
+    def prefill(self, embeds_list, prefixes=None):
+        """Прогоняет промпты батчем, возвращает логиты последней позиции и KVBatch
+
+        prefixes - готовые KV общих префиксов (см. compute_prefix) или None для каждой строки:
+        тогда embeds_list содержит только продолжение промпта после префикса.
+        """
+        raise NotImplementedError
+
+    def compute_prefix(self, input_ids):
+        """KV-состояние для префикса промпта (без изображения), батч из одной строки"""
+        _, batch = self.prefill([self.embed_text(input_ids)])
+        return batch
+
+    def decode(self, batch, token_ids):
+        """Один шаг декодирования для всего батча, обновляет batch на месте и возвращает логиты"""
+        raise NotImplementedError
+
+
+class CausalLMRunner(Runner):
+    """Prefill и шаг декодирования для любой causal LM из transformers через inputs_embeds"""
+
+    def __init__(self, model, tokenizer):
+        super().__init__(model.device, model.dtype)
+        self.model = model
+        self.tokenizer = tokenizer
+        self.model_type = getattr(model.config, 'model_type', 'unknown')
+        self.name = self.model_type
+
+        # Базовая модель без lm_head: логиты считаем только для последней позиции
+        self.base_model = model.get_model() if hasattr(model, 'get_model') else model.model
+        self.lm_head = model.get_output_embeddings()
+        self.embed_tokens = model.get_input_embeddings()
+
+        if tokenizer is not None and tokenizer.eos_token_id is not None:
+            self.eos_token_ids.add(tokenizer.eos_token_id)
+        generation_config = getattr(model, 'generation_config', None)
+        eos = getattr(generation_config, 'eos_token_id', None)
+        if isinstance(eos, int):
+            self.eos_token_ids.add(eos)
+        elif eos:
+            self.eos_token_ids.update(eos)
+
+    def embed_text(self, input_ids):
+        ids = torch.tensor(input_ids, dtype=torch.long, device=self.device)
+        return self.embed_tokens(ids)
+
+    def prefill(self, embeds_list, prefixes=None):
+        """Prefill батчем с паддингом слева, см. Runner.prefill"""
+        length = max(embeds.shape[0] for embeds in embeds_list)
+        hidden_size = embeds_list[0].shape[-1]
+        batch_size = len(embeds_list)
+
+        inputs_embeds = torch.zeros((batch_size, length, hidden_size), dtype=self.dtype, device=self.device)
+        attention_mask = torch.zeros((batch_size, length), dtype=torch.long, device=self.device)
+        for row, embeds in enumerate(embeds_list):
+            inputs_embeds[row, length - embeds.shape[0]:] = embeds.to(self.dtype)
+            attention_mask[row, length - embeds.shape[0]:] = 1
+
+        past, past_mask = self._stack_prefixes(prefixes or [None] * batch_size)
+        position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0) + past_mask.sum(dim=1, keepdim=True)
+        attention_mask = torch.cat([past_mask, attention_mask], dim=1)
+
+        hidden, past = self._forward(inputs_embeds, attention_mask, position_ids, past)
+        return self._logits(hidden), KVBatch(past, attention_mask, attention_mask.sum(dim=1))
+
+    def _stack_prefixes(self, prefixes):
+        """Собирает KV префиксов разной длины в один past, выравнивая паддингом слева"""
+        batch_size = len(prefixes)
+        length = max((prefix.length for prefix in prefixes if prefix is not None), default=0)
+        past_mask = torch.zeros((batch_size, length), dtype=torch.long, device=self.device)
+        if length == 0:
+            return None, past_mask
+
+        template = next(prefix for prefix in prefixes if prefix is not None).past
+        past = []
+        for layer, (key, value) in enumerate(template):
+            keys = key.new_zeros((batch_size, key.shape[1], length, key.shape[3]))
+            values = value.new_zeros((batch_size, value.shape[1], length, value.shape[3]))
+            for row, prefix in enumerate(prefixes):
+                if prefix is None:
+                    continue
+                prefix_key, prefix_value = prefix.past[layer]
+                keys[row, :, length - prefix.length:] = prefix_key[0]
+                values[row, :, length - prefix.length:] = prefix_value[0]
+            past.append((keys, values))
+
+        for row, prefix in enumerate(prefixes):
+            if prefix is not None:
+                past_mask[row, length - prefix.length:] = prefix.attention_mask[0]
+        return tuple(past), past_mask
+
+    def decode(self, batch, token_ids):
+        tokens = torch.tensor(token_ids, dtype=torch.long, device=self.device).unsqueeze(1)
+        inputs_embeds = self.embed_tokens(tokens)
+        attention_mask = torch.cat([batch.attention_mask, batch.attention_mask.new_ones((batch.size, 1))], dim=1)
+        position_ids = batch.positions.unsqueeze(1)
+
+        hidden, past = self._forward(inputs_embeds, attention_mask, position_ids, batch.past)
+        batch.past = past
+        batch.attention_mask = attention_mask
+        batch.positions = batch.positions + 1
+        return self._logits(hidden)
+
+    def decode_text(self, token_ids):
+        return self.tokenizer.decode(token_ids, skip_special_tokens=True)
+
+    def _forward(self, inputs_embeds, attention_mask, position_ids, past):
+        cache = DynamicCache.from_legacy_cache(past) if past is not None else DynamicCache()
+        outputs = self.base_model(
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True,
+            return_dict=True
+        )
+        past = outputs.past_key_values
+        if hasattr(past, 'to_legacy_cache'):
+            past = past.to_legacy_cache()
+        return outputs.last_hidden_state[:, -1], past
+
+    def _logits(self, hidden):
+        return self.lm_head(hidden).float()
+
+
+class FastVLMRunner(CausalLMRunner):
+    """Runner для FastVLM: шаблон диалога qwen_2, препроцессинг и энкодер изображений"""
+
+    def __init__(self, model, tokenizer, image_processor, conv_mode='qwen_2', image_position='before',
+                 name=None, context_len=None):
+        from llava.constants import IMAGE_TOKEN_INDEX
+
+        super().__init__(model, tokenizer)
+        self.image_token_index = IMAGE_TOKEN_INDEX
+        self.name = name or self.model_type
+        self.context_len = context_len
+        self.image_processor = image_processor
+        self.conv_mode = conv_mode
+        # 'before' - изображение перед текстом (как при обучении),
+        # 'after' - после инструкций: тогда весь промпт становится общим префиксом
+        self.image_position = image_position
+
+    @property
+    def image_size(self):
+        """Сторона квадратного входа vision tower (1024 для FastViTHD) или None, если неизвестна"""
+        crop_size = getattr(self.image_processor, 'crop_size', None)
+        if isinstance(crop_size, dict) and 'height' in crop_size:
+            return max(crop_size['height'], crop_size['width'])
+        size = getattr(self.image_processor, 'size', None)
+        if isinstance(size, dict):
+            return size.get('shortest_edge') or max(size.get('height', 0), size.get('width', 0)) or None
+        return None
+
+    def tokenize_prompt(self, prompt):
+        """Строит промпт по шаблону диалога, изображение обозначается IMAGE_TOKEN_INDEX"""
+        from llava.conversation import conv_templates
+        from llava.mm_utils import tokenizer_image_token
+        from llava.constants import DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN
+
+        image_token = DEFAULT_IMAGE_TOKEN
+        if self.model.config.mm_use_im_start_end:
+            image_token = DEFAULT_IM_START_TOKEN + DEFAULT_IMAGE_TOKEN + DEFAULT_IM_END_TOKEN
+
+        if self.image_position == 'after':
+            qs = prompt + '\n' + image_token
+        else:
+            qs = image_token + '\n' + prompt
+
+        conv = conv_templates[self.conv_mode].copy()
+        conv.append_message(conv.roles[0], qs)
+        conv.append_message(conv.roles[1], None)
+        return tokenizer_image_token(conv.get_prompt(), self.tokenizer, self.image_token_index)
+
+    def preprocess_image(self, image):
+        from llava.mm_utils import process_images
+        return process_images([image], self.image_processor, self.model.config)[0]
+
+    def encode_images(self, image_tensors):
+        """Vision tower + проектор для батча изображений"""
+        images = torch.stack(image_tensors).to(self.device, dtype=self.dtype)
+        features = self.model.encode_images(images)
+        return [feature.flatten(0, -2) for feature in features]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Конвейер подготовки запросов: этапы со своими пулами потоков перед движком модели
+decode (base64 -> изображение, хэш) -> preprocess (resize/normalize в тензор, токенизация) -> модель.
+Пока движок генерирует запрос N, пулы этапов уже готовят тензоры запроса N+1.
+"""
+
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Stage:
+    """Этап конвейера: пул потоков и счетчики очереди, выполняемых задач и времени"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_ms_total = 0.0
+        self.run_ms_total = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f'fastvlm-{name}')
+
+    async def run(self, fn, *args, timings=None, **kwargs):
+        """Выполняет fn в пуле этапа и ждет результат, не занимая event loop
+
+        timings - RequestTimings запроса: ожидание и работа этапа пишутся в <name>_wait_ms и <name>_ms.
+        """
+        submitted = time.monotonic()
+
+        def task():
+            started = time.monotonic()
+            if timings is not None:
+                timings.add(f'{self.name}_wait_ms', (started - submitted) * 1000)
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.wait_ms_total += (started - submitted) * 1000
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                run_ms = (time.monotonic() - started) * 1000
+                if timings is not None:
+                    timings.add(f'{self.name}_ms', run_ms)
+                with self._lock:
+                    self.running -= 1
+                    self.run_ms_total += run_ms
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+        with self._lock:
+            self.queued += 1
+        future = self._executor.submit(task)
+        # Задача, отмененная до старта (клиент отключился), так и не уйдет из очереди сама
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                'workers': self.workers,
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_ms': round(self.wait_ms_total / finished, 2) if finished else None,
+                'avg_run_ms': round(self.run_ms_total / finished, 2) if finished else None
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _on_done(self, future):
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Prefork-режим для CPU: мастер загружает модель один раз и форкает воркеры
+Веса модели лежат в памяти мастера и достаются воркерам copy-on-write,
+общие слушающие сокеты распределяют соединения между воркерами (accept в ядре).
+"""
+
+import gc
+import os
+import sys
+import time
+import signal
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед перезапуском упавшего воркера, секунды
+RESPAWN_DELAY = 1.0
+
+
+def prefork_supported(device):
+    """Prefork возможен только на CPU и там, где есть os.fork (не Windows)"""
+    return device == 'cpu' and hasattr(os, 'fork')
+
+
+def prepare_master():
+    """Настройка мастера до загрузки модели
+
+    libgomp не переживает fork после параллельного региона: если мастер хоть раз
+    запустил OpenMP-потоки, матричные операции в воркерах зависают. Поэтому мастер
+    работает в один поток, а число потоков задает каждый воркер после fork.
+    """
+    torch.set_num_threads(1)
+    # Rust-токенизатор после fork все равно отключает параллелизм - без предупреждений
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+
+def worker_threads(workers, threads=0):
+    """Потоки intra-op на воркер: заданное число или поровну ядер на каждый воркер"""
+    if threads > 0:
+        return threads
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def pin_worker(index, threads, affinity=False):
+    """Фиксирует число потоков torch в воркере и (опционально) привязывает его к своим ядрам"""
+    torch.set_num_threads(threads)
+
+    if affinity and hasattr(os, 'sched_setaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+        start = (index * threads) % len(cores)
+        own = [cores[(start + i) % len(cores)] for i in range(min(threads, len(cores)))]
+        os.sched_setaffinity(0, own)
+        logger.info(f"Воркер {index}: ядра {own}")
+
+
+def run_prefork(workers, worker_main):
+    """Форкает workers воркеров и перезапускает упавшие, пока не придет сигнал завершения
+
+    worker_main(index) выполняется в дочернем процессе и должен вернуться,
+    когда воркер остановлен (код выхода 0) или бросить исключение (код 1).
+    """
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            gc.unfreeze()
+            exit_code = 0
+            try:
+                worker_main(index)
+            except BaseException as e:
+                logger.error(f"Воркер {index} завершился с ошибкой: {e}", exc_info=True)
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+        children[pid] = index
+        logger.info(f"Воркер {index} запущен: pid {pid}")
+
+    def on_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    # Объекты мастера (модель, токенизатор) уходят из-под сборщика мусора:
+    # иначе он трогает их заголовки в воркерах и страницы копируются
+    gc.collect()
+    gc.freeze()
+
+    for index in range(workers):
+        spawn(index)
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        index = children.pop(pid, None)
+        if index is None:
+            continue
+
+        if stopping:
+            logger.info(f"Воркер {index} (pid {pid}) остановлен")
+            continue
+
+        logger.warning(f"Воркер {index} (pid {pid}) упал, код {os.waitstatus_to_exitcode(status)}; перезапуск")
+        time.sleep(RESPAWN_DELAY)
+        if not stopping:
+            spawn(index)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Справедливая очередь запросов движка: взвешенное разделение между пользователями
+Запросы одного пользователя и класса приоритета образуют поток. Порядок выдачи -
+start-time fair queuing: у каждого запроса есть виртуальное время старта, поток
+продвигается на 1/weight за запрос, новый поток стартует с текущего виртуального
+времени. Поэтому альбом из 30 фото одного пользователя не задерживает одиночное
+фото другого, а interactive получает weight/weight_background долю перед background.
+"""
+
+import queue
+import threading
+import time
+
+PRIORITIES = ('interactive', 'background')
+
+
+class UserLimitReached(queue.Full):
+    """У пользователя уже max_user_queued запросов в очереди"""
+
+    def __init__(self, user):
+        super().__init__(user)
+        self.user = user
+
+
+class _Entry:
+    __slots__ = ('item', 'flow', 'start', 'seq')
+
+    def __init__(self, item, flow, start, seq):
+        self.item = item
+        self.flow = flow
+        self.start = start
+        self.seq = seq
+
+    def tag(self):
+        return (self.start, self.seq)
+
+
+class FairQueue:
+    """Очередь с интерфейсом queue.Queue (put_nowait, get, get_nowait, full, qsize) и WFQ-порядком
+
+    Элемент - объект с атрибутами user (None - анонимный запрос, свой поток у каждого),
+    priority (из PRIORITIES) и group. max_user_queued - запросов пользователя в очереди,
+    max_user_active - выданных и не освобожденных через release() (0 - без ограничения).
+    Пользователь на пределе активных пропускается, пока его запрос не завершится.
+    Элементы с общим group (промпты /analyze/multi к одному изображению) занимают
+    одно место среди активных, чтобы попасть в один prefill.
+    """
+
+    def __init__(self, maxsize=0, weights=None, max_user_queued=0, max_user_active=0):
+        self.maxsize = maxsize
+        self.weights = weights or {'interactive': 4.0, 'background': 1.0}
+        self.max_user_queued = max_user_queued
+        self.max_user_active = max_user_active
+
+        self._entries = []
+        self._finish = {}
+        self._queued = {}
+        self._active = {}
+        self._virtual_time = 0.0
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+
+        self.served = {priority: 0 for priority in PRIORITIES}
+        self.deferred = 0
+
+    def put_nowait(self, item):
+        """Ставит элемент в очередь, возвращает позицию (сколько запросов будет выдано раньше)
+
+        Бросает queue.Full при заполненной очереди и UserLimitReached при пределе пользователя.
+        """
+        with self._lock:
+            if self.maxsize and len(self._entries) >= self.maxsize:
+                raise queue.Full
+            user = item.user
+            if user is not None and self.max_user_queued and self._queued.get(user, 0) >= self.max_user_queued:
+                raise UserLimitReached(user)
+
+            self._seq += 1
+            flow = (item.priority, user if user is not None else ('anonymous', self._seq))
+            start = max(self._virtual_time, self._finish.get(flow, 0.0))
+            self._finish[flow] = start + 1.0 / self.weights.get(item.priority, 1.0)
+            entry = _Entry(item, flow, start, self._seq)
+            self._entries.append(entry)
+            if user is not None:
+                self._queued[user] = self._queued.get(user, 0) + 1
+            self._ready.notify()
+            return sum(1 for other in self._entries if other.tag() < entry.tag())
+
+    def get_nowait(self):
+        with self._lock:
+            entry = self._pop_eligible()
+            if entry is None:
+                raise queue.Empty
+            return entry.item
+
+    def get(self, timeout=None):
+        """Ждет элемент, который можно выдать (с учетом пределов пользователей)"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            while True:
+                entry = self._pop_eligible()
+                if entry is not None:
+                    return entry.item
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._ready.wait(remaining)
+
+    def release(self, item):
+        """Запрос, выданный get(), завершен: место пользователя среди активных свободно"""
+        with self._lock:
+            if not getattr(item, 'scheduled', False):
+                return
+            item.scheduled = False
+            user = item.user
+            groups = self._active.get(user)
+            if groups is not None:
+                group = self._group(item)
+                groups[group] -= 1
+                if groups[group] <= 0:
+                    del groups[group]
+                if not groups:
+                    del self._active[user]
+            self._ready.notify()
+
+    def remove_if(self, predicate):
+        """Убирает из очереди элементы, для которых predicate(item) истинно, возвращает их"""
+        with self._lock:
+            kept, removed = [], []
+            for entry in self._entries:
+                (removed if predicate(entry.item) else kept).append(entry)
+            if not removed:
+                return []
+            self._entries = kept
+            for entry in removed:
+                self._forget_queued(entry.item.user)
+            return [entry.item for entry in removed]
+
+    def full(self, user=None):
+        """Новый запрос (пользователя user) будет отклонен"""
+        with self._lock:
+            if self.maxsize and len(self._entries) >= self.maxsize:
+                return True
+            return user is not None and bool(self.max_user_queued) and self._queued.get(user, 0) >= self.max_user_queued
+
+    def qsize(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': {priority: sum(1 for e in self._entries if e.flow[0] == priority) for priority in PRIORITIES},
+                'served': dict(self.served),
+                'users_queued': len(self._queued),
+                'users_active': len(self._active),
+                'deferred_by_user_cap': self.deferred,
+                'weights': dict(self.weights),
+                'max_user_queued': self.max_user_queued,
+                'max_user_active': self.max_user_active
+            }
+
+    def _pop_eligible(self):
+        """Элемент с наименьшим временем старта среди пользователей ниже предела активных"""
+        best = None
+        skipped = False
+        for entry in self._entries:
+            if not self._can_activate(entry.item):
+                skipped = True
+                continue
+            if best is None or entry.tag() < best.tag():
+                best = entry
+        if best is None:
+            return None
+        if skipped:
+            self.deferred += 1
+
+        self._entries.remove(best)
+        self._virtual_time = max(self._virtual_time, best.start)
+        # Потоки, отставшие от виртуального времени, больше не нужны: новый запрос начнет с него
+        self._finish = {flow: finish for flow, finish in self._finish.items() if finish > self._virtual_time}
+        user = best.item.user
+        self._forget_queued(user)
+        if user is not None:
+            groups = self._active.setdefault(user, {})
+            group = self._group(best.item)
+            groups[group] = groups.get(group, 0) + 1
+        best.item.scheduled = True
+        self.served[best.flow[0]] = self.served.get(best.flow[0], 0) + 1
+        return best
+
+    def _can_activate(self, item):
+        """Пользователь ниже предела активных или элемент из уже активной группы"""
+        if item.user is None or not self.max_user_active:
+            return True
+        groups = self._active.get(item.user, {})
+        return len(groups) < self.max_user_active or self._group(item) in groups
+
+    @staticmethod
+    def _group(item):
+        group = getattr(item, 'group', None)
+        return group if group is not None else id(item)
+
+    def _forget_queued(self, user):
+        if user is None:
+            return
+        self._queued[user] -= 1
+        if self._queued[user] <= 0:
+            del self._queued[user]
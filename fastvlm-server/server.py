@@ -4,41 +4,134 @@ FastVLM Server - отдельный сервер для анализа изоб
 Запускается в отдельном процессе от основного приложения
 """
 
+import time
+
+# Начало запуска процесса: время импорта модулей (torch, quart) входит в разбивку старта
+PROCESS_STARTED = time.monotonic()
+
 import sys
 import json
 import base64
-import tempfile
 import signal
-import time
+import copy
+import threading
+import asyncio
+import contextlib
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify
-from PIL import Image
-import io
+from urllib.parse import unquote
+from quart import Quart, Response, g, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+from hypercorn.asyncio import serve
+from hypercorn.config import Config as HypercornConfig
 import os
-import psutil
 
 # Импортируем конфигурацию
 from config import Config
+from pipeline import Stage
+from scheduler import PRIORITIES
+from singleflight import SingleFlight, WaiterDeadlineExceeded
+from metrics import Registry, ResourceSampler
+from tracing import REQUEST_ID_HEADER, RequestIdFilter, RequestTimings, log_timings, new_request_id, request_id_var
+from engine import (
+    BatchingEngine, DeadlineExceededError, GenerationRequest, QueueFullError, UserQueueFullError, WaitLimitError,
+    WarmingUpError
+)
+from cache import FeatureCache, PrefixCache, ResultCache, image_hash, make_key
+from streaming import IncrementalDetokenizer, sse_comment, sse_event, strip_incomplete
+from stopping import NATURAL_STOP_REASONS, criteria_settings, default_criteria
+from backends import load_backend
+from imaging import load_image, synthetic_jpeg
+from prefork import (
+    pin_worker, prefork_supported, prepare_master, run_prefork, worker_threads
+)
+from listeners import create_listen_sockets, describe, remove_unix_socket
 
-# Импортируем необходимые модули для FastVLM
 import torch
 
-# Импортируем FastVLM
-sys.path.append('../ml-fastvlm')
-from llava.utils import disable_torch_init
-from llava.conversation import conv_templates
-from llava.model.builder import load_pretrained_model
-from llava.mm_utils import tokenizer_image_token, process_images, get_model_name_from_path
-from llava.constants import IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN
-
-app = Flask(__name__)
-
-# Глобальные переменные для модели
-model = None
-tokenizer = None
-image_processor = None
-context_len = None
+# Этапы запуска в мс от начала процесса: одна JSON-запись "event": "startup" после прогрева
+startup_timings = RequestTimings(request_id='startup')
+startup_timings.started = PROCESS_STARTED
+startup_timings.add('import_ms', (time.monotonic() - PROCESS_STARTED) * 1000)
+
+app = Quart(__name__)
+# Предел тела запроса с одним изображением: изображение в base64 (+33%) и поля JSON
+MAX_REQUEST_BYTES = Config.MAX_UPLOAD_BYTES * 4 // 3 + 65536
+# Общий предел Quart - по самому большому запросу (/analyze/batch), остальные проверяются отдельно
+app.config['MAX_CONTENT_LENGTH'] = max(MAX_REQUEST_BYTES, Config.BATCH_MAX_BYTES)
+
+# Дедлайн клиента: сколько мс с момента получения запроса ответ еще нужен (поле deadline_ms)
+DEADLINE_HEADER = 'X-Deadline-Ms'
+# Справедливая очередь: пользователь (telegramId от Node) и класс приоритета запроса
+USER_HEADER = 'X-User-ID'
+PRIORITY_HEADER = 'X-Priority'
+MAX_USER_ID_LENGTH = 128
+# Быстрый отказ: сколько мс клиент готов ждать в очереди движка (поле max_wait_ms)
+MAX_WAIT_HEADER = 'X-Max-Wait-Ms'
+# Поля, которые для JSON и multipart можно передать и заголовками
+HEADER_PARAMS = {
+    'deadline_ms': DEADLINE_HEADER,
+    'user_id': USER_HEADER,
+    'priority': PRIORITY_HEADER,
+    'max_wait_ms': MAX_WAIT_HEADER
+}
+
+# Параметры анализа для загрузки сырыми байтами: имя в query-строке -> заголовок
+UPLOAD_PARAMS = {
+    'prompt': 'X-Prompt',
+    'deterministic': 'X-Deterministic',
+    'cache_bypass': 'X-Cache-Bypass',
+    'prompts': 'X-Prompts',
+    'timings': 'X-Timings',
+    **HEADER_PARAMS
+}
+
+# Промпты /analyze/multi по умолчанию: короткий отдельный ответ на каждый аспект образа
+ASPECT_PROMPTS = {
+    'type': 'What clothing items are in the image? List their types briefly.',
+    'color': 'What are the main colors of the clothing items? Answer briefly.',
+    'material': 'What materials are the clothing items made of? Answer briefly.',
+    'style': 'What is the style of the outfit (casual, business, evening, sporty, etc.)? Answer briefly.'
+}
+
+# Этапы подготовки запроса до движка: декодирование и препроцессинг в своих пулах
+decode_stage = Stage('decode', Config.DECODE_WORKERS)
+preprocess_stage = Stage('preprocess', Config.PREPROCESS_WORKERS)
+
+# Потоки для прочей блокирующей работы (кэш на диске, перезагрузка промпта)
+cpu_executor = ThreadPoolExecutor(max_workers=Config.CPU_WORKERS, thread_name_prefix='fastvlm-cpu')
+
+# Бэкенд инференса (Runner из backends.py), None - модель не загружена
+runner = None
+# Движок батчинга, владеет моделью во время генерации
+engine = None
+
+# Кэш результатов анализа и кэш признаков изображений (None - отключен)
+result_cache = None
+feature_cache = None
+prefix_cache = None
+
+# Одинаковые анализы в полете (одно изображение, промпт и параметры) выполняются один раз
+inflight = SingleFlight()
+
+# Метрики /metrics: запросы и задержки по эндпоинтам; движок, кэши и ресурсы читаются при запросе
+metrics = Registry()
+request_counter = metrics.counter(
+    'fastvlm_requests_total', 'HTTP-запросы по эндпоинтам и статусам ответа', labels=('endpoint', 'status')
+)
+request_latency = metrics.histogram(
+    'fastvlm_request_duration_seconds', 'Время HTTP-запроса до ответа (у SSE - до заголовков)', labels=('endpoint',)
+)
+deadline_counter = metrics.counter(
+    'fastvlm_deadline_exceeded_total', 'Запросы, снятые по дедлайну клиента, по этапу', labels=('stage',)
+)
+# Фоновый сэмплер CPU/памяти: /load и /gpu отдают его последний снимок
+sampler = None
+
+# Прогрев завершен (или не нужен): до этого /ready отвечает 503 warming_up
+warmup_done = threading.Event()
 
 # Глобальная переменная для промпта
 default_prompt = None
@@ -47,9 +140,9 @@ def setup_logging():
     """Настройка логирования"""
     log_file = os.path.join(Config.LOG_DIR, 'fastvlm.log')
 
-    # Создаем форматтер
+    # Создаем форматтер; request_id - X-Request-ID запроса, в контексте которого сделана запись
     formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
     )
 
     # Создаем ротирующий обработчик
@@ -59,6 +152,7 @@ def setup_logging():
         backupCount=Config.LOG_BACKUP_COUNT
     )
     handler.setFormatter(formatter)
+    handler.addFilter(RequestIdFilter())
 
     # Настраиваем логгер приложения
     app.logger.addHandler(handler)
@@ -103,28 +197,17 @@ def load_prompt():
         print(f"Ошибка загрузки промпта. Используется промпт по умолчанию")
 
 def load_model():
-    """Загружает FastVLM модель в память"""
-    global model, tokenizer, image_processor, context_len
+    """Загружает модель выбранного бэкенда (Config.BACKEND) в память"""
+    global runner
 
     try:
-        print("Загружаем FastVLM модель в память...")
-        app.logger.info("Начало загрузки модели")
-
-        # Проверяем существование модели
-        if not os.path.exists(Config.MODEL_PATH):
-            raise FileNotFoundError(f"Модель не найдена: {Config.MODEL_PATH}")
-
-        # Загружаем модель
-        disable_torch_init()
-        model_name = get_model_name_from_path(Config.MODEL_PATH)
-        tokenizer, model, image_processor, context_len = load_pretrained_model(
-            Config.MODEL_PATH, None, model_name,
-            device=Config.DEVICE,
-            torch_dtype=Config.TORCH_DTYPE
-        )
+        print(f"Загружаем модель в память (бэкенд {Config.BACKEND})...")
+        app.logger.info(f"Начало загрузки модели: бэкенд {Config.BACKEND}")
+
+        runner = load_backend(Config.BACKEND)
 
-        app.logger.info(f"FastVLM модель загружена: {model_name} на {Config.DEVICE}")
-        print("FastVLM модель загружена и готова к работе!")
+        app.logger.info(f"Модель загружена: {runner.name} на {runner.device}")
+        print("Модель загружена и готова к работе!")
         return True
 
     except Exception as e:
@@ -133,6 +216,306 @@ def load_model():
         app.logger.error(error_msg, exc_info=True)
         return False
 
+def start_engine():
+    """Запускает движок непрерывного батчинга поверх загруженной модели"""
+    global engine, feature_cache, prefix_cache
+
+    if Config.FEATURE_CACHE_ENABLED:
+        feature_cache = FeatureCache(Config.FEATURE_CACHE_MAX_BYTES)
+        app.logger.info(f"Кэш признаков изображений: {Config.FEATURE_CACHE_MAX_BYTES} байт")
+
+    if Config.PREFIX_CACHE_ENABLED:
+        prefix_cache = PrefixCache(Config.PREFIX_CACHE_SIZE)
+
+    engine = BatchingEngine(runner, feature_cache=feature_cache, prefix_cache=prefix_cache)
+    engine.start()
+    app.logger.info(f"Движок батчинга запущен: BATCH_SIZE={Config.BATCH_SIZE}, BATCH_WAIT_MS={Config.BATCH_WAIT_MS}")
+    register_metrics()
+
+    register_prompt_prefix()
+
+def warmup_job(width, height):
+    """Задание прогрева с новым синтетическим изображением, мимо кэшей
+
+    Без хэша изображения и ключей: кэш результатов и кэш признаков его не видят
+    (ни записей, ни попаданий в статистике), энкодер работает каждый раз.
+    """
+    job = AnalysisJob({}, image_data=synthetic_jpeg(width, height), priority='background')
+    job.params['max_new_tokens'] = Config.WARMUP_MAX_NEW_TOKENS
+    job.image = decode_image(job.image_data)
+    job.image_data = None
+    job.input_ids = runner.tokenize_prompt(job.prompt)
+    job.image_tensor = runner.preprocess_image(job.image)
+    return job
+
+def run_warmup():
+    """Прогрев: синтетические изображения WARMUP_IMAGE_SIZES проходят decode, препроцессинг и движок
+
+    Сначала по одному (выбор ядер, рост аллокатора, ленивая инициализация под каждый
+    размер), затем при BATCH_SIZE > 1 - полный батч из новых изображений, чтобы прогреть
+    батчевые энкодер, prefill и декодирование. После прогрева медиана задержки, время
+    обслуживания движка и счетчики кэша префиксов сбрасываются. Ошибка прогрева не останавливает сервер:
+    первый запрос просто будет медленнее.
+    """
+    sizes = Config.warmup_sizes()
+    try:
+        for width, height in sizes:
+            warmup_job(width, height).submit().future.result()
+        batch = [sizes[i % len(sizes)] for i in range(Config.BATCH_SIZE)] if sizes and Config.BATCH_SIZE > 1 else []
+        for gen_request in [warmup_job(width, height).submit() for width, height in batch]:
+            gen_request.future.result()
+        if sizes:
+            engine.reset_latency().result()
+            engine.reset_prefix_stats().result()
+            app.logger.info(
+                f"Прогрев завершен: {len(sizes) + len(batch)} изображений ({Config.WARMUP_IMAGE_SIZES}), "
+                f"батч {len(batch)}"
+            )
+    except Exception as e:
+        app.logger.error(f"Ошибка прогрева модели: {e}", exc_info=True)
+    finally:
+        warmup_done.set()
+
+def start_warmup():
+    """Прогрев в фоне: HTTP уже отвечает, /ready - 503 warming_up до конца прогрева
+
+    Затем в лог пишется разбивка времени запуска по этапам.
+    """
+    def warm_up():
+        with startup_timings.measure('warmup_ms'):
+            run_warmup()
+        log_timings(
+            app.logger, 'startup', startup_timings,
+            backend=Config.BACKEND, device=Config.DEVICE, worker_pid=os.getpid(),
+            warmup_sizes=Config.WARMUP_IMAGE_SIZES
+        )
+        print(f"Сервер готов к работе за {startup_timings.total_ms()}ms")
+
+    threading.Thread(target=warm_up, name='fastvlm-warmup', daemon=True).start()
+
+def start_sampler():
+    """Запускает фоновый сэмплер ресурсов (в prefork-режиме - в каждом воркере после fork)"""
+    global sampler
+    sampler = ResourceSampler(Config.RESOURCE_SAMPLE_SECONDS, device=Config.DEVICE)
+    sampler.start()
+
+def cache_stats():
+    """Статистика включенных кэшей по именам: result, feature, prefix"""
+    caches = {'result': result_cache, 'feature': feature_cache, 'prefix': prefix_cache}
+    return {name: cache.stats() for name, cache in caches.items() if cache is not None}
+
+def cache_hit_ratio(stats):
+    total = stats['hits'] + stats['misses']
+    return round(stats['hits'] / total, 4) if total else None
+
+def resource_value(name):
+    """Значение из последнего снимка сэмплера (None - еще нет снимка или значения)"""
+    snapshot = sampler.snapshot() if sampler is not None else None
+    return snapshot.get(name) if snapshot is not None else None
+
+def register_metrics():
+    """Гистограммы движка и метрики, которые читаются при запросе /metrics из движка, пулов, кэшей и сэмплера"""
+    for histogram in engine.histograms.values():
+        metrics.register(histogram)
+    metrics.callback('fastvlm_queue_depth', 'Запросов в очереди движка', lambda: engine.queue_depth())
+    metrics.callback('fastvlm_queue_max_size', 'Размер очереди движка (0 - без ограничения)', lambda: engine.max_queue_size)
+    metrics.callback(
+        'fastvlm_queue_depth_by_priority', 'Запросов в очереди движка по классу приоритета',
+        lambda: engine.scheduler_stats()['queued'], labels=('priority',)
+    )
+    metrics.callback(
+        'fastvlm_scheduled_total', 'Запросов, выданных справедливой очередью в батч',
+        lambda: engine.scheduler_stats()['served'], kind='counter', labels=('priority',)
+    )
+    metrics.callback('fastvlm_active_sequences', 'Последовательностей в батче генерации', lambda: engine.active_count())
+    metrics.callback(
+        'fastvlm_stage_queued', 'Задач в очереди этапа конвейера',
+        lambda: {stage.name: stage.stats()['queued'] for stage in (decode_stage, preprocess_stage)}, labels=('stage',)
+    )
+    metrics.callback(
+        'fastvlm_engine_requests_total', 'Запросы движка по исходу', lambda: {
+            outcome: engine.stats[f'requests_{outcome}'] for outcome in ('completed', 'failed', 'cancelled', 'rejected', 'dropped', 'expired')
+        }, kind='counter', labels=('outcome',)
+    )
+    metrics.callback(
+        'fastvlm_finish_reasons_total', 'Завершенные генерации по причине остановки',
+        lambda: engine.stats_snapshot()['finish_reasons'], kind='counter', labels=('reason',)
+    )
+    for name, help_text in (
+        ('tokens_generated', 'Сгенерировано токенов'),
+        ('prefill_tokens', 'Токенов посчитано в prefill'),
+        ('prefix_tokens_reused', 'Токенов взято из кэша префиксов'),
+        ('images_encoded', 'Изображений прогнано через энкодер')
+    ):
+        metrics.callback(f'fastvlm_{name}_total', help_text, lambda name=name: engine.stats[name], kind='counter')
+    metrics.callback(
+        'fastvlm_coalesced_requests_total', 'Запросов, присоединенных к такому же анализу в полете',
+        lambda: inflight.coalesced, kind='counter'
+    )
+    metrics.callback(
+        'fastvlm_cache_hits_total', 'Попадания в кэш',
+        lambda: {name: stats['hits'] for name, stats in cache_stats().items()}, kind='counter', labels=('cache',)
+    )
+    metrics.callback(
+        'fastvlm_cache_misses_total', 'Промахи кэша',
+        lambda: {name: stats['misses'] for name, stats in cache_stats().items()}, kind='counter', labels=('cache',)
+    )
+    metrics.callback(
+        'fastvlm_cache_hit_ratio', 'Доля попаданий в кэш с запуска',
+        lambda: {name: cache_hit_ratio(stats) for name, stats in cache_stats().items()}, labels=('cache',)
+    )
+    for name, help_text in (
+        ('cpu_percent', 'Загрузка CPU системы, %'),
+        ('process_cpu_percent', 'Загрузка CPU процессом сервера, %'),
+        ('process_rss_bytes', 'Резидентная память процесса'),
+        ('memory_used_bytes', 'Занятая память системы'),
+        ('accelerator_memory_allocated_bytes', 'Память ускорителя, выделенная тензорами'),
+        ('accelerator_memory_reserved_bytes', 'Память ускорителя, зарезервированная аллокатором'),
+        ('accelerator_memory_total_bytes', 'Всего памяти ускорителя')
+    ):
+        metrics.callback(f'fastvlm_{name}', help_text, lambda name=name: resource_value(name))
+
+def register_prompt_prefix():
+    """Предвычисляет токены и KV статичной части промпта по умолчанию"""
+    if prefix_cache is None:
+        return
+
+    prefix_ids = runner.static_prefix(default_prompt)
+    start = time.perf_counter()
+    engine.register_prefix(prefix_ids).result()
+    app.logger.info(
+        f"KV префикса промпта посчитан: {len(prefix_ids)} токенов за {(time.perf_counter() - start) * 1000:.0f}ms "
+        f"(IMAGE_POSITION={Config.IMAGE_POSITION})"
+    )
+
+def init_result_cache():
+    """Создает кэш результатов по настройкам Config"""
+    global result_cache
+
+    if not Config.RESULT_CACHE_ENABLED:
+        app.logger.info("Кэш результатов отключен")
+        return
+
+    result_cache = ResultCache(
+        Config.RESULT_CACHE_MAX_BYTES,
+        ttl=Config.RESULT_CACHE_TTL,
+        cache_dir=Config.RESULT_CACHE_DIR,
+        disk_max_bytes=Config.RESULT_CACHE_DISK_MAX_BYTES
+    )
+    app.logger.info(f"Кэш результатов: {Config.RESULT_CACHE_MAX_BYTES} байт, TTL {Config.RESULT_CACHE_TTL}с, диск: {Config.RESULT_CACHE_DIR or 'нет'}")
+
+def decode_image(image_data):
+    """Декодирует байты изображения сразу в масштабе, близком ко входу модели"""
+    target_size = runner.image_size if runner is not None else None
+    return load_image(image_data, target_size=target_size, max_size=Config.MAX_IMAGE_SIZE)
+
+def output_settings():
+    """Настройки сервера, меняющие текст анализа: постобработка, остановка, место изображения в промпте
+
+    Входят в ключ кэша результатов, чтобы после их смены диск не отдавал старые ответы.
+    """
+    return {
+        'analysis_max_lines': Config.ANALYSIS_MAX_LINES,
+        'image_position': Config.IMAGE_POSITION,
+        'stopping': criteria_settings()
+    }
+
+def generation_params(deterministic):
+    """Параметры генерации запроса; в детерминированном режиме сэмплирование выключено"""
+    return {
+        'max_new_tokens': Config.MAX_NEW_TOKENS,
+        'do_sample': Config.DO_SAMPLE and not deterministic,
+        'temperature': Config.TEMPERATURE
+    }
+
+async def run_blocking(fn, *args, **kwargs):
+    """Выполняет блокирующую функцию в cpu_executor, не занимая event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, functools.partial(fn, *args, **kwargs))
+
+async def wait_generation(gen_request):
+    """Ждет результат движка; если обработчик отменен (клиент отключился), отменяет генерацию"""
+    try:
+        # shield: отмена ожидания не должна отменять Future, который завершает поток движка
+        return await asyncio.shield(asyncio.wrap_future(gen_request.future))
+    except asyncio.CancelledError:
+        gen_request.cancel()
+        raise
+
+def check_capacity(user=None, max_wait=None):
+    """Отказ до постановки в движок, если очередь (или доля пользователя) заполнена
+
+    max_wait - сколько секунд клиент готов ждать prefill: при большей оценке - сразу отказ.
+    Во время прогрева запрос встает в очередь за заданиями прогрева, если оценка
+    укладывается в max_wait, иначе отказ с причиной warming_up.
+    """
+    if engine.is_full():
+        raise QueueFullError(engine.estimate_wait())
+    if user is not None and engine.is_full(user):
+        raise UserQueueFullError(user, engine.estimate_wait())
+    if max_wait is not None:
+        estimated_wait = engine.estimate_start(engine.queue_depth())
+        if estimated_wait > max_wait:
+            if not warmup_done.is_set():
+                raise WarmingUpError(engine.estimate_wait())
+            raise WaitLimitError(estimated_wait, engine.estimate_wait())
+
+def queue_info(gen_request):
+    """Позиция запроса в очереди движка при постановке и оценка ожидания до prefill"""
+    return {
+        'position': gen_request.queue_position,
+        'estimated_wait_ms': round(gen_request.estimated_wait * 1000) if gen_request.estimated_wait is not None else None
+    }
+
+def set_queue_headers(response, infos):
+    """X-Queue-Position и X-Estimated-Wait-Ms; для нескольких запросов движка - самый поздний"""
+    infos = [info for info in infos if info and info['position'] is not None]
+    if infos:
+        response.headers['X-Queue-Position'] = str(max(info['position'] for info in infos))
+        response.headers['X-Estimated-Wait-Ms'] = str(max(info['estimated_wait_ms'] for info in infos))
+    return response
+
+def deadline_response(error):
+    """504: дедлайн клиента прошел, работа по запросу прекращена"""
+    deadline_counter.inc(stage=error.stage)
+    app.logger.warning(f"Дедлайн клиента прошел, запрос снят на этапе {error.stage}")
+    return jsonify({
+        'success': False,
+        'error': str(error),
+        'stage': error.stage
+    }), 504
+
+def overloaded_status(error):
+    return 429 if isinstance(error, UserQueueFullError) else 503
+
+def overloaded_fields(error):
+    """Машиночитаемый отказ по перегрузке: клиент решает по reason, не проверяя /health заранее"""
+    fields = {
+        'success': False,
+        'error': str(error),
+        'overloaded': True,
+        'reason': error.reason,
+        'retry_after': error.retry_after
+    }
+    if isinstance(error, WaitLimitError):
+        fields['estimated_wait_ms'] = round(error.estimated_wait * 1000)
+    return fields
+
+def overloaded_response(error):
+    """503 с оценкой Retry-After вместо ожидания в переполненной очереди, 429 - при пределе пользователя"""
+    if isinstance(error, UserQueueFullError):
+        app.logger.warning(f"Очередь пользователя {error.user} заполнена, запрос отклонен (Retry-After {error.retry_after}с)")
+    elif isinstance(error, WarmingUpError):
+        app.logger.info("Идет прогрев модели, запрос с max_wait_ms отклонен")
+    elif isinstance(error, WaitLimitError):
+        app.logger.info(f"Ожидание в очереди {error.estimated_wait:.1f}с больше max_wait_ms клиента, запрос отклонен")
+    else:
+        app.logger.warning(f"Очередь генерации заполнена, запрос отклонен (Retry-After {error.retry_after}с)")
+    response = jsonify(overloaded_fields(error))
+    response.status_code = overloaded_status(error)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 def extract_analysis_from_output(output):
     """Извлекает текст анализа из вывода FastVLM"""
     try:
@@ -148,7 +531,7 @@ def extract_analysis_from_output(output):
                 clean_line = ' '.join(clean_line.split())
                 result_lines.insert(0, clean_line)
 
-        result_text = '\n'.join(result_lines[:10])
+        result_text = '\n'.join(result_lines[:Config.ANALYSIS_MAX_LINES])
 
         if not result_text:
             result_text = output.strip()
@@ -159,13 +542,34 @@ def extract_analysis_from_output(output):
         app.logger.error(f"Ошибка при извлечении анализа: {e}")
         return "Ошибка при обработке результатов анализа"
 
+@app.before_request
+async def begin_request():
+    """Идентификатор запроса из X-Request-ID (от Node) или новый - для логов и ответа"""
+    g.request_started = time.monotonic()
+    request_id_var.set(new_request_id(request.headers.get(REQUEST_ID_HEADER)))
+
+@app.after_request
+async def finish_request(response):
+    """X-Request-ID в ответе, счетчик и время запроса для /metrics"""
+    response.headers[REQUEST_ID_HEADER] = request_id_var.get()
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_counter.inc(endpoint=endpoint, status=response.status_code)
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        request_latency.observe(time.monotonic() - started, endpoint=endpoint)
+    return response
+
 @app.route('/health', methods=['GET'])
-def health():
+async def health():
     """Проверка здоровья сервера"""
     try:
         health_data = {
             'status': 'healthy',
-            'model_loaded': model is not None,
+            'model_loaded': runner is not None,
+            'engine_running': engine is not None,
+            'warmed_up': engine is not None and engine.warmed_up,
+            'queue_depth': engine.queue_depth() if engine is not None else None,
+            'backend': Config.BACKEND,
             'timestamp': time.time(),
             'device': Config.DEVICE,
             'torch_version': torch.__version__
@@ -182,124 +586,894 @@ def health():
             'timestamp': time.time()
         }), 500
 
+@app.route('/ready', methods=['GET'])
+async def ready():
+    """Готовность принимать анализ: прогрев, очередь, задержка, оценка ожидания
+
+    Значения уже посчитаны движком, обработчик только читает их: проверка стоит
+    микросекунды и не занимает ни пул, ни модель. 503 - движок не запущен,
+    идет прогрев или очередь заполнена.
+    """
+    if engine is None:
+        return jsonify({'ready': False, 'status': 'loading', 'model_loaded': runner is not None}), 503
+
+    state = engine.readiness()
+    if not warmup_done.is_set():
+        status = 'warming_up'
+    elif state['queue_full']:
+        status = 'overloaded'
+    else:
+        status = 'ready'
+    is_ready = status == 'ready'
+    return jsonify({
+        'ready': is_ready,
+        'status': status,
+        'worker_pid': os.getpid(),
+        'preparing': decode_stage.queued + preprocess_stage.queued,
+        **state
+    }), 200 if is_ready else 503
+
+class RequestError(Exception):
+    """Ошибка во входных данных запроса: HTTP-статус и дополнительные поля ответа"""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+def request_error_response(error):
+    return jsonify({
+        'success': False,
+        'error': str(error),
+        **error.extra
+    }), error.status
+
+def parse_seconds(value, name):
+    """Положительное число мс из поля или заголовка -> секунды; None - не задано"""
+    if value is None or value == '':
+        return None
+    try:
+        ms = float(value)
+    except (TypeError, ValueError):
+        raise RequestError(f'Invalid {name}: {value}')
+    if ms <= 0:
+        raise RequestError(f'Invalid {name}: {value}')
+    return ms / 1000.0
+
+def parse_deadline(value, start):
+    """Дедлайн в мс от start (time.monotonic()) -> момент time.monotonic(); None - без дедлайна"""
+    seconds = parse_seconds(value, 'deadline_ms')
+    return start + seconds if seconds is not None else None
+
+def with_header_params(data):
+    """Дедлайн, пользователь и приоритет из заголовков для запросов, где их нет в полях"""
+    if isinstance(data, dict):
+        for key, header in HEADER_PARAMS.items():
+            if key not in data and header in request.headers:
+                data[key] = request.headers[header]
+    return data
+
+def parse_priority(value, default):
+    """Класс приоритета: interactive (одиночный анализ) или background (пакетная работа)"""
+    if value is None or value == '':
+        return default
+    priority = str(value).strip().lower()
+    if priority not in PRIORITIES:
+        raise RequestError(f'Invalid priority: {value}', priorities=list(PRIORITIES))
+    return priority
+
+def parse_user(value):
+    """Идентификатор пользователя для справедливой очереди; без него у запроса свой поток"""
+    if value is None:
+        return None
+    user = str(value).strip()
+    if not user:
+        return None
+    if len(user) > MAX_USER_ID_LENGTH or not user.isprintable():
+        raise RequestError('Invalid user_id')
+    return user
+
+def parse_flag(value):
+    """Булев параметр из JSON (true/false) или из заголовка/формы ('true', '1', 'yes')"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+async def read_upload(limit):
+    """Читает тело запроса потоком и прерывает чтение, как только превышен limit байт"""
+    if request.content_length is not None and request.content_length > limit:
+        raise RequestError('Image too large', status=413, max_bytes=limit)
+
+    chunks = []
+    size = 0
+    async for chunk in request.body:
+        size += len(chunk)
+        if size > limit:
+            raise RequestError('Image too large', status=413, max_bytes=limit)
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+async def read_analysis_request():
+    """Разбирает тело запроса с изображением, возвращает (параметры, байты изображения или None)
+
+    - application/json: image_base64 или image_hash и параметры в полях JSON
+    - multipart/form-data: файл в поле image, параметры в полях формы
+    - image/* или application/octet-stream: сырые байты изображения, параметры в query-строке
+      или заголовках X-Prompt (URL-encoded UTF-8), X-Deterministic, X-Cache-Bypass, X-Prompts
+    """
+    content_type = request.mimetype
+    try:
+        if content_type.startswith('image/') or content_type == 'application/octet-stream':
+            data = {key: request.args[key] for key in UPLOAD_PARAMS if key in request.args}
+            for key, header in UPLOAD_PARAMS.items():
+                if header in request.headers:
+                    data[key] = unquote(request.headers[header])
+            return data, await read_upload(Config.MAX_UPLOAD_BYTES)
+
+        if request.content_length is not None and request.content_length > MAX_REQUEST_BYTES:
+            raise RequestError('Request too large', status=413, max_bytes=Config.MAX_UPLOAD_BYTES)
+
+        if content_type == 'multipart/form-data':
+            files = await request.files
+            data = (await request.form).to_dict()
+            upload = files.get('image')
+            if upload is None:
+                return with_header_params(data), None
+            image_data = upload.read()
+            if len(image_data) > Config.MAX_UPLOAD_BYTES:
+                raise RequestError('Image too large', status=413, max_bytes=Config.MAX_UPLOAD_BYTES)
+            return with_header_params(data), image_data
+
+        return with_header_params(await request.get_json()), None
+
+    except RequestEntityTooLarge:
+        raise RequestError('Request too large', status=413, max_bytes=Config.MAX_UPLOAD_BYTES)
+
+async def read_batch_request():
+    """Разбирает тело /analyze/batch, возвращает список (параметры, байты изображения или None)
+
+    - application/json: {"images": [...]} - элемент списка это объект с image_base64 или
+      image_hash и своими prompt/deterministic/cache_bypass, либо просто строка base64;
+      те же поля на верхнем уровне действуют для элементов без своих значений
+    - multipart/form-data: несколько файлов в поле image; поле prompt - один промпт
+      для всех файлов или по одному на каждый файл в том же порядке
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            files = (await request.files).getlist('image')
+            form = await request.form
+            prompts = form.getlist('prompt')
+            if len(prompts) > 1 and len(prompts) != len(files):
+                raise RequestError(f'Expected 1 or {len(files)} prompts, got {len(prompts)}')
+
+            common = with_header_params({
+                key: form[key] for key in ('deterministic', 'cache_bypass', 'timings', 'deadline_ms', 'user_id', 'priority',
+                                         'max_wait_ms')
+                if key in form
+            })
+            items = []
+            for i, upload in enumerate(files):
+                data = dict(common)
+                if prompts:
+                    data['prompt'] = prompts[i] if len(prompts) > 1 else prompts[0]
+                items.append((data, upload.read()))
+        else:
+            body = await request.get_json(silent=True)
+            if not isinstance(body, dict) or not isinstance(body.get('images'), list):
+                raise RequestError('Expected JSON object with "images" list')
+
+            common = with_header_params({
+                key: body[key]
+                for key in (
+                    'prompt', 'deterministic', 'cache_bypass', 'timings', 'deadline_ms', 'user_id', 'priority',
+                    'max_wait_ms'
+                )
+                if key in body
+            })
+            items = []
+            for item in body['images']:
+                if isinstance(item, str):
+                    item = {'image_base64': item}
+                # Элемент неверного типа получит свою ошибку, не ломая остальные
+                items.append(({**common, **item} if isinstance(item, dict) else {}, None))
+
+    except RequestEntityTooLarge:
+        raise RequestError('Request too large', status=413, max_bytes=Config.BATCH_MAX_BYTES)
+
+    if not items:
+        raise RequestError('No images provided')
+    if len(items) > Config.BATCH_MAX_IMAGES:
+        raise RequestError(f'Too many images: {len(items)}', max_images=Config.BATCH_MAX_IMAGES)
+    return items
+
+class AnalysisJob:
+    """Разобранный запрос анализа: промпт, параметры генерации, изображение или его хэш
+
+    Проходит этапы конвейера: decode() в пуле decode, prepare() в пуле preprocess,
+    затем submit() ставит готовые тензоры в очередь движка. priority - класс
+    приоритета, если запрос не указал свой (для /analyze/batch - background).
+    """
+
+    def __init__(self, data, image_data=None, timings=None, priority='interactive'):
+        data = data or {}
+        if image_data is None and 'image_base64' not in data and 'image_hash' not in data:
+            raise RequestError('No image provided')
+        image_size = len(image_data) if image_data is not None else len(data.get('image_base64') or '') * 3 // 4
+        if image_size > Config.MAX_UPLOAD_BYTES:
+            raise RequestError('Image too large', status=413, max_bytes=Config.MAX_UPLOAD_BYTES)
+
+        self.prompt = data.get('prompt') or default_prompt
+        self.params = generation_params(parse_flag(data.get('deterministic', Config.DETERMINISTIC)))
+        self.cache_bypass = parse_flag(data.get('cache_bypass', False))
+        # Время этапов пишется в лог всегда, в ответ - по запросу (timings=true)
+        self.timings = timings or RequestTimings()
+        self.return_timings = parse_flag(data.get('timings', False))
+        # Отсчет дедлайна - с начала обработки запроса (до чтения тела, если timings передан)
+        self.deadline = parse_deadline(data.get('deadline_ms'), self.timings.started)
+        # Поток справедливой очереди движка и позиция в ней после постановки
+        self.user = parse_user(data.get('user_id'))
+        self.priority = parse_priority(data.get('priority'), priority)
+        self.queue = None
+        # Быстрый отказ 503 (reason: wait_limit), если оценка ожидания в очереди больше
+        self.max_wait = parse_seconds(data.get('max_wait_ms'), 'max_wait_ms')
+
+        # Изображение приходит байтами (multipart/raw) или base64 в JSON;
+        # без них используем признаки, закодированные через /encode
+        self.image_data = image_data
+        self.image_base64 = data.get('image_base64')
+        self.image = None
+        self.image_key = data.get('image_hash')
+        self.cache_key = None
+        self.coalesce_key = None
+
+        self.input_ids = None
+        self.image_tensor = None
+        self.image_features = None
+
+    def check_deadline(self, stage):
+        """Дедлайн клиента прошел, пока задание ждало в пуле этапа - дальше не обрабатываем"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise DeadlineExceededError(stage)
+
+    def decode(self):
+        """Этап decode: байты (или base64) -> изображение, хэш пикселей и ключ кэша результатов"""
+        self.check_deadline('decode')
+        if self.image_data is not None or self.image_base64 is not None:
+            try:
+                image_data = self.image_data if self.image_data is not None else base64.b64decode(self.image_base64)
+                self.image = decode_image(image_data)
+                self.image_key = image_hash(self.image)
+            except Exception as e:
+                app.logger.error(f"Ошибка декодирования изображения: {e}")
+                raise RequestError(f'Invalid image data: {e}')
+            self.image_data = self.image_base64 = None
+
+        self._make_keys()
+
+    def _make_keys(self):
+        """Ключ кэша результатов и ключ объединения запросов по изображению, промпту и параметрам"""
+        request_key = make_key(self.image_key, self.prompt, self.params, runner.name, output_settings())
+        # Такие же запросы в полете объединяются; cache_bypass требует собственной генерации
+        if not self.cache_bypass:
+            self.coalesce_key = request_key
+
+        if result_cache is not None:
+            if self.cache_bypass:
+                result_cache.record_bypass()
+            else:
+                self.cache_key = request_key
+
+    def for_prompt(self, prompt, **params):
+        """Копия задания после decode с другим промптом: изображение и его тензор общие"""
+        job = copy.copy(self)
+        job.prompt = prompt
+        job.params = {**self.params, **params}
+        job.input_ids = None
+        job._make_keys()
+        return job
+
+    def cached_result(self):
+        """Готовый результат из кэша результатов или None"""
+        if self.cache_key is None:
+            return None
+        return result_cache.get(self.cache_key)
+
+    def prepare(self, timings=None):
+        """Этап preprocess: тензор изображения (resize + normalize) и токены промпта
+
+        timings - RequestTimings генерации для tokenize_ms и image_preprocess_ms.
+        """
+        timings = timings or RequestTimings()
+        self.check_deadline('preprocess')
+        # Признаки изображения из кэша позволяют пропустить препроцессинг и энкодер
+        self.image_features = feature_cache.get(self.image_key) if feature_cache is not None else None
+        if self.image is None and self.image_features is None:
+            raise RequestError('Image features not cached, send image_base64', status=404, image_hash=self.image_key)
+
+        with timings.measure('tokenize_ms'):
+            self.input_ids = runner.tokenize_prompt(self.prompt)
+        if self.image_features is None and self.image_tensor is None:
+            with timings.measure('image_preprocess_ms'):
+                self.image_tensor = runner.preprocess_image(self.image)
+
+    def submit(self, on_token=None, group=None):
+        """Этап модели: ставит подготовленный запрос в движок и возвращает GenerationRequest"""
+        return engine.submit(GenerationRequest(
+            self.input_ids, self.image_tensor,
+            image_key=self.image_key, image_features=self.image_features,
+            on_token=on_token, stopping=default_criteria(), deadline=self.deadline,
+            user=self.user, priority=self.priority, group=group, **self.params
+        ))
+
+    def finish(self, output_ids, finish_reason=None):
+        """Декодирует результат, чистит текст анализа и сохраняет его в кэш
+
+        В кэш попадают только естественные остановки (NATURAL_STOP_REASONS): ответ,
+        оборванный лимитом токенов или дедлайном под нагрузкой, не кэшируется.
+        """
+        result_text = strip_incomplete(runner.decode_text(output_ids)).strip()
+        clean_analysis = extract_analysis_from_output(result_text)
+
+        if self.cache_key is not None and finish_reason in NATURAL_STOP_REASONS:
+            result_cache.put(self.cache_key, {'analysis': clean_analysis})
+
+        return clean_analysis
+
+def engine_timings(gen_request, timings):
+    """Переносит этапы движка из GenerationRequest в RequestTimings"""
+    engine_stages = gen_request.timings()
+    for name in ('queue_ms', 'encode_ms', 'prefill_ms', 'generate_ms'):
+        timings.add(name, engine_stages[name])
+    timings.note('ttft_ms', engine_stages['ttft_ms'])
+    timings.note('tokens', engine_stages['tokens'])
+    timings.note('tokens_per_sec', engine_stages['tokens_per_sec'])
+
+async def run_analysis(job, shared=None):
+    """Генерация для задания после decode: препроцессинг, батч движка, постобработка
+
+    Время этапов генерации возвращается отдельным RequestTimings: результат
+    общий для всех объединенных запросов, а decode и кэш у каждого свои.
+    shared - SharedDeadline объединенных запросов: задание и запрос движка живут
+    до самого позднего дедлайна среди ожидающих.
+    """
+    check_capacity(job.user, job.max_wait)
+    timings = RequestTimings()
+    if shared is not None:
+        shared.bind(job)
+
+    # Препроцессинг в своем пуле, генерация - в общем батче движка
+    await preprocess_stage.run(job.prepare, timings, timings=timings)
+    gen_request = job.submit()
+    if shared is not None:
+        shared.bind(gen_request)
+    output_ids = await wait_generation(gen_request)
+    engine_timings(gen_request, timings)
+
+    with timings.measure('postprocess_ms'):
+        clean_analysis = await run_blocking(job.finish, output_ids, gen_request.finish_reason)
+
+    app.logger.info(
+        f"Анализ успешно завершен: TTFT {gen_request.ttft_ms()}ms, "
+        f"префикс из кэша {gen_request.prefix_tokens} токенов, "
+        f"{len(output_ids)} токенов, остановка: {gen_request.finish_reason}"
+    )
+
+    return {
+        'analysis': clean_analysis,
+        'image_hash': job.image_key,
+        'ttft_ms': gen_request.ttft_ms(),
+        'finish_reason': gen_request.finish_reason,
+        'timings': timings,
+        'queue': queue_info(gen_request)
+    }
+
+async def analyze_job(job, slots=None):
+    """Анализ одного задания: decode, кэш результатов, затем генерация (с объединением)
+
+    slots - семафор, ограничивающий число одновременных генераций (для /analyze/batch).
+    Время этапов пишется в лог (событие analyze), в ответ - если задание просит timings.
+    """
+    timings = job.timings
+    await decode_stage.run(job.decode, timings=timings)
+
+    # Проверяем кэш результатов
+    with timings.measure('cache_ms'):
+        cached = await run_blocking(job.cached_result)
+    if cached is not None:
+        app.logger.info("Результат анализа взят из кэша")
+        log_timings(app.logger, 'analyze', timings, image_hash=job.image_key, cached=True)
+        result = {'analysis': cached['analysis'], 'cached': True}
+    else:
+        # Такой же анализ уже идет - ждем его результат вместо новой генерации
+        async with slots or contextlib.nullcontext():
+            try:
+                shared, coalesced = await inflight.run(
+                    job.coalesce_key, lambda shared_deadline: run_analysis(job, shared_deadline), job.deadline
+                )
+            except WaiterDeadlineExceeded:
+                # Генерация продолжается для других ожидающих с более поздним дедлайном
+                raise DeadlineExceededError('generation')
+        if coalesced:
+            app.logger.info("Запрос присоединен к такому же анализу в процессе")
+
+        result = {key: value for key, value in shared.items() if key not in ('timings', 'queue')}
+        timings.update(shared['timings'])
+        job.queue = shared['queue']
+        log_timings(
+            app.logger, 'analyze', timings, image_hash=job.image_key, cached=False, coalesced=coalesced,
+            finish_reason=result['finish_reason']
+        )
+        result = {'cached': False, 'coalesced': coalesced, **result}
+
+    if job.return_timings:
+        result['timings'] = timings.as_dict()
+    return result
+
 @app.route('/analyze', methods=['POST'])
-def analyze():
+async def analyze():
     """Анализ изображения"""
     try:
-        if model is None:
+        if runner is None:
             return jsonify({
                 'success': False,
                 'error': 'Model not loaded'
             }), 500
 
         # Получаем данные
-        data = request.get_json()
-        if not data or 'image_base64' not in data:
+        timings = RequestTimings()
+        with timings.measure('read_ms'):
+            data, image_data = await read_analysis_request()
+        job = AnalysisJob(data, image_data, timings=timings)
+
+        app.logger.info("Начало анализа изображения")
+        result = await analyze_job(job)
+
+        return set_queue_headers(jsonify({
+            'success': True,
+            'model_used': runner.model_type,
+            'device': str(runner.device),
+            **result
+        }), [job.queue])
+
+    except RequestError as e:
+        return request_error_response(e)
+
+    except QueueFullError as e:
+        return overloaded_response(e)
+
+    except DeadlineExceededError as e:
+        return deadline_response(e)
+
+    except Exception as e:
+        error_msg = f"Ошибка анализа: {e}"
+        app.logger.error(error_msg, exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+async def analyze_batch_item(index, data, image_data, slots):
+    """Один элемент /analyze/batch: ошибка элемента возвращается в его результате"""
+    try:
+        job = AnalysisJob(data, image_data, priority='background')
+        return {'index': index, 'success': True, **await analyze_job(job, slots)}
+
+    except RequestError as e:
+        return {'index': index, 'success': False, 'error': str(e), 'status': e.status, **e.extra}
+
+    except DeadlineExceededError as e:
+        deadline_counter.inc(stage=e.stage)
+        return {'index': index, 'success': False, 'error': str(e), 'status': 504, 'stage': e.stage}
+
+    except QueueFullError as e:
+        return {'index': index, 'status': overloaded_status(e), **overloaded_fields(e)}
+
+    except Exception as e:
+        app.logger.error(f"Ошибка анализа элемента {index} батча: {e}", exc_info=True)
+        return {'index': index, 'success': False, 'error': str(e), 'status': 500}
+
+@app.route('/analyze/batch', methods=['POST'])
+async def analyze_batch():
+    """Анализ нескольких изображений за один запрос (доска Pinterest, альбом образов)
+
+    Элементы декодируются параллельно и генерируются общим батчем движка; одновременно
+    в движке не больше BATCH_SIZE элементов запроса, чтобы он не занимал всю очередь.
+    Элементы по умолчанию идут классом background. Ошибка одного элемента не отменяет остальные.
+    """
+    try:
+        if runner is None:
             return jsonify({
                 'success': False,
-                'error': 'No image provided'
-            }), 400
+                'error': 'Model not loaded'
+            }), 500
 
-        image_base64 = data['image_base64']
-        prompt = data.get('prompt', default_prompt)
+        items = await read_batch_request()
+        check_capacity()
 
-        app.logger.info("Начало анализа изображения")
+        app.logger.info(f"Начало пакетного анализа: {len(items)} изображений")
+        start = time.perf_counter()
+
+        slots = asyncio.Semaphore(Config.BATCH_SIZE)
+        results = await asyncio.gather(*(
+            analyze_batch_item(index, data, image_data, slots)
+            for index, (data, image_data) in enumerate(items)
+        ))
+
+        succeeded = sum(1 for result in results if result['success'])
+        app.logger.info(
+            f"Пакетный анализ завершен за {(time.perf_counter() - start) * 1000:.0f}ms: "
+            f"успешно {succeeded}, с ошибкой {len(results) - succeeded}"
+        )
+
+        return jsonify({
+            'success': True,
+            'model_used': runner.model_type,
+            'device': str(runner.device),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        })
+
+    except RequestError as e:
+        return request_error_response(e)
+
+    except QueueFullError as e:
+        return overloaded_response(e)
+
+    except DeadlineExceededError as e:
+        return deadline_response(e)
 
-        # Декодируем изображение
+    except Exception as e:
+        app.logger.error(f"Ошибка пакетного анализа: {e}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def parse_prompts(value):
+    """Промпты /analyze/multi: объект {имя: промпт}, список или JSON-строка (поле формы, заголовок)"""
+    if value is None:
+        return dict(ASPECT_PROMPTS)
+    if isinstance(value, str):
         try:
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_data))
-        except Exception as e:
-            app.logger.error(f"Ошибка декодирования изображения: {e}")
+            value = json.loads(value)
+        except ValueError:
+            raise RequestError('prompts must be a JSON object or list')
+    if isinstance(value, list):
+        value = {str(index): prompt for index, prompt in enumerate(value)}
+    if not isinstance(value, dict) or not value:
+        raise RequestError('prompts must be a non-empty JSON object or list')
+    if len(value) > Config.MULTI_MAX_PROMPTS:
+        raise RequestError(f'Too many prompts: {len(value)}', max_prompts=Config.MULTI_MAX_PROMPTS)
+    if not all(isinstance(prompt, str) and prompt.strip() for prompt in value.values()):
+        raise RequestError('Each prompt must be a non-empty string')
+    return value
+
+@app.route('/analyze/multi', methods=['POST'])
+async def analyze_multi():
+    """Несколько коротких промптов к одному изображению (тип, цвет, материал, стиль)
+
+    Изображение декодируется, препроцессится и кодируется один раз; промпты ставятся
+    в движок вместе и делят prefill начала промпта с изображением (см. engine.py),
+    дальше декодируются одним батчем. Ответ - словарь {имя промпта: ответ}.
+    """
+    try:
+        if runner is None:
             return jsonify({
                 'success': False,
-                'error': f'Invalid image data: {e}'
-            }), 400
+                'error': 'Model not loaded'
+            }), 500
 
-        # Сохраняем во временный файл
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            image.save(temp_file, 'JPEG')
-            temp_image_path = temp_file.name
+        data, image_data = await read_analysis_request()
+        prompts = parse_prompts((data or {}).get('prompts'))
+        job = AnalysisJob(data, image_data)
+        await decode_stage.run(job.decode)
 
-        try:
-            # Создаем промпт для модели
-            qs = prompt
-            if model.config.mm_use_im_start_end:
-                qs = DEFAULT_IM_START_TOKEN + DEFAULT_IMAGE_TOKEN + DEFAULT_IM_END_TOKEN + '\n' + qs
-            else:
-                qs = DEFAULT_IMAGE_TOKEN + '\n' + qs
-
-            conv = conv_templates["qwen_2"].copy()
-            conv.append_message(conv.roles[0], qs)
-            conv.append_message(conv.roles[1], None)
-            prompt_full = conv.get_prompt()
-
-            # Токенизируем промпт
-            input_ids = tokenizer_image_token(prompt_full, tokenizer, IMAGE_TOKEN_INDEX, return_tensors='pt').unsqueeze(0).to(model.device)
-
-            # Обрабатываем изображение
-            image_tensor = process_images([image], image_processor, model.config)[0]
-
-            # Выполняем анализ
-            with torch.no_grad():
-                output_ids = model.generate(
-                    input_ids,
-                    images=image_tensor.unsqueeze(0).to(model.device).half(),
-                    image_sizes=[image.size],
-                    do_sample=Config.DO_SAMPLE,
-                    temperature=Config.TEMPERATURE,
-                    top_p=None,
-                    num_beams=1,
-                    max_new_tokens=Config.MAX_NEW_TOKENS,
-                    use_cache=True
-                )
+        app.logger.info(f"Начало анализа по {len(prompts)} промптам")
+        start = time.perf_counter()
+
+        jobs = {
+            name: job.for_prompt(prompt, max_new_tokens=Config.MULTI_MAX_NEW_TOKENS)
+            for name, prompt in prompts.items()
+        }
+        answers = {}
+        for name, sub_job in jobs.items():
+            cached = await run_blocking(sub_job.cached_result)
+            if cached is not None:
+                answers[name] = cached['analysis']
+        cached_names = sorted(answers)
+        pending = {name: sub_job for name, sub_job in jobs.items() if name not in answers}
+
+        finish_reasons = {}
+        ttft_ms = None
+        if pending:
+            check_capacity(job.user, job.max_wait)
+
+            def prepare_all():
+                # Тензор изображения готовится один раз и достается копиям заданий
+                job.prepare()
+                for sub_job in pending.values():
+                    sub_job.image_tensor = job.image_tensor
+                    sub_job.prepare()
+
+            await preprocess_stage.run(prepare_all)
+
+            # Все промпты ставятся в очередь разом, чтобы попасть в один prefill;
+            # для предела активных запросов пользователя это один запрос
+            gen_requests = {}
+            group = object()
+            try:
+                for name, sub_job in pending.items():
+                    gen_requests[name] = sub_job.submit(group=group)
+                outputs = await asyncio.gather(*(wait_generation(r) for r in gen_requests.values()))
+            except BaseException:
+                for gen_request in gen_requests.values():
+                    gen_request.cancel()
+                raise
+
+            for (name, gen_request), output_ids in zip(gen_requests.items(), outputs):
+                answers[name] = await run_blocking(pending[name].finish, output_ids, gen_request.finish_reason)
+                finish_reasons[name] = gen_request.finish_reason
+            ttft_ms = max(r.ttft_ms() or 0 for r in gen_requests.values())
+
+        app.logger.info(
+            f"Анализ по {len(prompts)} промптам завершен за {(time.perf_counter() - start) * 1000:.0f}ms, "
+            f"из кэша {len(cached_names)}"
+        )
+
+        response = jsonify({
+            'success': True,
+            'answers': answers,
+            'model_used': runner.model_type,
+            'device': str(runner.device),
+            'cached': cached_names,
+            'image_hash': job.image_key,
+            'ttft_ms': ttft_ms,
+            'finish_reasons': finish_reasons
+        })
+        return set_queue_headers(response, [queue_info(r) for r in gen_requests.values()] if pending else [])
 
-            # Декодируем результат
-            result_text = tokenizer.batch_decode(output_ids, skip_special_tokens=True)[0].strip()
+    except RequestError as e:
+        return request_error_response(e)
 
-            # Извлекаем чистый анализ
-            clean_analysis = extract_analysis_from_output(result_text)
+    except QueueFullError as e:
+        return overloaded_response(e)
 
-            app.logger.info("Анализ успешно завершен")
+    except DeadlineExceededError as e:
+        return deadline_response(e)
+
+    except Exception as e:
+        app.logger.error(f"Ошибка анализа по нескольким промптам: {e}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
+@app.route('/analyze/stream', methods=['POST'])
+async def analyze_stream():
+    """Потоковый анализ изображения (Server-Sent Events): текст отдается по мере генерации"""
+    try:
+        if runner is None:
             return jsonify({
+                'success': False,
+                'error': 'Model not loaded'
+            }), 500
+
+        job = AnalysisJob(*await read_analysis_request())
+        await decode_stage.run(job.decode, timings=job.timings)
+        cached = await run_blocking(job.cached_result)
+
+        # Токены приходят из потока движка и передаются в event loop; None - генерация завершена
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+
+        def put_token(token_id):
+            loop.call_soon_threadsafe(tokens.put_nowait, token_id)
+
+        gen_request = None
+        if cached is None:
+            check_capacity(job.user, job.max_wait)
+            await preprocess_stage.run(job.prepare, job.timings, timings=job.timings)
+            gen_request = job.submit(on_token=put_token)
+            gen_request.future.add_done_callback(lambda _: put_token(None))
+
+    except RequestError as e:
+        return request_error_response(e)
+
+    except QueueFullError as e:
+        return overloaded_response(e)
+
+    except DeadlineExceededError as e:
+        return deadline_response(e)
+
+    except Exception as e:
+        app.logger.error(f"Ошибка потокового анализа: {e}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+    app.logger.info("Начало потокового анализа изображения")
+    request_id = request_id_var.get()
+
+    async def events():
+        # Генератор ответа выполняется вне обработчика: возвращаем идентификатор запроса в контекст
+        request_id_var.set(request_id)
+        if cached is not None:
+            yield sse_event('token', {'text': cached['analysis']})
+            yield sse_event('done', {
+                'success': True,
+                'analysis': cached['analysis'],
+                'text': cached['analysis'],
+                'cached': True
+            })
+            return
+
+        detokenizer = IncrementalDetokenizer(runner.decode_text)
+        try:
+            while True:
+                try:
+                    token_id = await asyncio.wait_for(tokens.get(), timeout=Config.SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Пока запрос ждет в очереди, проверяем, что клиент еще подключен
+                    yield sse_comment()
+                    continue
+
+                if token_id is None:
+                    break
+                text = detokenizer.push(token_id)
+                if text:
+                    yield sse_event('token', {'text': text})
+
+            text = detokenizer.flush()
+            if text:
+                yield sse_event('token', {'text': text})
+
+            clean_analysis = await run_blocking(job.finish, gen_request.result(), gen_request.finish_reason)
+            app.logger.info(f"Потоковый анализ завершен: TTFT {gen_request.ttft_ms()}ms")
+            engine_timings(gen_request, job.timings)
+            log_timings(
+                app.logger, 'analyze_stream', job.timings, image_hash=job.image_key,
+                finish_reason=gen_request.finish_reason
+            )
+            yield sse_event('done', {
                 'success': True,
                 'analysis': clean_analysis,
-                'model_used': model.config.model_type,
-                'device': str(model.device)
+                'text': detokenizer.text,
+                'cached': False,
+                'image_hash': job.image_key,
+                'finish_reason': gen_request.finish_reason,
+                'timings': gen_request.timings()
             })
 
+        except DeadlineExceededError as e:
+            deadline_counter.inc(stage=e.stage)
+            app.logger.warning(f"Дедлайн клиента прошел, потоковый анализ остановлен на этапе {e.stage}")
+            yield sse_event('error', {'success': False, 'error': str(e), 'stage': e.stage})
+
+        except Exception as e:
+            app.logger.error(f"Ошибка потокового анализа: {e}", exc_info=True)
+            yield sse_event('error', {'success': False, 'error': str(e)})
+
         finally:
-            # Удаляем временный файл
-            try:
-                os.unlink(temp_image_path)
-            except:
-                pass
+            # Клиент отключился (генератор отменен): генерацию больше никто не прочитает
+            if not gen_request.future.done():
+                gen_request.cancel()
+                app.logger.info("Клиент отключился, генерация остановлена")
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    if gen_request is not None:
+        set_queue_headers(response, [queue_info(gen_request)])
+    # Длительность потока ограничивает дедлайн генерации, а не таймаут ответа Quart
+    response.timeout = None
+    return response
+
+@app.route('/encode', methods=['POST'])
+async def encode():
+    """Предварительное кодирование изображения: признаки попадают в кэш для последующих /analyze"""
+    try:
+        if runner is None:
+            return jsonify({
+                'success': False,
+                'error': 'Model not loaded'
+            }), 500
+
+        if feature_cache is None:
+            return jsonify({
+                'success': False,
+                'error': 'Feature cache disabled'
+            }), 400
+
+        data, image_data = await read_analysis_request()
+        if image_data is None and (not data or 'image_base64' not in data):
+            return jsonify({
+                'success': False,
+                'error': 'No image provided'
+            }), 400
+
+        try:
+            if image_data is None:
+                image_data = base64.b64decode(data['image_base64'])
+            image = await decode_stage.run(decode_image, image_data)
+            image_key = await decode_stage.run(image_hash, image)
+        except Exception as e:
+            app.logger.error(f"Ошибка декодирования изображения: {e}")
+            return jsonify({
+                'success': False,
+                'error': f'Invalid image data: {e}'
+            }), 400
+
+        if image_key in feature_cache:
+            return jsonify({'success': True, 'image_hash': image_key, 'cached': True})
+
+        check_capacity()
+        image_tensor = await preprocess_stage.run(runner.preprocess_image, image)
+        gen_request = engine.submit(GenerationRequest(
+            [], image_tensor, image_key=image_key, encode_only=True
+        ))
+        await wait_generation(gen_request)
+
+        app.logger.info(f"Изображение закодировано заранее: {image_key[:12]}")
+        return jsonify({'success': True, 'image_hash': image_key, 'cached': False})
+
+    except RequestError as e:
+        return request_error_response(e)
+
+    except QueueFullError as e:
+        return overloaded_response(e)
 
     except Exception as e:
-        error_msg = f"Ошибка анализа: {e}"
-        app.logger.error(error_msg, exc_info=True)
+        app.logger.error(f"Ошибка кодирования изображения: {e}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/prompt/reload', methods=['POST'])
+async def reload_prompt():
+    """Перечитывает prompt.md и пересчитывает KV префикса нового промпта"""
+    try:
+        await run_blocking(load_prompt)
+        if runner is not None:
+            await run_blocking(register_prompt_prefix)
+        return jsonify({
+            'success': True,
+            'prompt_length': len(default_prompt)
+        })
+
+    except Exception as e:
+        app.logger.error(f"Ошибка перезагрузки промпта: {e}", exc_info=True)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
 @app.route('/load', methods=['GET'])
-def get_load():
-    """Проверка нагрузки сервера"""
+async def get_load():
+    """Проверка нагрузки сервера: последний снимок фонового сэмплера, без ожидания замера"""
     try:
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
+        snapshot = sampler.snapshot() if sampler is not None else None
+        if snapshot is None:
+            return jsonify({
+                'error': 'Resource sampler is not running',
+                'timestamp': time.time()
+            }), 503
 
         load_data = {
-            'cpu_percent': cpu_percent,
-            'memory_percent': memory.percent,
-            'memory_used_gb': round(memory.used / (1024**3), 2),
-            'memory_total_gb': round(memory.total / (1024**3), 2),
+            'cpu_percent': snapshot['cpu_percent'],
+            'process_cpu_percent': snapshot['process_cpu_percent'],
+            'process_rss_mb': round(snapshot['process_rss_bytes'] / (1024**2), 1),
+            'memory_percent': snapshot['memory_percent'],
+            'memory_used_gb': round(snapshot['memory_used_bytes'] / (1024**3), 2),
+            'memory_total_gb': round(snapshot['memory_total_bytes'] / (1024**3), 2),
+            'sampled_at': snapshot['sampled_at'],
             'timestamp': time.time()
         }
 
-        app.logger.debug(f"Load check: CPU {cpu_percent}%, Memory {memory.percent}%")
+        app.logger.debug(f"Load check: CPU {snapshot['cpu_percent']}%, Memory {snapshot['memory_percent']}%")
         return jsonify(load_data)
 
     except Exception as e:
@@ -310,7 +1484,7 @@ def get_load():
         }), 500
 
 @app.route('/gpu', methods=['GET'])
-def get_gpu_info():
+async def get_gpu_info():
     """Проверка работы на GPU"""
     try:
         if not torch.cuda.is_available():
@@ -320,12 +1494,24 @@ def get_gpu_info():
                 'device': 'cpu'
             })
 
+        # Сэмплер снимает память CUDA, только если модель на cuda; иначе считаем на месте
+        snapshot = sampler.snapshot() if sampler is not None else None
+        if snapshot is None or snapshot.get('accelerator') != 'cuda':
+            snapshot = {
+                'accelerator_name': torch.cuda.get_device_name(0),
+                'accelerator_memory_allocated_bytes': torch.cuda.memory_allocated(0),
+                'accelerator_memory_reserved_bytes': torch.cuda.memory_reserved(0),
+                'accelerator_memory_total_bytes': torch.cuda.get_device_properties(0).total_memory,
+                'sampled_at': time.time()
+            }
+
         gpu_info = {
             'gpu_available': True,
-            'gpu_name': torch.cuda.get_device_name(0),
-            'gpu_memory_allocated_mb': round(torch.cuda.memory_allocated(0) / (1024**2), 2),
-            'gpu_memory_reserved_mb': round(torch.cuda.memory_reserved(0) / (1024**2), 2),
-            'gpu_memory_total_mb': round(torch.cuda.get_device_properties(0).total_memory / (1024**2), 2),
+            'gpu_name': snapshot['accelerator_name'],
+            'gpu_memory_allocated_mb': round(snapshot['accelerator_memory_allocated_bytes'] / (1024**2), 2),
+            'gpu_memory_reserved_mb': round(snapshot['accelerator_memory_reserved_bytes'] / (1024**2), 2),
+            'gpu_memory_total_mb': round(snapshot['accelerator_memory_total_bytes'] / (1024**2), 2),
+            'sampled_at': snapshot['sampled_at'],
             'device': 'cuda'
         }
 
@@ -341,10 +1527,10 @@ def get_gpu_info():
         }), 500
 
 @app.route('/model', methods=['GET'])
-def get_model_info():
+async def get_model_info():
     """Информация о загруженной модели"""
     try:
-        if model is None:
+        if runner is None:
             return jsonify({
                 'loaded': False,
                 'message': 'Модель не загружена'
@@ -352,12 +1538,11 @@ def get_model_info():
 
         model_info = {
             'loaded': True,
-            'model_name': model.config.model_type,
-            'device': str(model.device),
-            'context_length': context_len,
-            'torch_dtype': str(Config.TORCH_DTYPE),
-            'model_path': Config.MODEL_PATH
+            'backend': Config.BACKEND,
+            **runner.describe()
         }
+        if Config.BACKEND == 'fastvlm':
+            model_info['model_path'] = Config.MODEL_PATH
 
         app.logger.debug(f"Model info: {model_info['model_name']}")
         return jsonify(model_info)
@@ -369,47 +1554,139 @@ def get_model_info():
             'error': str(e)
         }), 500
 
-def signal_handler(signum, frame):
-    """Обработка сигналов завершения"""
-    print("Получен сигнал завершения, останавливаем сервер...")
+@app.route('/stats', methods=['GET'])
+async def get_engine_stats():
+    """Счетчики движка генерации: запросы, токены, причины остановки"""
+    if engine is None:
+        return jsonify({'running': False})
+
+    return jsonify({
+        'running': True,
+        'worker_pid': os.getpid(),
+        'queue_depth': engine.queue_depth(),
+        'queue_max_size': engine.max_queue_size,
+        'active': engine.active_count(),
+        'avg_service_ms': round(engine.avg_service_time * 1000, 1) if engine.avg_service_time else None,
+        'coalescing': inflight.stats(),
+        'scheduler': engine.scheduler_stats(),
+        'pipeline': {
+            'decode': decode_stage.stats(),
+            'preprocess': preprocess_stage.stats(),
+            'model': {'queued': engine.queue_depth(), 'running': engine.active_count()}
+        },
+        **engine.stats_snapshot()
+    })
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/cache', methods=['GET'])
+async def get_cache_info():
+    """Статистика кэша результатов и кэша признаков изображений"""
+    return jsonify({
+        'results': {'enabled': True, **result_cache.stats()} if result_cache is not None else {'enabled': False},
+        'features': {'enabled': True, **feature_cache.stats()} if feature_cache is not None else {'enabled': False},
+        'prefixes': {'enabled': True, **prefix_cache.stats()} if prefix_cache is not None else {'enabled': False}
+    })
+
+def shutdown():
+    """Останавливает движок и освобождает ресурсы"""
     app.logger.info("Server shutdown initiated")
 
-    if model and torch.cuda.is_available():
+    if engine:
+        engine.stop()
+    if sampler is not None:
+        sampler.stop()
+    decode_stage.shutdown()
+    preprocess_stage.shutdown()
+    cpu_executor.shutdown(wait=False)
+
+    if runner is not None and torch.cuda.is_available():
         # Очистка GPU памяти
         torch.cuda.empty_cache()
         app.logger.info("GPU memory cleared")
 
+def signal_handler(signum, frame):
+    """Обработка сигналов завершения до запуска HTTP сервера (во время загрузки модели)"""
+    print("Получен сигнал завершения, останавливаем сервер...")
+    shutdown()
     sys.exit(0)
 
-def start_server():
-    """Запуск Flask сервера"""
+def open_listen_sockets():
+    """TCP и (если задан FASTVLM_SOCKET) Unix-сокет по настройкам Config"""
+    return create_listen_sockets(
+        Config.HOST, Config.PORT,
+        unix_path=Config.UNIX_SOCKET, unix_mode=Config.UNIX_SOCKET_MODE, tcp=Config.TCP_ENABLED
+    )
+
+def start_server(listen_sockets=None):
+    """Запуск асинхронного сервера (Quart на Hypercorn)
+
+    Hypercorn сам обрабатывает SIGINT/SIGTERM: дожидается текущих ответов
+    и возвращает управление, после чего останавливаем движок.
+    listen_sockets - уже открытые сокеты мастера в prefork-режиме.
+    """
+    owns_sockets = listen_sockets is None
     try:
-        print(f"Запускаем FastVLM сервер на {Config.HOST}:{Config.PORT}...")
-        app.logger.info(f"Server starting on {Config.HOST}:{Config.PORT}")
-
-        app.run(
-            host=Config.HOST,
-            port=Config.PORT,
-            debug=False,
-            use_reloader=False
+        if owns_sockets:
+            listen_sockets = open_listen_sockets()
+        addresses = describe(listen_sockets)
+        print(f"Запускаем FastVLM сервер на {addresses}...")
+        app.logger.info(
+            f"Server starting on {addresses} "
+            f"(очередь {Config.QUEUE_MAX_SIZE}, пулы decode/preprocess {Config.DECODE_WORKERS}/{Config.PREPROCESS_WORKERS})"
         )
+
+        hypercorn_config = HypercornConfig()
+        hypercorn_config.bind = [f"fd://{sock.fileno()}" for sock in listen_sockets]
+        hypercorn_config.keep_alive_timeout = Config.KEEP_ALIVE_TIMEOUT
+        asyncio.run(serve(app, hypercorn_config))
+        shutdown()
+        if owns_sockets:
+            remove_unix_socket(Config.UNIX_SOCKET)
     except Exception as e:
         error_msg = f"Ошибка запуска FastVLM сервера: {e}"
         print(error_msg)
         app.logger.error(error_msg, exc_info=True)
 
+def start_prefork():
+    """Prefork-режим: модель уже загружена мастером, воркеры получают ее copy-on-write"""
+    listen_sockets = open_listen_sockets()
+    threads = worker_threads(Config.WORKERS, Config.WORKER_THREADS)
+
+    def worker_main(index):
+        pin_worker(index, threads, Config.WORKER_CPU_AFFINITY)
+        # Поток движка и пулы создаются уже после fork - потоки мастера в воркер не переходят
+        with startup_timings.measure('engine_ms'):
+            start_engine()
+            start_sampler()
+        start_warmup()
+        start_server(listen_sockets)
+
+    print(f"Prefork: {Config.WORKERS} воркеров по {threads} потоков на {describe(listen_sockets)}")
+    app.logger.info(f"Prefork: {Config.WORKERS} воркеров, {threads} потоков torch на воркер")
+    run_prefork(Config.WORKERS, worker_main)
+    remove_unix_socket(Config.UNIX_SOCKET)
+
 if __name__ == '__main__':
-    # Загружаем переменные окружения
-    Config.load_env()
+    with startup_timings.measure('config_ms'):
+        # Загружаем переменные окружения
+        Config.load_env()
 
-    # Создаем необходимые директории
-    Config.ensure_directories()
+        # Создаем необходимые директории
+        Config.ensure_directories()
 
-    # Настраиваем логирование
-    setup_logging()
+        # Настраиваем логирование
+        setup_logging()
 
     print("FastVLM Server starting...")
 
+    # Устройство определяется при первом обращении к Config.DEVICE (импорт torch.cuda, опрос драйвера)
+    with startup_timings.measure('device_ms'):
+        Config.DEVICE
+
     # Валидируем конфигурацию
     try:
         Config.validate_config()
@@ -421,13 +1698,34 @@ if __name__ == '__main__':
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
-    # Загружаем промпт
-    load_prompt()
+    # Prefork-режим: мастер не должен запускать OpenMP-потоки до fork
+    prefork = Config.WORKERS > 1 and prefork_supported(Config.DEVICE)
+    if Config.WORKERS > 1 and not prefork:
+        print("WORKERS > 1 поддерживается только на CPU с fork(), запускаем один процесс")
+        app.logger.warning("Prefork недоступен (GPU или нет fork), WORKERS игнорируется")
+    if prefork:
+        prepare_master()
+
+    with startup_timings.measure('prompt_ms'):
+        # Загружаем промпт
+        load_prompt()
+
+        # Кэш результатов
+        init_result_cache()
 
     # Загружаем модель
-    if load_model():
-        # Запускаем сервер
-        start_server()
+    with startup_timings.measure('model_load_ms'):
+        loaded = load_model()
+    if loaded:
+        # Запускаем движок генерации, прогрев и сервер
+        if prefork:
+            start_prefork()
+        else:
+            with startup_timings.measure('engine_ms'):
+                start_engine()
+                start_sampler()
+            start_warmup()
+            start_server()
     else:
         print("Не удалось загрузить модель, сервер не запущен")
         sys.exit(1)
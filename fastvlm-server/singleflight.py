@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Объединение одинаковых запросов в полете (single-flight)
+Пока генерация для ключа (изображение + промпт + параметры) идет, такие же запросы
+не запускают свою, а ждут результат первой. Кэш результатов помогает после
+завершения, single-flight - в окне, когда результата еще нет.
+Общее выполнение идет до самого позднего дедлайна ожидающих: ожидающий с ранним
+дедлайном уходит один, не обрывая генерацию для остальных.
+"""
+
+import time
+import asyncio
+
+
+class WaiterDeadlineExceeded(Exception):
+    """Дедлайн ожидающего прошел раньше, чем общее выполнение завершилось"""
+
+
+class SharedDeadline:
+    """Дедлайн общего выполнения: самый поздний среди ожидающих (None - кто-то ждет без дедлайна)
+
+    bind(target) - объект с атрибутом deadline (задание, запрос движка): получает
+    новое значение при каждом приходе и уходе ожидающего.
+    """
+
+    def __init__(self):
+        self.value = None
+        self._deadlines = []
+        self._targets = []
+
+    def bind(self, target):
+        target.deadline = self.value
+        self._targets.append(target)
+        return target
+
+    def add(self, deadline):
+        self._deadlines.append(deadline)
+        self._update()
+
+    def remove(self, deadline):
+        self._deadlines.remove(deadline)
+        self._update()
+
+    def _update(self):
+        # Без ожидающих выполнение отменяется, дедлайн больше не важен
+        if not self._deadlines:
+            return
+        self.value = None if None in self._deadlines else max(self._deadlines)
+        for target in self._targets:
+            target.deadline = self.value
+
+
+class _Call:
+    def __init__(self):
+        self.task = None
+        self.shared = SharedDeadline()
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Выполнения по ключу в event loop: одна задача на ключ, остальные запросы ждут ее результат
+
+    Задача не привязана к клиенту: отключение первого запроса не отменяет генерацию,
+    пока ее ждет кто-то еще. Когда уходит последний ожидающий, задача отменяется.
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.coalesced = 0
+        self._calls = {}
+
+    async def run(self, key, factory, deadline=None):
+        """Возвращает (результат, coalesced); factory(shared) создает корутину выполнения
+
+        shared - SharedDeadline выполнения, к нему выполнение привязывает свои дедлайны.
+        deadline - момент time.monotonic(), после которого этому ожидающему ответ не нужен:
+        он уходит с WaiterDeadlineExceeded, выполнение продолжается для остальных.
+        key=None - без объединения (например, cache_bypass).
+        """
+        if key is None:
+            shared = SharedDeadline()
+            shared.add(deadline)
+            return await factory(shared), False
+
+        call = self._calls.get(key)
+        coalesced = call is not None
+        call_deadline = deadline
+        if call is None:
+            call = _Call()
+            call.shared.add(deadline)
+            call.task = asyncio.ensure_future(factory(call.shared))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.started += 1
+        else:
+            call.shared.add(deadline)
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    # shield: отмена одного ожидающего не должна отменять общую задачу
+                    return await asyncio.wait_for(asyncio.shield(call.task), timeout), coalesced
+                except asyncio.TimeoutError:
+                    # Самый поздний дедлайн - дедлайн самого выполнения: оно завершится
+                    # само, с этапом, на котором его сняли
+                    if call.shared.value is not None and call.shared.value <= deadline:
+                        deadline = None
+                        continue
+                    raise WaiterDeadlineExceeded()
+        finally:
+            call.waiters -= 1
+            call.shared.remove(call_deadline)
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def stats(self):
+        return {
+            'inflight': len(self._calls),
+            'started': self.started,
+            'coalesced': self.coalesced
+        }
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
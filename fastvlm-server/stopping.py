@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Критерии ранней остановки генерации
+Проверяются движком после каждого токена; имя сработавшего критерия
+становится finish_reason запроса.
+"""
+
+import time
+
+from config import Config
+
+# Естественные причины остановки: ответ не зависит от нагрузки и лимитов, его можно кэшировать.
+# length (лимит токенов) и deadline (время с постановки в очередь) обрывают ответ на середине.
+NATURAL_STOP_REASONS = frozenset({'eos', 'line_budget', 'repetition'})
+
+
+class StoppingCriterion:
+    """Базовый критерий: name - причина остановки, needs_text - нужен ли декодированный текст"""
+
+    name = 'stop'
+    needs_text = False
+
+    def __call__(self, gen_request):
+        raise NotImplementedError
+
+
+class LineBudgetCriterion(StoppingCriterion):
+    """Остановка, когда набрано max_lines непустых строк - столько оставляет постобработка"""
+
+    name = 'line_budget'
+    needs_text = True
+
+    def __init__(self, max_lines):
+        self.max_lines = max_lines
+
+    def __call__(self, gen_request):
+        text = gen_request.detokenizer.text
+        if text.count('\n') < self.max_lines:
+            return False
+        # Последняя строка еще может дописываться - считаем только завершенные
+        complete_lines = text.split('\n')[:-1]
+        return sum(1 for line in complete_lines if line.strip()) >= self.max_lines
+
+
+class RepetitionCriterion(StoppingCriterion):
+    """Зацикливание: хвост из n-граммы, повторенной min_repeats раз подряд, или одинаковые строки подряд
+
+    Короткие n-граммы должны занимать не меньше min_tokens токенов, чтобы "!!!!" или
+    разделитель из дефисов не считались зацикливанием.
+    """
+
+    name = 'repetition'
+    needs_text = True
+
+    def __init__(self, max_period, min_repeats, repeated_lines=3, min_tokens=16):
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.repeated_lines = repeated_lines
+        self.min_tokens = min_tokens
+
+    def __call__(self, gen_request):
+        return self._token_loop(gen_request.output_ids) or self._line_loop(gen_request.detokenizer.text)
+
+    def _token_loop(self, output_ids):
+        for period in range(1, self.max_period + 1):
+            repeats = max(self.min_repeats, -(-self.min_tokens // period))
+            span = period * repeats
+            if len(output_ids) < span:
+                continue
+            tail = output_ids[-span:]
+            if tail == tail[-period:] * repeats:
+                return True
+        return False
+
+    def _line_loop(self, text):
+        if text.count('\n') < self.repeated_lines:
+            return False
+        lines = [line.strip() for line in text.split('\n')[:-1] if line.strip()]
+        tail = lines[-self.repeated_lines:]
+        return len(tail) == self.repeated_lines and len(set(tail)) == 1
+
+
+class DeadlineCriterion(StoppingCriterion):
+    """Ограничение времени на запрос (с момента постановки в очередь)"""
+
+    name = 'deadline'
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, gen_request):
+        return time.monotonic() - gen_request.created_at > self.seconds
+
+
+def criteria_settings():
+    """Настройки Config, от которых зависят критерии остановки (часть ключа кэша результатов)"""
+    return {
+        'line_budget': Config.STOP_LINE_BUDGET,
+        'repetition': [Config.REPETITION_MAX_PERIOD, Config.REPETITION_MIN_REPEATS] if Config.STOP_ON_REPETITION else None
+    }
+
+
+def default_criteria(max_lines=None):
+    """Критерии остановки по настройкам Config"""
+    criteria = []
+    max_lines = Config.STOP_LINE_BUDGET if max_lines is None else max_lines
+    if max_lines > 0:
+        criteria.append(LineBudgetCriterion(max_lines))
+    if Config.STOP_ON_REPETITION:
+        criteria.append(RepetitionCriterion(Config.REPETITION_MAX_PERIOD, Config.REPETITION_MIN_REPEATS))
+    if Config.GENERATION_DEADLINE_SECONDS > 0:
+        criteria.append(DeadlineCriterion(Config.GENERATION_DEADLINE_SECONDS))
+    return criteria
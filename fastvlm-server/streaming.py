@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Потоковая выдача текста: инкрементальная детокенизация и форматирование Server-Sent Events
+"""
+
+import json
+
+# Символ замены: так выглядит незавершенная многобайтовая последовательность UTF-8
+REPLACEMENT_CHAR = '�'
+
+
+def strip_incomplete(text):
+    """Убирает '�': незавершенный многобайтовый символ в конце (обрыв по лимиту токенов) и битые байты"""
+    return text.replace(REPLACEMENT_CHAR, '')
+
+
+class IncrementalDetokenizer:
+    """Превращает поток токенов в поток текста, не разрывая многобайтовые символы
+
+    Byte-level BPE может разбить одну кириллическую букву на два токена: после первого
+    decode дает '�'. Такой хвост не отдается, пока следующий токен не завершит символ.
+    Текст декодируется окном от предыдущей выдачи, чтобы пробелы на границах токенов
+    не терялись.
+    """
+
+    def __init__(self, decode):
+        # decode - функция list[int] -> str (например, runner.decode_text)
+        self.decode = decode
+        self.token_ids = []
+        self.text = ''
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def push(self, token_id):
+        """Добавляет токен, возвращает новый готовый фрагмент текста (возможно пустой)"""
+        self.token_ids.append(token_id)
+        prefix_text = self.decode(self.token_ids[self._prefix_offset:self._read_offset])
+        new_text = self.decode(self.token_ids[self._prefix_offset:])
+
+        if len(new_text) <= len(prefix_text) or new_text.endswith(REPLACEMENT_CHAR):
+            return ''
+
+        # Внутри фрагмента '�' возможен только от действительно битых байтов - убираем их
+        delta = new_text[len(prefix_text):].replace(REPLACEMENT_CHAR, '')
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(self.token_ids)
+        self.text += delta
+        return delta
+
+    def flush(self):
+        """Отдает остаток после завершения генерации (битые байты в конце отбрасываются)"""
+        prefix_text = self.decode(self.token_ids[self._prefix_offset:self._read_offset])
+        new_text = self.decode(self.token_ids[self._prefix_offset:])
+        delta = strip_incomplete(new_text[len(prefix_text):])
+        self._prefix_offset = self._read_offset = len(self.token_ids)
+        self.text += delta
+        return delta
+
+
+def sse_event(event, data):
+    """Одно событие Server-Sent Events с JSON в поле data"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def sse_comment(text='keep-alive'):
+    """Комментарий SSE: не виден клиенту, но держит соединение и выявляет отключение"""
+    return f": {text}\n\n"
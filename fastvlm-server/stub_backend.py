@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Детерминированный бэкенд-заглушка без весов модели (FASTVLM_BACKEND=stub)
+Проходит весь путь сервера - декодирование и препроцессинг изображения, очередь,
+батчинг, кэши, стриминг и критерии остановки - но вместо модели "генерирует" один
+из готовых ответов. Задержки энкодера, prefill и шага декодирования настраиваются,
+поэтому обвязку сервера можно нагружать на ноутбуке или в CI.
+"""
+
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from model_runner import KVBatch, Runner
+
+# Байтовый токенизатор: токены 0-255 - байты UTF-8, 256 - конец ответа
+EOS_TOKEN_ID = 256
+VOCAB_SIZE = 257
+
+# Признаки изображения: сетка GRID x GRID позиций (как 256 токенов FastViTHD)
+GRID = 16
+HIDDEN_SIZE = 4
+
+# Ответ выбирается по содержимому промпта и изображения: один и тот же запрос - один и тот же ответ.
+# Кириллица занимает по 2 байта-токена и проверяет сборку многобайтовых символов при стриминге.
+RESPONSES = [
+    'На фото синяя джинсовая куртка прямого кроя.\n'
+    'Цвет: индиго, светлые потертости.\n'
+    'Материал: плотный хлопковый деним.\n'
+    'Стиль: casual.',
+    'The image shows a white cotton t-shirt with a crew neck.\n'
+    'Color: white.\n'
+    'Material: cotton jersey.\n'
+    'Style: minimalist, casual.',
+    'Черное платье миди из шелка с V-образным вырезом.\n'
+    'Стиль: вечерний.\n'
+    'Сочетание: лодочки и клатч.',
+    'A beige wool trench coat with a belt and double-breasted fastening.\n'
+    'Color: beige.\n'
+    'Style: classic, transitional season.'
+]
+RESPONSE_TOKENS = [list(text.encode('utf-8')) for text in RESPONSES]
+
+
+class StubRunner(Runner):
+    """Runner-заглушка: настоящие KVBatch и логиты, но без вычислений модели
+
+    KV каждой строки хранит в последней позиции номер ответа (key) и номер шага (value),
+    поэтому выбор/объединение строк батча и кэш префиксов работают как с настоящей моделью.
+    Задержки: encode_latency_ms на изображение, prefill_latency_ms на вызов prefill,
+    token_latency_ms на шаг декодирования (для всего батча сразу, как на GPU).
+    """
+
+    name = 'stub'
+    model_type = 'stub'
+    context_len = 4096
+
+    def __init__(self, token_latency_ms=20.0, prefill_latency_ms=50.0, encode_latency_ms=30.0,
+                 image_size=1024, image_position='before'):
+        super().__init__(torch.device('cpu'), torch.float32)
+        self.token_latency = token_latency_ms / 1000.0
+        self.prefill_latency = prefill_latency_ms / 1000.0
+        self.encode_latency = encode_latency_ms / 1000.0
+        self._image_size = image_size
+        self.image_position = image_position
+        self.eos_token_ids = {EOS_TOKEN_ID}
+
+    @property
+    def image_size(self):
+        return self._image_size
+
+    def tokenize_prompt(self, prompt):
+        """Шаблон в духе qwen_2; изображение до или после текста, как у FastVLMRunner"""
+        header = list('<|im_start|>system\nYou are a helpful assistant.<|im_end|>\n<|im_start|>user\n'.encode('utf-8'))
+        footer = list('<|im_end|>\n<|im_start|>assistant\n'.encode('utf-8'))
+        text = list(prompt.encode('utf-8'))
+        newline = list(b'\n')
+        if self.image_position == 'after':
+            body = text + newline + [self.image_token_index]
+        else:
+            body = [self.image_token_index] + newline + text
+        return header + body + footer
+
+    def decode_text(self, token_ids):
+        return bytes(token_id for token_id in token_ids if token_id < 256).decode('utf-8', errors='replace')
+
+    def preprocess_image(self, image):
+        """Resize до стороны энкодера и перевод в тензор [3, S, S], как у настоящего препроцессинга"""
+        image = image.convert('RGB').resize((self._image_size, self._image_size))
+        return torch.from_numpy(np.asarray(image, dtype=np.float32)).permute(2, 0, 1) / 255.0
+
+    def encode_images(self, image_tensors):
+        """Средние цвета сетки GRID x GRID, округленные до целых: суммы признаков считаются точно"""
+        if self.encode_latency:
+            time.sleep(self.encode_latency * len(image_tensors))
+        features = []
+        for tensor in image_tensors:
+            pooled = F.adaptive_avg_pool2d(tensor.float(), GRID).flatten(1).t()
+            colors = torch.round(pooled * 255)
+            features.append(torch.cat([colors, colors.new_zeros((colors.shape[0], HIDDEN_SIZE - 3))], dim=1))
+        return features
+
+    def embed_text(self, input_ids):
+        embeds = torch.zeros((len(input_ids), HIDDEN_SIZE), dtype=self.dtype)
+        embeds[:, 0] = torch.tensor(input_ids, dtype=self.dtype)
+        return embeds
+
+    def prefill(self, embeds_list, prefixes=None):
+        if self.prefill_latency:
+            time.sleep(self.prefill_latency)
+        prefixes = prefixes or [None] * len(embeds_list)
+        length = max(embeds.shape[0] for embeds in embeds_list)
+        prefix_length = max((prefix.length for prefix in prefixes if prefix is not None), default=0)
+
+        batch_size = len(embeds_list)
+        attention_mask = torch.zeros((batch_size, prefix_length + length), dtype=torch.long)
+        seeds = torch.zeros(batch_size, dtype=self.dtype)
+        for row, (embeds, prefix) in enumerate(zip(embeds_list, prefixes)):
+            attention_mask[row, attention_mask.shape[1] - embeds.shape[0]:] = 1
+            # Сумма эмбеддингов - целое число, поэтому не зависит от того, где промпт разрезан на префикс
+            seeds[row] = embeds.sum()
+            if prefix is not None:
+                attention_mask[row, prefix_length - prefix.length:prefix_length] = prefix.attention_mask[0]
+                seeds[row] += prefix.past[0][0][0, 0, -1, 0]
+
+        steps = torch.zeros(batch_size, dtype=self.dtype)
+        past = self._state(seeds, steps, attention_mask.shape[1])
+        return self._logits(seeds, steps), KVBatch(past, attention_mask, attention_mask.sum(dim=1))
+
+    def decode(self, batch, token_ids):
+        if self.token_latency:
+            time.sleep(self.token_latency)
+        key, value = batch.past[0]
+        seeds = key[:, 0, -1, 0]
+        steps = value[:, 0, -1, 0] + 1
+        column_key, column_value = self._state(seeds, steps, 1)[0]
+        batch.past = ((torch.cat([key, column_key], dim=2), torch.cat([value, column_value], dim=2)),)
+        batch.attention_mask = torch.cat([batch.attention_mask, batch.attention_mask.new_ones((batch.size, 1))], dim=1)
+        batch.positions = batch.positions + 1
+        return self._logits(seeds, steps)
+
+    def _state(self, seeds, steps, length):
+        """KV одного слоя [B, 1, length, 1]: номер ответа и шаг в последней позиции"""
+        key = torch.zeros((seeds.shape[0], 1, length, 1), dtype=self.dtype)
+        value = torch.zeros_like(key)
+        key[:, 0, -1, 0] = seeds
+        value[:, 0, -1, 0] = steps
+        return ((key, value),)
+
+    def _logits(self, seeds, steps):
+        """Логиты с единственным допустимым токеном: следующий байт ответа или EOS"""
+        logits = torch.full((seeds.shape[0], VOCAB_SIZE), -1e4, dtype=torch.float32)
+        for row, (seed, step) in enumerate(zip(seeds.tolist(), steps.tolist())):
+            tokens = RESPONSE_TOKENS[int(seed) % len(RESPONSE_TOKENS)]
+            step = int(step)
+            logits[row, tokens[step] if step < len(tokens) else EOS_TOKEN_ID] = 0.0
+        return logits
@@ -5,16 +5,29 @@
 - Отправляет на сервер по API
 - Получает ответ и выводит его
 - Логирует время выполнения запроса
+
+Нагрузочный бенчмарк (см. python test_server_api.py bench --help):
+- closed-loop: N клиентов, каждый отправляет следующий запрос после ответа на предыдущий
+- open-loop: запросы приходят потоком Пуассона с заданной частотой, независимо от ответов
+- пропускная способность, p50/p95/p99 задержки и TTFT, доля ошибок и отказов (429/503),
+  время этапов на сервере по /stats; результат в JSON и сравнение с сохраненным baseline
 """
 
+import io
 import os
+import math
 import sys
 import json
 import time
 import base64
+import random
 import logging
+import argparse
+import threading
 import requests
 from pathlib import Path
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 
 # Настройка логирования
 logging.basicConfig(
@@ -60,7 +73,61 @@ class FastVLMTester:
     def __init__(self, server_url="http://127.0.0.1:3001"):
         self.server_url = server_url
         self.analyze_endpoint = f"{server_url}/analyze"
+        self.stream_endpoint = f"{server_url}/analyze/stream"
         self.health_endpoint = f"{server_url}/health"
+        self.stats_endpoint = f"{server_url}/stats"
+        self._local = threading.local()
+
+    def session(self):
+        """Своя requests.Session (и keep-alive соединение) на каждый поток нагрузки"""
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def server_stats(self):
+        """Счетчики движка и этапов конвейера из /stats"""
+        response = requests.get(self.stats_endpoint, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def timed_analysis(self, image_data, prompt, stream=False, cache_bypass=True, timeout=300):
+        """Один запрос анализа сырыми байтами; возвращает статус, задержку и TTFT в мс
+
+        Для потока TTFT - время до первого события token у клиента,
+        без потока - ttft_ms, который сообщил сервер.
+        """
+        headers = {
+            'Content-Type': 'image/jpeg',
+            'X-Prompt': quote(prompt),
+            'X-Cache-Bypass': 'true' if cache_bypass else 'false'
+        }
+        sample = {'status': None, 'latency_ms': None, 'ttft_ms': None, 'error': None}
+        start = time.perf_counter()
+        try:
+            if stream:
+                with self.session().post(self.stream_endpoint, data=image_data, headers=headers,
+                                         stream=True, timeout=timeout) as response:
+                    sample['status'] = response.status_code
+                    if response.status_code == 200:
+                        for line in response.iter_lines(decode_unicode=True):
+                            if line == 'event: token' and sample['ttft_ms'] is None:
+                                sample['ttft_ms'] = (time.perf_counter() - start) * 1000
+                            elif line == 'event: error':
+                                sample['error'] = 'stream error'
+                    else:
+                        # Дочитываем тело ошибки, чтобы соединение вернулось в пул
+                        response.content
+            else:
+                response = self.session().post(self.analyze_endpoint, data=image_data, headers=headers, timeout=timeout)
+                sample['status'] = response.status_code
+                if response.status_code == 200:
+                    sample['ttft_ms'] = response.json().get('ttft_ms')
+        except requests.exceptions.RequestException as e:
+            sample['error'] = type(e).__name__
+        sample['latency_ms'] = (time.perf_counter() - start) * 1000
+        if sample['status'] is not None and sample['status'] != 200 and sample['error'] is None:
+            sample['error'] = f"HTTP {sample['status']}"
+        return sample
 
     def check_server_health(self):
         """Проверка доступности сервера"""
@@ -154,12 +221,321 @@ def find_test_images(project_root):
 
     return images
 
+# === Нагрузочный бенчмарк ===
+
+# Метрики для сравнения с baseline: True - больше лучше, False - меньше лучше
+BASELINE_METRICS = {
+    'throughput_rps': True,
+    'latency_ms.p50': False,
+    'latency_ms.p95': False,
+    'latency_ms.p99': False,
+    'ttft_ms.p50': False,
+    'ttft_ms.p95': False,
+    'error_rate': False,
+    'rejected_rate': False
+}
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу; None для пустого списка"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return round(ordered[rank - 1], 1)
+
+def distribution(values):
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': round(max(values), 1) if values else None
+    }
+
+def synthetic_image(side, seed):
+    """JPEG side x side*3/4 с шумом и градиентом: сжимается как фото, а не как заливка"""
+    from PIL import Image
+
+    size = (side, side * 3 // 4)
+    noise = Image.effect_noise(size, 30 + seed % 20).convert('RGB')
+    gradient = Image.linear_gradient('L').resize(size).convert('RGB')
+    buffer = io.BytesIO()
+    Image.blend(noise, gradient, 0.5).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+class Workload:
+    """Смесь изображений и промптов, из которой запросы выбираются случайно (с фиксированным seed)"""
+
+    def __init__(self, images, prompts, seed=0):
+        self.images = images
+        self.prompts = prompts
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, sizes, image_dir=None, prompts_file=None, variants=3, seed=0):
+        """Синтетические изображения заданных сторон (по variants разных на размер) или файлы каталога"""
+        if image_dir:
+            images = [(Path(path).name, Path(path).read_bytes()) for path in find_test_images(image_dir)]
+            if not images:
+                raise ValueError(f"В каталоге нет изображений: {image_dir}")
+        else:
+            images = [(f"{side}px", synthetic_image(side, seed + i)) for side in sizes for i in range(variants)]
+
+        if prompts_file:
+            with open(prompts_file, 'r', encoding='utf-8') as f:
+                prompts = [line.strip() for line in f if line.strip()]
+        else:
+            prompts = [
+                load_prompt_from_file(),
+                'Describe the clothing items in the image briefly: type, color, style.',
+                'What is the main color of the outfit?'
+            ]
+        return cls(images, prompts, seed)
+
+    def pick(self):
+        with self._lock:
+            label, image_data = self._rng.choice(self.images)
+            return label, image_data, self._rng.choice(self.prompts)
+
+class LoadBenchmark:
+    """Генерирует нагрузку на сервер и собирает замеры по каждому запросу"""
+
+    def __init__(self, tester, workload, stream=False, cache_bypass=True, timeout=300):
+        self.tester = tester
+        self.workload = workload
+        self.stream = stream
+        self.cache_bypass = cache_bypass
+        self.timeout = timeout
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def _request(self, scheduled=None):
+        label, image_data, prompt = self.workload.pick()
+        sample = self.tester.timed_analysis(image_data, prompt, self.stream, self.cache_bypass, self.timeout)
+        sample['image'] = label
+        if scheduled is not None:
+            # Open-loop: задержка от запланированного прихода, включая ожидание свободного клиента
+            sample['latency_ms'] = (time.perf_counter() - scheduled) * 1000
+        with self._lock:
+            self.samples.append(sample)
+
+    def run_closed(self, concurrency, duration=None, total=None):
+        """concurrency клиентов шлют запросы без пауз: до total запросов или duration секунд"""
+        deadline = time.perf_counter() + duration if duration else None
+        counter = iter(range(total)) if total else None
+        counter_lock = threading.Lock()
+
+        def client():
+            while True:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                if counter is not None:
+                    with counter_lock:
+                        if next(counter, None) is None:
+                            return
+                self._request()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def run_open(self, rate, duration, max_inflight=256, seed=0):
+        """Поток Пуассона: интервалы между приходами экспоненциальные со средним 1/rate"""
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+            scheduled = start
+            while scheduled - start < duration:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._request, scheduled)
+                scheduled += rng.expovariate(rate)
+        return time.perf_counter() - start
+
+    def summarize(self, wall_time):
+        ok = [s for s in self.samples if s['status'] == 200 and s['error'] is None]
+        rejected = [s for s in self.samples if s['status'] in (429, 503)]
+        total = len(self.samples)
+        by_image = {}
+        for sample in ok:
+            by_image.setdefault(sample['image'], []).append(sample['latency_ms'])
+        return {
+            'requests': total,
+            'completed': len(ok),
+            'wall_time_s': round(wall_time, 2),
+            'throughput_rps': round(len(ok) / wall_time, 3) if wall_time > 0 else None,
+            'latency_ms': distribution([s['latency_ms'] for s in ok]),
+            'ttft_ms': distribution([s['ttft_ms'] for s in ok if s['ttft_ms'] is not None]),
+            'error_rate': round((total - len(ok) - len(rejected)) / total, 4) if total else None,
+            'rejected_rate': round(len(rejected) / total, 4) if total else None,
+            'status_counts': {str(status): sum(1 for s in self.samples if s['status'] == status)
+                              for status in sorted({s['status'] for s in self.samples}, key=str)},
+            'latency_by_image_ms': {label: distribution(values) for label, values in sorted(by_image.items())}
+        }
+
+def stage_average(before, after, key):
+    """Среднее по счетчикам этапа только за время прогона (из накопительных средних /stats)"""
+    def total(stats):
+        count = stats.get('completed', 0) + stats.get('failed', 0)
+        return count, (stats.get(key) or 0) * count
+
+    count_before, sum_before = total(before)
+    count_after, sum_after = total(after)
+    if count_after <= count_before:
+        return None
+    return round((sum_after - sum_before) / (count_after - count_before), 2)
+
+def server_side_timings(before, after):
+    """Время этапов и работа движка на сервере за время прогона по разнице /stats"""
+    completed = after.get('requests_completed', 0) - before.get('requests_completed', 0)
+    timings = {
+        'requests_completed': completed,
+        'avg_server_ttft_ms': round((after.get('ttft_ms_total', 0) - before.get('ttft_ms_total', 0)) / completed, 1)
+        if completed else None,
+        'avg_service_ms': after.get('avg_service_ms'),
+        'tokens_generated': after.get('tokens_generated', 0) - before.get('tokens_generated', 0),
+        'prefill_batches': after.get('prefill_batches', 0) - before.get('prefill_batches', 0),
+        'decode_steps': after.get('decode_steps', 0) - before.get('decode_steps', 0),
+        'max_batch_seen': after.get('max_batch_seen')
+    }
+    for stage in ('decode', 'preprocess'):
+        stage_before = before.get('pipeline', {}).get(stage, {})
+        stage_after = after.get('pipeline', {}).get(stage, {})
+        timings[stage] = {
+            'avg_wait_ms': stage_average(stage_before, stage_after, 'avg_wait_ms'),
+            'avg_run_ms': stage_average(stage_before, stage_after, 'avg_run_ms')
+        }
+    return timings
+
+def metric_value(result, path):
+    value = result
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def compare_with_baseline(result, baseline, tolerance):
+    """Строки сравнения с baseline: (метрика, было, стало, изменение %, регрессия)"""
+    rows = []
+    for path, higher_is_better in BASELINE_METRICS.items():
+        old, new = metric_value(baseline, path), metric_value(result, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else (0.0 if new == old else float('inf'))
+        worse = -change if higher_is_better else change
+        rows.append((path, old, new, change, worse > tolerance))
+    return rows
+
+def bench_main(args):
+    """Нагрузочный прогон: прогрев, нагрузка, сводка, JSON и сравнение с baseline"""
+    tester = FastVLMTester(args.url)
+    if not tester.check_server_health():
+        logger.error("Server unavailable. Make sure server is running.")
+        sys.exit(1)
+
+    sizes = [int(side) for side in args.sizes.split(',')]
+    workload = Workload.build(sizes, args.images, args.prompts, seed=args.seed)
+    bench = LoadBenchmark(tester, workload, stream=args.stream, cache_bypass=not args.allow_cache, timeout=args.timeout)
+
+    logger.info(f"Warmup: {args.warmup} requests")
+    for _ in range(args.warmup):
+        bench._request()
+    bench.samples = []
+
+    stats_before = tester.server_stats()
+    if args.mode == 'closed':
+        logger.info(f"Closed-loop: {args.concurrency} clients, "
+                    f"{f'{args.requests} requests' if args.requests else f'{args.duration}s'}")
+        wall_time = bench.run_closed(args.concurrency, duration=None if args.requests else args.duration, total=args.requests)
+    else:
+        logger.info(f"Open-loop: Poisson {args.rate} req/s for {args.duration}s")
+        wall_time = bench.run_open(args.rate, args.duration, max_inflight=args.max_inflight, seed=args.seed)
+    stats_after = tester.server_stats()
+
+    result = {
+        'config': {
+            'mode': args.mode,
+            'concurrency': args.concurrency if args.mode == 'closed' else None,
+            'rate': args.rate if args.mode == 'open' else None,
+            'duration_s': args.duration,
+            'requests': args.requests,
+            'stream': args.stream,
+            'cache_bypass': not args.allow_cache,
+            'images': [label for label, _ in workload.images],
+            'prompts': len(workload.prompts),
+            'url': args.url,
+            'timestamp': time.time()
+        },
+        **bench.summarize(wall_time),
+        'server': server_side_timings(stats_before, stats_after)
+    }
+
+    print(json.dumps({key: result[key] for key in result if key != 'config'}, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        logger.info(f"Results saved: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare_with_baseline(result, baseline, args.tolerance)
+        differs = [key for key in ('mode', 'concurrency', 'rate', 'stream', 'cache_bypass')
+                   if baseline.get('config', {}).get(key) != result['config'][key]]
+        if differs:
+            logger.warning(f"Baseline run used different settings: {', '.join(differs)}")
+        regressions = [row for row in rows if row[4]]
+        print(f"\nСравнение с {args.baseline} (допуск {args.tolerance}%):")
+        for path, old, new, change, regressed in rows:
+            mark = 'РЕГРЕССИЯ' if regressed else ''
+            print(f"  {path:<16} {old:>10} -> {new:>10} ({change:+.1f}%) {mark}")
+        if regressions and args.fail_on_regression:
+            sys.exit(2)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Тест и нагрузочный бенчмарк FastVLM Server API')
+    parser.add_argument('--url', default='http://127.0.0.1:3001', help='Адрес сервера')
+    commands = parser.add_subparsers(dest='command')
+
+    bench = commands.add_parser('bench', help='Нагрузочный бенчмарк')
+    bench.add_argument('--mode', choices=('closed', 'open'), default='closed',
+                       help='closed - N клиентов без пауз, open - поток Пуассона с частотой --rate')
+    bench.add_argument('-c', '--concurrency', type=int, default=4, help='Клиентов в closed-loop')
+    bench.add_argument('--rate', type=float, default=2.0, help='Запросов в секунду в open-loop')
+    bench.add_argument('-d', '--duration', type=float, default=30.0, help='Длительность прогона, секунды')
+    bench.add_argument('-n', '--requests', type=int, help='Closed-loop: фиксированное число запросов вместо --duration')
+    bench.add_argument('--max-inflight', type=int, default=256, help='Open-loop: предел одновременных запросов клиента')
+    bench.add_argument('--sizes', default='640,1280,4032', help='Стороны синтетических изображений через запятую')
+    bench.add_argument('--images', help='Каталог с изображениями вместо синтетических')
+    bench.add_argument('--prompts', help='Файл с промптами, по одному на строку')
+    bench.add_argument('--stream', action='store_true', help='Через /analyze/stream: TTFT по первому токену у клиента')
+    bench.add_argument('--allow-cache', action='store_true', help='Не обходить кэш результатов')
+    bench.add_argument('--warmup', type=int, default=2, help='Запросов прогрева (не входят в результат)')
+    bench.add_argument('--timeout', type=float, default=300, help='Таймаут запроса, секунды')
+    bench.add_argument('--seed', type=int, default=0)
+    bench.add_argument('-o', '--output', help='Сохранить результат в JSON')
+    bench.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    bench.add_argument('--tolerance', type=float, default=10.0, help='Допустимое ухудшение метрики, %%')
+    bench.add_argument('--fail-on-regression', action='store_true', help='Код выхода 2 при регрессии')
+    return parser.parse_args()
+
 def main():
     """Главная функция"""
+    args = parse_args()
+    if args.command == 'bench':
+        bench_main(args)
+        return
+
     logger.info("Starting FastVLM Server API test")
 
     # Инициализация тестера
-    tester = FastVLMTester()
+    tester = FastVLMTester(args.url)
 
     # Проверка доступности сервера
     if not tester.check_server_health():
@@ -190,6 +566,8 @@ def main():
             print(f"Device: {result['device']}")
         if 'model_used' in result:
             print(f"Model: {result['model_used']}")
+        if 'ttft_ms' in result:
+            print(f"Time to first token: {result['ttft_ms']} ms")
         print(f"Execution time: {result.get('execution_time', 'N/A')}")
     else:
         logger.error("Test failed")
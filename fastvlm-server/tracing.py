@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Трассировка запросов: идентификатор запроса и время этапов анализа
+Идентификатор приходит от Node в заголовке X-Request-ID (или генерируется сервером),
+попадает во все записи лога, сделанные в контексте запроса, и возвращается в ответе.
+Время этапов собирается монотонными таймерами и пишется одной JSON-записью в лог.
+"""
+
+import json
+import time
+import uuid
+import logging
+import contextvars
+from contextlib import contextmanager
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Длинные и произвольные идентификаторы от клиента не попадают в лог как есть
+MAX_REQUEST_ID_LENGTH = 128
+
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+
+def new_request_id(value=None):
+    """Идентификатор запроса: присланный клиентом (если он приличный) или новый"""
+    if value:
+        value = value.strip()
+        if 0 < len(value) <= MAX_REQUEST_ID_LENGTH and value.isprintable():
+            return value
+    return uuid.uuid4().hex
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет request_id текущего запроса в каждую запись лога ('-' вне запроса)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class RequestTimings:
+    """Время этапов одного запроса в мс с момента создания объекта и счетчики генерации
+
+    measure(name) - контекстный менеджер вокруг этапа, add(name, ms) - готовое значение
+    (например, из движка); повторные замеры одного этапа складываются.
+    note(name, value) - значение не из этапов: токены, скорость генерации, TTFT.
+    """
+
+    def __init__(self, request_id=None):
+        self.request_id = request_id or request_id_var.get()
+        self.started = time.monotonic()
+        self.stages = {}
+        self.notes = {}
+
+    @contextmanager
+    def measure(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, (time.monotonic() - start) * 1000)
+
+    def add(self, name, ms):
+        if ms is not None:
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def note(self, name, value):
+        if value is not None:
+            self.notes[name] = value
+
+    def update(self, other):
+        """Добавляет этапы и счетчики другого RequestTimings (например, общей генерации)"""
+        for name, ms in other.stages.items():
+            self.add(name, ms)
+        self.notes.update(other.notes)
+
+    def total_ms(self):
+        return round((time.monotonic() - self.started) * 1000, 1)
+
+    def as_dict(self):
+        stages = {name: round(ms, 1) for name, ms in self.stages.items()}
+        return {**stages, 'total_ms': self.total_ms(), **self.notes}
+
+
+def log_timings(logger, event, timings, **fields):
+    """Структурированная запись о запросе: одна строка JSON с этапами и полями результата"""
+    record = {'event': event, 'request_id': timings.request_id, **fields, 'timings': timings.as_dict()}
+    logger.info(json.dumps(record, ensure_ascii=False))
@@ -2,73 +2,61 @@ const express = require('express');
 const router = express.Router();
 const { validateTelegramWebAppData } = require('../utils/telegram');
 const User = require('../models/User');
+const { fastvlmRequest } = require('../utils/fastvlm');
 const path = require('path');
 const fs = require('fs');
+const crypto = require('crypto');
 
-// Используем встроенный fetch в Node.js 18+
+// Таймаут ожидания анализа; FastVLM получает чуть меньший дедлайн, чтобы сам снять
+// просроченный запрос и ответить 504 раньше, чем клиент оборвет соединение
+const FASTVLM_TIMEOUT_MS = 30000;
+const FASTVLM_DEADLINE_MARGIN_MS = 1000;
+// Если FastVLM оценивает ожидание в очереди дольше, он сразу отвечает 503 (reason: wait_limit):
+// отдельная проверка /health перед каждым анализом не нужна
+const FASTVLM_MAX_WAIT_MS = 20000;
 
 // Временно закомментировал TensorFlow
 // const tf = require('@tensorflow/tfjs-node');
 // const sharp = require('sharp');
 
-// Проверка доступности FastVLM сервера
-async function checkFastVLMHealth() {
-    try {
-        const controller = new AbortController();
-        const timeoutId = setTimeout(() => controller.abort(), 5000);
-
-        const response = await fetch('http://127.0.0.1:3001/health', {
-            signal: controller.signal
-        });
-
-        clearTimeout(timeoutId);
-        return response.ok;
-    } catch (error) {
-        return false;
-    }
-}
-
 // Анализ изображения через FastVLM сервер
-async function classifyImage(imageBuffer) {
+// requestId уходит в заголовке X-Request-ID: по нему запрос находится в логах FastVLM сервера
+// userId (telegramId) - в X-User-ID: очередь FastVLM делит генерацию между пользователями поровну
+async function classifyImage(imageBuffer, requestId, userId) {
     try {
-        // Проверяем доступность FastVLM сервера
-        const isHealthy = await checkFastVLMHealth();
-        if (!isHealthy) {
-            console.log('FastVLM сервер недоступен, используем симуляцию');
-            return simulateClassification();
-        }
-
         console.log('Отправка запроса в FastVLM сервер...');
 
-        // Конвертируем изображение в base64
-        const base64Image = imageBuffer.toString('base64');
-
         // Создаем промпт
         const prompt = "Describe in detail what clothing items you see in this image. What type, color, style and material? Please provide a detailed description in Russian language using fashion terms.";
 
-        // Отправляем запрос в FastVLM сервер
-        const controller = new AbortController();
-        const timeoutId = setTimeout(() => controller.abort(), 30000); // 30 секунд таймаут
-
-        const response = await fetch('http://127.0.0.1:3001/analyze', {
+        // Отправляем запрос в FastVLM сервер (Unix-сокет или TCP, keep-alive)
+        // Изображение уходит сырыми байтами, без base64 и JSON; промпт - в заголовке (URL-encoded)
+        const response = await fastvlmRequest('/analyze', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/octet-stream',
+                'X-Prompt': encodeURIComponent(prompt),
+                'X-Request-ID': requestId,
+                'X-User-ID': String(userId),
+                'X-Priority': 'interactive',
+                'X-Timings': 'true',
+                'X-Deadline-Ms': String(FASTVLM_TIMEOUT_MS - FASTVLM_DEADLINE_MARGIN_MS),
+                'X-Max-Wait-Ms': String(FASTVLM_MAX_WAIT_MS)
             },
-            body: JSON.stringify({
-                image_base64: base64Image,
-                prompt: prompt
-            }),
-            signal: controller.signal
+            body: imageBuffer,
+            timeout: FASTVLM_TIMEOUT_MS
         });
 
-        clearTimeout(timeoutId);
-
         if (response.ok) {
             const result = await response.json();
 
             if (result.success) {
-                console.log('FastVLM анализ успешен');
+                console.log(`[${requestId}] FastVLM анализ успешен, позиция в очереди:`,
+                    response.headers['x-queue-position'], 'ожидание:', response.headers['x-estimated-wait-ms'], 'мс');
+                if (result.timings) {
+                    // Этапы на стороне FastVLM: decode, preprocess, очередь, prefill, генерация (мс)
+                    console.log(`[${requestId}] FastVLM timings:`, JSON.stringify(result.timings));
+                }
 
                 // Извлекаем тип одежды из анализа
                 let analysisText = result.analysis || '';
@@ -112,6 +100,21 @@ async function classifyImage(imageBuffer) {
                 console.error('FastVLM сервер вернул ошибку:', result.error);
                 return simulateClassification();
             }
+        } else if (response.status === 504) {
+            // Дедлайн прошел: FastVLM уже снял запрос с очереди или остановил генерацию
+            console.warn(`[${requestId}] FastVLM не успел до дедлайна, этап:`, response.json().stage);
+            return simulateClassification();
+        } else if (response.status === 429) {
+            // У пользователя уже слишком много фото в очереди: остальные пользователи не ждут его альбом
+            console.warn(`[${requestId}] Очередь пользователя ${userId} в FastVLM заполнена, Retry-After:`,
+                response.headers['retry-after'], 'с');
+            return simulateClassification();
+        } else if (response.status === 503) {
+            // Перегрузка (очередь заполнена или ждать дольше FASTVLM_MAX_WAIT_MS): сервер отвечает сразу
+            const result = response.json();
+            console.warn(`[${requestId}] FastVLM сервер перегружен (${result.reason}), Retry-After:`,
+                response.headers['retry-after'], 'с');
+            return simulateClassification();
         } else {
             console.error('FastVLM сервер недоступен, статус:', response.status);
             return simulateClassification();
@@ -156,7 +159,9 @@ function simulateClassification() {
  */
 router.post('/', async (req, res) => {
     try {
-        console.log('Получен запрос на анализ изображения');
+        // Идентификатор запроса сквозной: от Telegram-запроса до записей FastVLM сервера
+        const requestId = req.get('X-Request-ID') || crypto.randomUUID();
+        console.log(`[${requestId}] Получен запрос на анализ изображения`);
         const { photo, pinterestUrl, initData } = req.body;
         
         if ((!photo && !pinterestUrl) || !initData) {
@@ -216,7 +221,7 @@ router.post('/', async (req, res) => {
                 }
                 
                 // Классифицируем изображение через FastVLM
-                classification = await classifyImage(imageBuffer);
+                classification = await classifyImage(imageBuffer, requestId, user.id);
                 console.log('Результат классификации:', classification);
                 
                 // Проверка на корректность результатов классификации
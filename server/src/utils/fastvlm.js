@@ -0,0 +1,67 @@
+const http = require('http');
+
+// FastVLM сервер работает на той же машине: Unix-сокет (FASTVLM_SOCKET) или TCP
+const FASTVLM_SOCKET = process.env.FASTVLM_SOCKET || '';
+const FASTVLM_HOST = process.env.FASTVLM_HOST || '127.0.0.1';
+const FASTVLM_PORT = parseInt(process.env.FASTVLM_PORT || '3001', 10);
+
+// Соединения переиспользуются между запросами (keep-alive), без нового handshake на каждый вызов
+const agent = new http.Agent({ keepAlive: true, maxSockets: 16 });
+
+/**
+ * HTTP-запрос к FastVLM серверу
+ * @param {string} path - Путь, например '/analyze'
+ * @param {Object} options - method, headers, body (Buffer или строка), timeout (мс, на весь запрос)
+ * @returns {Promise<Object>} - { ok, status, headers, json() }
+ */
+function fastvlmRequest(path, { method = 'GET', headers = {}, body = null, timeout = 5000 } = {}) {
+    return new Promise((resolve, reject) => {
+        const options = { method, path, agent, headers: { ...headers } };
+        if (FASTVLM_SOCKET) {
+            options.socketPath = FASTVLM_SOCKET;
+        } else {
+            options.host = FASTVLM_HOST;
+            options.port = FASTVLM_PORT;
+        }
+        if (body) {
+            options.headers['Content-Length'] = Buffer.byteLength(body);
+        }
+
+        const req = http.request(options, (res) => {
+            const chunks = [];
+            res.on('data', (chunk) => chunks.push(chunk));
+            res.on('end', () => {
+                clearTimeout(timer);
+                const text = Buffer.concat(chunks).toString('utf8');
+                resolve({
+                    ok: res.statusCode >= 200 && res.statusCode < 300,
+                    status: res.statusCode,
+                    headers: res.headers,
+                    json: () => JSON.parse(text)
+                });
+            });
+            res.on('error', (error) => {
+                clearTimeout(timer);
+                reject(error);
+            });
+        });
+
+        const timer = setTimeout(() => {
+            req.destroy(new Error(`FastVLM request timeout: ${timeout} ms`));
+        }, timeout);
+
+        req.on('error', (error) => {
+            clearTimeout(timer);
+            reject(error);
+        });
+
+        if (body) {
+            req.write(body);
+        }
+        req.end();
+    });
+}
+
+module.exports = {
+    fastvlmRequest
+};
@@ -1,122 +1,570 @@
 #!/usr/bin/env python3
 """
 FastVLM Analyzer Module для TgStyle
-Исправленная версия - принимает данные через stdin, избегая ENAMETOOLONG
+Долгоживущий воркер анализа: модель загружается один раз, запросы и ответы идут
+строками JSON (NDJSON) через stdin/stdout с идентификаторами, поэтому родительский
+процесс может отправлять запросы потоком, не дожидаясь ответов на предыдущие.
+
+    python fastvlm_analyzer.py --worker          # один воркер с моделью
+    python fastvlm_analyzer.py --pool 2          # супервизор: 2 воркера, пинги, перезапуск при падении
+    python fastvlm_analyzer.py < request.json    # один запрос без id (прежний режим)
+
+Протокол - по одному JSON-объекту в строке, ответы приходят по мере готовности, не по порядку:
+
+    -> {"id": "r1", "op": "analyze", "image_base64": "...", "prompt": "..."}
+    <- {"id": "r1", "success": true, "analysis": "...", "cached": false, "finish_reason": "eos"}
+    -> {"id": "p1", "op": "ping"}
+    <- {"id": "p1", "op": "pong", "pid": 1234, "queue_depth": 0, "backlog": 0, "active": 1}
+
+Остальные поля запроса - как у /analyze fastvlm-server (deterministic, cache_bypass,
+deadline_ms, user_id, priority). После загрузки модели воркер пишет {"op": "ready", ...};
+конец stdin - воркер отвечает на начатые запросы и завершается.
+
+Внутри воркера работает движок непрерывного батчинга fastvlm-server, поэтому запросы,
+пришедшие подряд, генерируются общим батчем - без отдельного процесса predict.py,
+импорта torch и загрузки чекпоинта на каждое изображение.
 """
 
+import io
+import os
 import sys
 import json
-import base64
-import tempfile
+import time
+import queue
+import logging
+import argparse
+import itertools
+import threading
 import subprocess
-import os
-from PIL import Image
-import io
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.normpath(os.path.join(CURRENT_DIR, '../../..'))
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'fastvlm-server')
+
+# Пинг воркера раз в PING_INTERVAL секунд; нет ответа дольше PING_TIMEOUT - воркер завис
+PING_INTERVAL = 10.0
+PING_TIMEOUT = 30.0
+# Сколько ждать сообщения ready (загрузка модели) до перезапуска воркера
+STARTUP_TIMEOUT = 600.0
+# Пауза перед перезапуском упавшего воркера: удваивается при падениях подряд
+RESPAWN_DELAY = 1.0
+RESPAWN_MAX_DELAY = 30.0
+# Воркер, проработавший столько секунд, считается стабильным: пауза сбрасывается
+STABLE_SECONDS = 60.0
+
+logger = logging.getLogger('fastvlm_analyzer')
+
+
+def default_python():
+    """Python окружения FastVLM (fastvlm_env), если оно есть, иначе текущий интерпретатор"""
+    env_dir = os.path.join(PROJECT_ROOT, 'fastvlm_env')
+    for candidate in (os.path.join(env_dir, 'Scripts', 'python.exe'), os.path.join(env_dir, 'bin', 'python')):
+        if os.path.exists(candidate):
+            return candidate
+    return sys.executable
+
+
+class LineWriter:
+    """Потокобезопасная запись сообщений по одному JSON в строке"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, message):
+        data = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            try:
+                self.stream.write(data)
+                self.stream.flush()
+            except (BrokenPipeError, ValueError):
+                # Другая сторона закрыла канал: ответ уже некому читать
+                pass
+
+
+def read_messages(stream):
+    """Сообщения из бинарного потока строк JSON: (сообщение, None) или (None, ошибка)"""
+    for line in iter(stream.readline, b''):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            yield None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(message, dict):
+            yield None, 'Expected JSON object'
+            continue
+        yield message, None
+
+
+class AnalyzerWorker:
+    """Модель в этом процессе: те же загрузка, кэши и движок батчинга, что у server.py
 
-def extract_analysis_from_output(output):
+    warmup - прогнать прогрев server.py (WARMUP_IMAGE_SIZES) до сообщения ready.
     """
-    Извлекает текст анализа из вывода FastVLM с исправлением кодировки
+
+    def __init__(self, writer, warmup=False):
+        sys.path.insert(0, SERVER_DIR)
+        import server
+        from config import Config
+
+        self.server = server
+        self.writer = writer
+        server.load_prompt()
+        server.init_result_cache()
+        if not server.load_model():
+            raise RuntimeError('Не удалось загрузить модель')
+        server.start_engine()
+        if warmup:
+            server.run_warmup()
+
+        # Запросов в работе не больше очереди движка, а одного пользователя - не больше его
+        # предела в очереди: остальные ждут в локальной очереди, а не получают 503/429.
+        # Чтение stdin при этом не останавливается, и ping получает ответ сразу
+        self.limit = Config.QUEUE_MAX_SIZE or Config.BATCH_SIZE * 4
+        self.user_limit = Config.USER_MAX_QUEUED
+        self.pool = ThreadPoolExecutor(max_workers=Config.DECODE_WORKERS, thread_name_prefix='analyzer-prepare')
+        self._backlog = collections.deque()
+        self._active = 0
+        self._active_users = collections.Counter()
+        self._idle = threading.Condition()
+
+    def serve(self, stream, announce=True):
+        """Читает запросы до конца потока, затем дожидается ответов на все начатые"""
+        if announce:
+            self.writer.write({
+                'op': 'ready', 'pid': os.getpid(), 'backend': self.server.runner.name, 'limit': self.limit
+            })
+
+        for message, error in read_messages(stream):
+            if error is not None:
+                self.writer.write({'id': None, 'success': False, 'error': error})
+                continue
+
+            op = message.get('op', 'analyze')
+            if op == 'ping':
+                self._ping(message.get('id'))
+            elif op == 'analyze':
+                with self._idle:
+                    self._backlog.append(message)
+                self._dispatch()
+            else:
+                self.writer.write({'id': message.get('id'), 'success': False, 'error': f'Unknown op: {op}'})
+
+        with self._idle:
+            self._idle.wait_for(lambda: not self._backlog and not self._active)
+        self.pool.shutdown(wait=True)
+        self.server.shutdown()
+
+    def _dispatch(self):
+        """Запускает запросы из локальной очереди по порядку, пока есть место в окне и у пользователя"""
+        with self._idle:
+            skipped = collections.deque()
+            while self._backlog and self._active < self.limit:
+                message = self._backlog.popleft()
+                user = self._user(message)
+                if user is not None and self.user_limit and self._active_users[user] >= self.user_limit:
+                    skipped.append(message)
+                    continue
+                self._active += 1
+                if user is not None:
+                    self._active_users[user] += 1
+                self.pool.submit(self._analyze, message)
+            self._backlog.extendleft(reversed(skipped))
+
+    @staticmethod
+    def _user(message):
+        user = message.get('user_id')
+        return None if user is None else str(user)
+
+    def _release(self, message):
+        with self._idle:
+            self._active -= 1
+            user = self._user(message)
+            if user is not None:
+                self._active_users[user] -= 1
+                if not self._active_users[user]:
+                    del self._active_users[user]
+            self._idle.notify_all()
+        self._dispatch()
+
+    def _ping(self, request_id):
+        """pong отправляется из потока движка: ответ придет, только если цикл генерации не завис"""
+        engine = self.server.engine
+        started = time.monotonic()
+
+        def pong(_future):
+            self.writer.write({
+                'id': request_id,
+                'op': 'pong',
+                'pid': os.getpid(),
+                'queue_depth': engine.queue_depth(),
+                'backlog': len(self._backlog),
+                'active': engine.active_count(),
+                'engine_ms': round((time.monotonic() - started) * 1000, 1)
+            })
+
+        engine.run_in_engine(lambda: None).add_done_callback(pong)
+
+    def _analyze(self, message):
+        """В пуле: decode, кэш результатов, препроцессинг и постановка в движок"""
+        try:
+            job = self.server.AnalysisJob({key: value for key, value in message.items() if key not in ('id', 'op')})
+            job.decode()
+            cached = job.cached_result()
+            if cached is not None:
+                self._respond(message, {
+                    'success': True, 'analysis': cached['analysis'], 'cached': True, 'image_hash': job.image_key
+                })
+                return
+            job.prepare()
+            gen_request = job.submit()
+        except Exception as e:
+            self._respond(message, self._error(e))
+            return
+
+        # Постобработка - снова в пуле, чтобы не занимать поток движка
+        gen_request.future.add_done_callback(
+            lambda _future: self.pool.submit(self._finish, message, job, gen_request)
+        )
+
+    def _finish(self, message, job, gen_request):
+        try:
+            analysis = job.finish(gen_request.result(), gen_request.finish_reason)
+        except Exception as e:
+            self._respond(message, self._error(e))
+            return
+        self._respond(message, {
+            'success': True, 'analysis': analysis, 'cached': False, 'image_hash': job.image_key,
+            'finish_reason': gen_request.finish_reason, 'timings': gen_request.timings()
+        })
+
+    def _respond(self, message, fields):
+        try:
+            self.writer.write({'id': message.get('id'), **fields})
+        finally:
+            self._release(message)
+
+    def _error(self, error):
+        """Ошибка запроса в тех же полях, что у ответов /analyze"""
+        server = self.server
+        if isinstance(error, server.QueueFullError):
+            return server.overloaded_fields(error)
+        fields = {'success': False, 'error': str(error)}
+        if isinstance(error, server.RequestError):
+            fields.update(status=error.status, **error.extra)
+        elif isinstance(error, server.DeadlineExceededError):
+            fields['stage'] = error.stage
+        else:
+            logger.error(f"Ошибка анализа: {error}", exc_info=error)
+        return fields
+
+
+class WorkerProcess:
+    """Процесс-воркер под супервизором: запуск, запись и чтение сообщений, ожидающие запросы по id
+
+    Сообщения воркеру пишет отдельный поток из очереди, поэтому ни поток чтения ответов,
+    ни супервизор не блокируются на заполненном канале stdin.
     """
-    try:
-        lines = output.strip().split('\n')
 
-        # Ищем последнюю строку с результатом (пропускаем предупреждения)
-        result_lines = []
-        for line in reversed(lines):
-            line = line.strip()
-            if line and not line.startswith('`torch_dtype`') and not line.startswith('The following'):
-                # Исправляем кодировку - заменяем мусорные символы
-                clean_line = line.encode('utf-8', errors='replace').decode('utf-8', errors='replace')
-                # Убираем повторяющиеся символы
-                clean_line = ' '.join(clean_line.split())
-                result_lines.insert(0, clean_line)
+    def __init__(self, index, command, on_change, on_exit):
+        self.index = index
+        self.command = command
+        self.on_change = on_change
+        self.on_exit = on_exit
 
-        # Берем последние несколько строк как результат
-        result_text = '\n'.join(result_lines[:10])  # Максимум 10 строк
+        self.process = None
+        self.pending = {}
+        self.ready = False
+        # Сколько запросов воркер держит в работе, не задерживая чтение stdin (из сообщения ready)
+        self.limit = 1
+        self.started_at = None
+        self.last_pong = None
+        self.last_ping = None
+        self.crashes = 0
+        self.restarts = 0
+        self.respawn_at = None
+        self._outbox = None
+        self._lock = threading.Lock()
 
-        if not result_text:
-            # Если не нашли, берем весь вывод
-            result_text = output.strip()
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=SERVER_DIR
+        )
+        self._outbox = queue.Queue()
+        self.ready = False
+        self.started_at = time.monotonic()
+        self.last_pong = self.last_ping = None
+        self.respawn_at = None
+        threading.Thread(
+            target=self._write, args=(self.process, self._outbox), name=f'analyzer-send-{self.index}', daemon=True
+        ).start()
+        threading.Thread(
+            target=self._read, args=(self.process, self._outbox), name=f'analyzer-recv-{self.index}', daemon=True
+        ).start()
+        logger.info(f"Воркер {self.index} запущен: pid {self.process.pid}")
 
-        return result_text
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
 
-    except Exception as e:
-        print(f"Ошибка при извлечении анализа: {e}")
-        return "Ошибка при обработке результатов анализа"
+    def outstanding(self):
+        with self._lock:
+            return len(self.pending)
 
-def main():
-    try:
-        # Читаем JSON данные из stdin
-        input_data = json.loads(sys.stdin.read())
-        
-        image_base64 = input_data['image_base64']
-        prompt = input_data.get('prompt', 'Опиши подробно какие предметы одежды ты видишь на этом изображении. Какой тип, цвет, стиль и материал? Пожалуйста, отвечай на русском языке, используя точные термины моды.')
-        
-        # Декодируем base64 в изображение
-        image_data = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Сохраняем изображение во временный файл
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            image.save(temp_file, 'JPEG')
-            temp_image_path = temp_file.name
-        
+    def available(self):
+        """Готов и может принять еще запрос"""
+        return self.ready and self.alive() and self.outstanding() < self.limit
+
+    def send(self, message, future):
+        with self._lock:
+            self.pending[message['id']] = future
+        self._outbox.put(message)
+
+    def ping(self):
+        self.last_ping = time.monotonic()
+        self._outbox.put({'id': None, 'op': 'ping'})
+
+    def kill(self, reason):
+        logger.warning(f"Воркер {self.index} (pid {self.process.pid}) остановлен: {reason}")
+        self.process.kill()
+
+    def close(self):
+        """Конец stdin после уже отправленных сообщений: воркер отвечает на начатые запросы и завершается"""
+        self._outbox.put(None)
+
+    def _write(self, process, outbox):
+        writer = LineWriter(process.stdin)
+        while True:
+            message = outbox.get()
+            if message is None:
+                break
+            writer.write(message)
         try:
-            # Определяем пути
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            project_root = os.path.join(current_dir, '../../..')
-            fastvlm_path = os.path.join(project_root, 'ml-fastvlm')
-            python_env = os.path.join(project_root, 'fastvlm_env', 'Scripts', 'python.exe')
-            
-            # Запускаем FastVLM через subprocess
-            cmd = [
-                python_env,
-                os.path.join(fastvlm_path, 'predict.py'),
-                '--image-file', temp_image_path,
-                '--prompt', prompt
-            ]
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                cwd=fastvlm_path,
-                timeout=60  # 60 секунд таймаут
-            )
-            
-            if result.returncode == 0:
-                # Извлекаем результат из вывода
-                analysis_text = extract_analysis_from_output(result.stdout)
-                
-                # Возвращаем успешный результат
-                response = {
-                    'success': True,
-                    'analysis': analysis_text
-                }
+            process.stdin.close()
+        except OSError:
+            pass
+
+    def _read(self, process, outbox):
+        for message, error in read_messages(process.stdout):
+            if error is not None:
+                logger.warning(f"Воркер {self.index}: {error}")
+                continue
+
+            op = message.get('op')
+            if op == 'ready':
+                self.limit = max(1, int(message.get('limit') or 1))
+                self.ready = True
+                self.last_pong = time.monotonic()
+                logger.info(f"Воркер {self.index} готов за {self.last_pong - self.started_at:.1f}с")
+                self.on_change()
+            elif op == 'pong':
+                self.last_pong = time.monotonic()
+            elif op == 'error':
+                logger.error(f"Воркер {self.index} не запустился: {message.get('error')}")
             else:
-                # Возвращаем ошибку
-                response = {
-                    'success': False,
-                    'error': f'FastVLM process failed: {result.stderr}'
-                }
-            
-        finally:
-            # Удаляем временный файл
+                with self._lock:
+                    future = self.pending.pop(message.get('id'), None)
+                if future is not None:
+                    future.set_result(message)
+                    self.on_change()
+
+        # stdout закрыт - процесс завершился: запросы без ответа получают ошибку
+        code = process.wait()
+        outbox.put(None)
+        self.ready = False
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        for request_id, future in pending.items():
+            future.set_result({
+                'id': request_id, 'success': False, 'error': f'FastVLM worker exited with code {code}',
+                'worker_crashed': True
+            })
+        self.on_exit(self, code)
+
+
+class WorkerPool:
+    """Супервизор небольшого пула воркеров: раздача запросов, пинги, перезапуск при падении
+
+    submit(сообщение) -> Future с ответом воркера. Запрос уходит готовому воркеру
+    с наименьшим числом ответов в ожидании, но не больше его limit: остальные ждут
+    в очереди пула (как и во время загрузки модели или перезапуска), а воркер всегда
+    читает stdin и сразу отвечает на ping. Зависший воркер (нет pong дольше ping_timeout)
+    убивается и перезапускается так же, как упавший; его запросы получают ошибку
+    с worker_crashed: true.
+    """
+
+    def __init__(self, size=1, python=None, ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT,
+                 startup_timeout=STARTUP_TIMEOUT):
+        self.command = [python or default_python(), os.path.abspath(__file__), '--worker']
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.startup_timeout = startup_timeout
+
+        self._backlog = collections.deque()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._closing = False
+
+        self.workers = [WorkerProcess(index, self.command, self._dispatch, self._on_exit) for index in range(size)]
+        for worker in self.workers:
+            worker.start()
+        self._monitor_thread = threading.Thread(target=self._monitor, name='analyzer-monitor', daemon=True)
+        self._monitor_thread.start()
+
+    def submit(self, message):
+        future = Future()
+        with self._lock:
+            self._backlog.append(({**message, 'id': next(self._ids)}, future))
+        self._dispatch()
+        return future
+
+    def stats(self):
+        return {
+            'backlog': len(self._backlog),
+            'restarts': sum(worker.restarts for worker in self.workers),
+            'workers': [{
+                'index': worker.index,
+                'pid': worker.process.pid if worker.alive() else None,
+                'ready': worker.ready,
+                'outstanding': worker.outstanding(),
+                'restarts': worker.restarts
+            } for worker in self.workers]
+        }
+
+    def close(self, timeout=30):
+        """Воркеры завершают начатые запросы; не успевшие за timeout секунд убиваются"""
+        self._closing = True
+        self._stop_event.set()
+        self._monitor_thread.join()
+        with self._lock:
+            backlog, self._backlog = self._backlog, collections.deque()
+        for message, future in backlog:
+            future.set_result({'id': message['id'], 'success': False, 'error': 'FastVLM worker pool closed'})
+        for worker in self.workers:
+            worker.close()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
             try:
-                os.unlink(temp_image_path)
-            except:
-                pass
-        
-        # Выводим результат в stdout
-        print(json.dumps(response, ensure_ascii=False))
-        
+                worker.process.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                worker.kill('не завершился при остановке пула')
+
+    def _dispatch(self):
+        """Раздает запросы из очереди пула свободным воркерам (наименее занятому первым)"""
+        with self._lock:
+            while self._backlog:
+                available = [worker for worker in self.workers if worker.available()]
+                if not available:
+                    return
+                worker = min(available, key=lambda worker: worker.outstanding())
+                message, future = self._backlog.popleft()
+                worker.send(message, future)
+
+    def _on_exit(self, worker, code):
+        if self._closing:
+            return
+        uptime = time.monotonic() - worker.started_at
+        worker.crashes = 1 if uptime >= STABLE_SECONDS else worker.crashes + 1
+        delay = min(RESPAWN_MAX_DELAY, RESPAWN_DELAY * 2 ** (worker.crashes - 1))
+        worker.respawn_at = time.monotonic() + delay
+        logger.error(f"Воркер {worker.index} завершился с кодом {code} через {uptime:.0f}с, перезапуск через {delay:.0f}с")
+
+    def _monitor(self):
+        while not self._stop_event.wait(1.0):
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.respawn_at is not None:
+                    if now >= worker.respawn_at:
+                        worker.restarts += 1
+                        worker.start()
+                elif not worker.alive():
+                    continue
+                elif not worker.ready:
+                    if now - worker.started_at > self.startup_timeout:
+                        worker.kill(f'нет ready за {self.startup_timeout:.0f}с')
+                elif now - worker.last_pong > self.ping_timeout:
+                    worker.kill(f'нет ответа на ping {now - worker.last_pong:.0f}с')
+                elif worker.last_ping is None or now - worker.last_ping >= self.ping_interval:
+                    worker.ping()
+
+
+def protocol_stdout():
+    """stdout только для протокола: print и логи библиотек дальше уходят в stderr"""
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return LineWriter(protocol)
+
+
+def start_worker(writer, warmup=False):
+    try:
+        return AnalyzerWorker(writer, warmup)
     except Exception as e:
-        # В случае любой ошибки возвращаем JSON с ошибкой
-        error_response = {
-            'success': False,
-            'error': str(e)
-        }
-        print(json.dumps(error_response, ensure_ascii=False))
+        logger.error(f"Ошибка загрузки модели: {e}", exc_info=True)
+        writer.write({'op': 'error', 'success': False, 'error': str(e)})
+        sys.exit(1)
+
+
+def run_worker():
+    writer = protocol_stdout()
+    start_worker(writer, warmup=True).serve(sys.stdin.buffer)
+
+
+def run_pool(size, python, ping_interval, ping_timeout):
+    """Супервизор с тем же протоколом на stdin/stdout; ping отвечает состоянием пула"""
+    writer = LineWriter(sys.stdout.buffer)
+    pool = WorkerPool(size, python, ping_interval=ping_interval, ping_timeout=ping_timeout)
+    futures = set()
+
+    def respond(future, client_id):
+        futures.discard(future)
+        writer.write({**future.result(), 'id': client_id})
+
+    try:
+        for message, error in read_messages(sys.stdin.buffer):
+            if error is not None:
+                writer.write({'id': None, 'success': False, 'error': error})
+            elif message.get('op') == 'ping':
+                writer.write({'id': message.get('id'), 'op': 'pong', 'pid': os.getpid(), **pool.stats()})
+            else:
+                future = pool.submit(message)
+                futures.add(future)
+                future.add_done_callback(lambda future, client_id=message.get('id'): respond(future, client_id))
+        wait(list(futures))
+    finally:
+        pool.close()
+
+
+def run_once():
+    """Прежний режим: один JSON-запрос на stdin, один JSON-ответ на stdout"""
+    writer = protocol_stdout()
+    data = sys.stdin.buffer.read()
+    start_worker(writer).serve(io.BytesIO(data.replace(b'\n', b' ') + b'\n'), announce=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воркер FastVLM: NDJSON-запросы анализа через stdin/stdout')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--worker', action='store_true', help='Один воркер с моделью в этом процессе')
+    mode.add_argument('--pool', type=int, metavar='N', help='Супервизор N воркеров с пингами и перезапуском')
+    parser.add_argument('--python', help='Интерпретатор воркеров (по умолчанию fastvlm_env, если есть)')
+    parser.add_argument('--ping-interval', type=float, default=PING_INTERVAL, help='Период пинга воркеров, секунды')
+    parser.add_argument('--ping-timeout', type=float, default=PING_TIMEOUT, help='Воркер без pong дольше - перезапуск')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.worker:
+        run_worker()
+    elif args.pool:
+        run_pool(args.pool, args.python, args.ping_interval, args.ping_timeout)
+    else:
+        run_once()
+
 
 if __name__ == '__main__':
     main()
@@ -7,12 +7,9 @@ FastVLM Server - постоянный сервер для анализа изо
 import sys
 import json
 import base64
-import tempfile
 import threading
 import time
 from flask import Flask, request, jsonify
-from PIL import Image
-import io
 import os
 
 # Импортируем необходимые модули
@@ -26,6 +23,15 @@ from llava.model.builder import load_pretrained_model
 from llava.mm_utils import tokenizer_image_token, process_images, get_model_name_from_path
 from llava.constants import IMAGE_TOKEN_INDEX, DEFAULT_IMAGE_TOKEN, DEFAULT_IM_START_TOKEN, DEFAULT_IM_END_TOKEN
 
+# Загрузка изображений - общая с fastvlm-server (draft/reduce, EXIF, MAX_IMAGE_SIZE)
+SERVER_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../fastvlm-server'))
+sys.path.insert(0, SERVER_DIR)
+from config import Config
+from imaging import load_image
+
+# Сторона входа FastViTHD: длинная сторона декодированного изображения не меньше нее
+IMAGE_SIZE = 1024
+
 app = Flask(__name__)
 
 # Глобальные переменные для модели
@@ -115,65 +121,52 @@ def analyze():
         image_base64 = data['image_base64']
         prompt = data.get('prompt', 'Опиши подробно какие предметы одежды ты видишь на этом изображении. Какой тип, цвет, стиль и материал? Пожалуйста, отвечай на русском языке, используя точные термины моды.')
 
-        # Декодируем изображение
+        # Декодируем изображение прямо из памяти
         image_data = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_data))
-
-        # Сохраняем во временный файл
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-            image.save(temp_file, 'JPEG')
-            temp_image_path = temp_file.name
-
-        try:
-            # Создаем промпт для модели
-            qs = prompt
-            if model.config.mm_use_im_start_end:
-                qs = DEFAULT_IM_START_TOKEN + DEFAULT_IMAGE_TOKEN + DEFAULT_IM_END_TOKEN + '\n' + qs
-            else:
-                qs = DEFAULT_IMAGE_TOKEN + '\n' + qs
-
-            conv = conv_templates["qwen_2"].copy()
-            conv.append_message(conv.roles[0], qs)
-            conv.append_message(conv.roles[1], None)
-            prompt_full = conv.get_prompt()
-
-            # Токенизируем промпт
-            input_ids = tokenizer_image_token(prompt_full, tokenizer, IMAGE_TOKEN_INDEX, return_tensors='pt').unsqueeze(0).to(model.device)
-
-            # Обрабатываем изображение
-            image_tensor = process_images([image], image_processor, model.config)[0]
-
-            # Выполняем анализ
-            with torch.no_grad():
-                output_ids = model.generate(
-                    input_ids,
-                    images=image_tensor.unsqueeze(0).to(model.device).half(),
-                    image_sizes=[image.size],
-                    do_sample=True,
-                    temperature=0.2,
-                    top_p=None,
-                    num_beams=1,
-                    max_new_tokens=256,
-                    use_cache=True
-                )
-
-            # Декодируем результат
-            result_text = tokenizer.batch_decode(output_ids, skip_special_tokens=True)[0].strip()
-
-            # Извлекаем чистый анализ
-            clean_analysis = extract_analysis_from_output(result_text)
+        image = load_image(image_data, target_size=IMAGE_SIZE, max_size=Config.MAX_IMAGE_SIZE)
+
+        # Создаем промпт для модели
+        qs = prompt
+        if model.config.mm_use_im_start_end:
+            qs = DEFAULT_IM_START_TOKEN + DEFAULT_IMAGE_TOKEN + DEFAULT_IM_END_TOKEN + '\n' + qs
+        else:
+            qs = DEFAULT_IMAGE_TOKEN + '\n' + qs
+
+        conv = conv_templates["qwen_2"].copy()
+        conv.append_message(conv.roles[0], qs)
+        conv.append_message(conv.roles[1], None)
+        prompt_full = conv.get_prompt()
+
+        # Токенизируем промпт
+        input_ids = tokenizer_image_token(prompt_full, tokenizer, IMAGE_TOKEN_INDEX, return_tensors='pt').unsqueeze(0).to(model.device)
+
+        # Обрабатываем изображение
+        image_tensor = process_images([image], image_processor, model.config)[0]
+
+        # Выполняем анализ
+        with torch.no_grad():
+            output_ids = model.generate(
+                input_ids,
+                images=image_tensor.unsqueeze(0).to(model.device).half(),
+                image_sizes=[image.size],
+                do_sample=True,
+                temperature=0.2,
+                top_p=None,
+                num_beams=1,
+                max_new_tokens=256,
+                use_cache=True
+            )
+
+        # Декодируем результат
+        result_text = tokenizer.batch_decode(output_ids, skip_special_tokens=True)[0].strip()
+
+        # Извлекаем чистый анализ
+        clean_analysis = extract_analysis_from_output(result_text)
 
-            return jsonify({
-                'success': True,
-                'analysis': clean_analysis
-            })
-
-        finally:
-            # Удаляем временный файл
-            try:
-                os.unlink(temp_image_path)
-            except:
-                pass
+        return jsonify({
+            'success': True,
+            'analysis': clean_analysis
+        })
 
     except Exception as e:
         print(f"Ошибка анализа: {e}")